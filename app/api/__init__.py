@@ -1,7 +1,10 @@
 from fastapi import APIRouter
 
-from app.api.endpoints import users_router
+from app.api.endpoints import admin_router, users_bulk_router, users_router
 
 
 api_router = APIRouter()
+# registered first so that /users/bulk is not taken for a /users/{user_id}
+api_router.include_router(users_bulk_router, prefix="/users", tags=["users"])
 api_router.include_router(users_router, prefix="/users", tags=["users"])
+api_router.include_router(admin_router, prefix="/admin", tags=["admin"])
@@ -1,4 +1,12 @@
+from .admin import router as admin_router
+from .metrics import router as metrics_router
 from .users import router as users_router
+from .users_bulk import router as users_bulk_router
 
 
-__all__ = ["users_router"]
+__all__ = [
+    "admin_router",
+    "metrics_router",
+    "users_bulk_router",
+    "users_router",
+]
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+
+from app.schemas import UserPurgeBacklog
+from app.services.purge import user_purger
+
+
+router: APIRouter = APIRouter()
+
+
+@router.get("/users/purge", response_model=UserPurgeBacklog)
+async def get_user_purge_backlog():
+    """
+    The soft deleted users waiting for the purge to move them to the
+    archive, see ``USERS_DELETED_RETENTION_DAYS``.
+    """
+    return UserPurgeBacklog.parse_obj(await user_purger.get_backlog())
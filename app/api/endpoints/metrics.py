@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Response
+
+from app.metrics import CONTENT_TYPE, collect, metrics_store, render
+
+
+router: APIRouter = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Metrics of every worker when a multiprocess directory is configured,
+    otherwise only the ones of the worker answering.
+    """
+    return Response(
+        content=render(
+            metrics_store.collect() if metrics_store is not None else collect()
+        ),
+        media_type=CONTENT_TYPE,
+    )
@@ -1,30 +1,354 @@
-from typing import List, Optional
+from datetime import datetime
+from json import dumps
+from typing import AsyncIterator, Dict, List, NoReturn, Optional, Tuple, Union
+from uuid import UUID
 
-from fastapi import APIRouter, HTTPException, status
-from fastapi.responses import PlainTextResponse
+from fastapi import (
+    APIRouter,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from tortoise.backends.base.client import BaseDBAsyncClient
 from tortoise.contrib.fastapi import HTTPNotFoundError
 from tortoise.exceptions import IntegrityError
+from tortoise.query_utils import Q
+from tortoise.queryset import QuerySet
+from tortoise.transactions import in_transaction
 
+from app.config import settings
+from app.db import PRIMARY_CONNECTION
 from app.db.exceptions import UsernameAlreadyInUseError
-from app.db.models import User
+from app.db.models import ProfileImageStatus, User, UserChangeType
+from app.db.queries import (
+    get_usernames_by_prefix,
+    record_user_changes,
+    search_users,
+    soft_delete_user,
+    update_user_columns,
+)
+from app.db.routing import replica_router
 from app.schemas import (
     CreateUser,
     DisplayUser,
     UpdateUser,
+    UserChangesPage,
     UsernameAlreadyInUseErrorMessage,
+    UsernameAvailability,
+)
+from app.services.cache import (
+    CachedPayload,
+    CachedResponse,
+    user_cache,
+    users_list_cache,
+)
+from app.services.changes import (
+    Change,
+    change_relay,
+    render_change_events,
+    render_changes_page,
+)
+from app.services.compression import response_compression
+from app.services.export import (
+    get_export_start,
+    get_snapshot_checkpoint,
+    stream_modified_users,
+    stream_snapshot,
+)
+from app.services.images import profile_image_ingestor
+from app.services.loader import user_loader
+from app.services.usernames import (
+    is_username_taken,
+    username_filter,
+    username_index,
+)
+from app.utils import (
+    DISPLAY_USER_FIELDS,
+    decode_cursor,
+    encode_cursor,
+    format_http_date,
+    get_display_user_dict,
+    get_user_etag,
+    get_users_etag,
+    is_not_modified,
+    matches_entity_tag,
+    process_user_upsert_info,
+    render_display_user,
+    render_display_users,
 )
-from app.utils import get_utc_now, process_user_upsert_info
 
 
 router: APIRouter = APIRouter()
 
+NDJSON_MEDIA_TYPE: str = "application/x-ndjson"
+EVENT_STREAM_MEDIA_TYPE: str = "text/event-stream"
+CSV_MEDIA_TYPE: str = "text/csv"
+
+
+def get_active_users_page(
+    after: Optional[Tuple[datetime, UUID]],
+    limit: int,
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> QuerySet[User]:
+    queryset: QuerySet[User] = User.filter(deleted_at__isnull=True).using_db(
+        connection
+    )
+
+    if after:
+        created_at, user_id = after
+        # the redundant lower bound on created_at is what lets postgres
+        #  start the index scan at the cursor instead of filtering its way
+        #  to it from the first row
+        queryset = queryset.filter(
+            Q(created_at__gte=created_at),
+            Q(created_at__gt=created_at) | Q(id__gt=user_id),
+        )
+
+    return queryset.order_by("created_at", "id").limit(limit)
 
-@router.get("", response_model=List[DisplayUser])
-async def list_users():
-    return [
-        DisplayUser.from_orm(user)
-        for user in await User.exclude(deleted_at__not_isnull=True).all()
-    ]
+
+def get_users_validators(rows: List[Dict]) -> Dict[str, str]:
+    validators: Dict[str, str] = {"ETag": get_users_etag(rows)}
+
+    if rows:
+        validators["Last-Modified"] = format_http_date(
+            max(row["modified_at"] for row in rows)
+        )
+
+    return validators
+
+
+def render_users_response(
+    request: Request, rows: List[Dict], headers: Dict[str, str]
+) -> Response:
+    """
+    Renders the users, unless the client already has them, as told by its
+    conditional headers.
+    """
+    validators: Dict[str, str] = get_users_validators(rows)
+
+    if rows and is_not_modified(
+        request.headers,
+        validators["ETag"],
+        max(row["modified_at"] for row in rows),
+    ):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=validators
+        )
+
+    # rendered straight from the rows, the response model is only used for
+    #  the docs
+    return Response(
+        content=render_display_users(rows),
+        media_type="application/json",
+        headers={**headers, **validators},
+    )
+
+
+async def render_users_payload(
+    rows: List[Dict], headers: Dict[str, str], encoding: Optional[str]
+) -> CachedPayload:
+    body: bytes = render_display_users(rows)
+    headers = {**headers, **get_users_validators(rows)}
+
+    if encoding and len(body) >= response_compression.minimum_size:
+        body = await response_compression.compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+
+    return CachedPayload(
+        body=body,
+        headers=headers,
+        modified_at=max(row["modified_at"] for row in rows) if rows else None,
+    )
+
+
+def send_users_payload(request: Request, payload: CachedPayload) -> Response:
+    etag: str = payload.headers["ETag"]
+
+    if payload.modified_at and is_not_modified(
+        request.headers, etag, payload.modified_at
+    ):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={
+                "ETag": etag,
+                "Last-Modified": payload.headers["Last-Modified"],
+            },
+        )
+
+    headers: Dict[str, str] = dict(payload.headers)
+    encoding: Optional[str] = headers.get("Content-Encoding")
+    if encoding:
+        headers["ETag"] = response_compression.encode_etag(etag, encoding)
+
+    return Response(
+        content=payload.body, media_type="application/json", headers=headers
+    )
+
+
+async def load_users_page(
+    request: Request, after: Optional[Tuple[datetime, UUID]], limit: int
+) -> Tuple[List[Dict], Dict[str, str]]:
+    """
+    Fetches a page of users, along with the headers linking to the next one.
+    """
+    # fetching one extra row tells us whether there is a next page
+    rows: List[Dict] = await replica_router.read(
+        lambda connection: get_active_users_page(
+            after=after, limit=limit + 1, connection=connection
+        ).values(*DISPLAY_USER_FIELDS)
+    )
+    headers: Dict[str, str] = {}
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor: str = encode_cursor(
+            rows[-1]["created_at"], rows[-1]["id"]
+        )
+        next_url = request.url.include_query_params(
+            cursor=next_cursor, limit=limit
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+        headers["X-Next-Cursor"] = next_cursor
+
+    return rows, headers
+
+
+async def stream_users(
+    after: Optional[Tuple[datetime, UUID]]
+) -> AsyncIterator[str]:
+    while True:
+        rows: List[Dict] = await replica_router.read(
+            lambda connection: get_active_users_page(
+                after=after,
+                limit=settings.USERS_STREAM_BATCH_SIZE,
+                connection=connection,
+            ).values(*DISPLAY_USER_FIELDS)
+        )
+
+        # same bytes as ``DisplayUser.json(by_alias=True)`` used to produce
+        for row in rows:
+            yield dumps(get_display_user_dict(row)) + "\n"
+
+        if len(rows) < settings.USERS_STREAM_BATCH_SIZE:
+            return
+
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+async def fetch_users(request: Request, ids: List[str]) -> Response:
+    # a dict, to drop duplicates while keeping the order
+    user_ids: Dict[UUID, None] = {}
+
+    for user_id in ",".join(ids).split(","):
+        try:
+            user_ids[UUID(user_id.strip())] = None
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Invalid user id "{user_id}".',
+            )
+
+    if len(user_ids) > settings.USERS_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                f"At most {settings.USERS_MAX_PAGE_SIZE} users can be "
+                "fetched at once."
+            ),
+        )
+
+    # each id goes through the loader, so that the lookups of concurrent
+    #  requests end up in the same queries as these
+    rows: List[Optional[Dict]] = await user_loader.load_all(list(user_ids))
+
+    return render_users_response(
+        request,
+        [row for row in rows if row and row["deleted_at"] is None],
+        headers={},
+    )
+
+
+@router.get(
+    "",
+    response_model=List[DisplayUser],
+    responses={
+        status.HTTP_200_OK: {
+            "content": {NDJSON_MEDIA_TYPE: {}},
+            "description": (
+                "A page of users, or every user after the cursor as "
+                "newline delimited JSON when streaming. When ``ids`` are "
+                "given, the ones of these users that exist, in order."
+            ),
+        },
+    },
+)
+async def list_users(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(
+        settings.USERS_PAGE_SIZE, ge=1, le=settings.USERS_MAX_PAGE_SIZE
+    ),
+    stream: bool = False,
+    ids: Optional[List[str]] = Query(
+        None,
+        description=(
+            "Fetches these users instead of a page, given comma separated "
+            "and/or as repeated parameters."
+        ),
+    ),
+):
+    if ids:
+        return await fetch_users(request, ids)
+
+    try:
+        after: Optional[Tuple[datetime, UUID]] = (
+            decode_cursor(cursor) if cursor else None
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        )
+
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_users(after=after), media_type=NDJSON_MEDIA_TYPE
+        )
+
+    if not users_list_cache.enabled:
+        rows, headers = await load_users_page(request, after, limit)
+        return render_users_response(request, rows, headers)
+
+    encoding: Optional[str] = response_compression.choose_encoding(
+        request.headers.get("accept-encoding")
+    )
+    key: Tuple = (str(request.base_url), cursor, limit, encoding)
+    payload: Optional[CachedPayload] = users_list_cache.get(key)
+
+    if payload is None:
+        version: int = users_list_cache.version
+        rows, headers = await load_users_page(request, after, limit)
+        payload = await render_users_payload(rows, headers, encoding)
+        users_list_cache.set(key, payload, version=version)
+
+    return send_users_payload(request, payload)
+
+
+def get_username_in_use_error(username: str) -> UsernameAlreadyInUseError:
+    return UsernameAlreadyInUseError(
+        status_code=status.HTTP_409_CONFLICT,
+        msg=f'The username "{username}" is already in use.',
+    )
 
 
 @router.post(
@@ -32,50 +356,420 @@ async def list_users():
     response_model=DisplayUser,
     status_code=status.HTTP_201_CREATED,
     responses={
-        status.HTTP_409_CONFLICT: {"model": UsernameAlreadyInUseErrorMessage}
+        status.HTTP_202_ACCEPTED: {
+            "model": DisplayUser,
+            "description": "User created, profile image still being processed",
+        },
+        status.HTTP_409_CONFLICT: {"model": UsernameAlreadyInUseErrorMessage},
     },
 )
-async def create_user(user_in: CreateUser):
+async def create_user(
+    user_in: CreateUser,
+    response: Response,
+    defer_image_processing: bool = settings.PROFILE_IMAGE_DEFER_PROCESSING,
+):
+    # rejected before paying for the password hash and the profile image,
+    #  the unique constraint still catching the usernames taken meanwhile
+    if await is_username_taken(user_in.username):
+        raise get_username_in_use_error(user_in.username)
+
+    user_info: Dict = await process_user_upsert_info(
+        upsert_user=user_in, defer_image_processing=defer_image_processing
+    )
+
     try:
-        return DisplayUser.from_orm(
-            await User.create(**process_user_upsert_info(upsert_user=user_in))
-        )
+        async with in_transaction(PRIMARY_CONNECTION) as connection:
+            user: User = await User.create(using_db=connection, **user_info)
+            await record_user_changes(
+                UserChangeType.CREATED, [user.id], connection
+            )
     except IntegrityError as e:
+        # the reference taken on the image would otherwise never be released
+        await release_unused_profile_image(user_info)
+
         if e.args[0].constraint_name != "user_username_key":
             raise e
 
-        raise UsernameAlreadyInUseError(
-            status_code=status.HTTP_409_CONFLICT,
-            msg=f'The username "{user_in.username}" is already in use.',
+        raise get_username_in_use_error(user_in.username)
+
+    replica_router.mark_written(str(user.id))
+    users_list_cache.bump_version()
+    username_index.add(user.username)
+    username_filter.add(user.username)
+
+    if user.profile_image_status == ProfileImageStatus.PENDING:
+        profile_image_ingestor.enqueue(user_id=user.id, url=user.profile_image)
+        response.status_code = status.HTTP_202_ACCEPTED
+
+    return DisplayUser.from_orm(user)
+
+
+@router.get("/search", response_model=List[DisplayUser])
+async def find_users(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(
+        settings.USERS_SEARCH_LIMIT, ge=1, le=settings.USERS_SEARCH_MAX_LIMIT
+    ),
+):
+    rows: List[Dict] = await replica_router.read(
+        lambda connection: search_users(q, limit, connection=connection)
+    )
+
+    return render_users_response(request, rows, headers={})
+
+
+@router.get("/autocomplete", response_model=List[str])
+async def autocomplete_usernames(
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(
+        settings.USERS_SEARCH_LIMIT, ge=1, le=settings.USERS_SEARCH_MAX_LIMIT
+    ),
+):
+    if username_index.ready:
+        return username_index.search(q, limit)
+
+    return await replica_router.read(
+        lambda connection: get_usernames_by_prefix(
+            q, limit, connection=connection
         )
+    )
+
+
+@router.api_route(
+    "/username-available/{username}",
+    methods=["GET", "HEAD"],
+    response_model=UsernameAvailability,
+    responses={
+        status.HTTP_409_CONFLICT: {
+            "model": UsernameAvailability,
+            "description": "The username is already in use",
+        },
+    },
+)
+async def check_username_availability(
+    username: str = Path(..., min_length=2, max_length=24),
+):
+    # always looked up, the filter of this worker misses the usernames
+    #  taken through the others since its last reload
+    available: bool = not await is_username_taken(username, use_filter=False)
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK
+        if available
+        else status.HTTP_409_CONFLICT,
+        content=UsernameAvailability(
+            username=username, available=available
+        ).dict(by_alias=True),
+    )
 
 
-async def get_user_by_id(user_id: str) -> User:
-    user: Optional[User] = await User.filter(id=user_id).first()
+@router.get(
+    "/export",
+    responses={
+        status.HTTP_200_OK: {
+            "content": {NDJSON_MEDIA_TYPE: {}, CSV_MEDIA_TYPE: {}},
+            "description": (
+                "The users modified since ``modified_since``, or after the "
+                "``cursor`` of an earlier export, deleted ones as "
+                "tombstones, in the order they were modified. Each batch "
+                "is followed by a ``checkpoint`` line, the cursor to resume "
+                "from. A ``snapshot`` is every active user, as NDJSON or "
+                "CSV, the cursor to resume from given as "
+                "``X-Export-Checkpoint``."
+            ),
+        },
+    },
+)
+async def export_users(
+    modified_since: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    snapshot: bool = False,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+):
+    if snapshot:
+        if modified_since or cursor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="A snapshot is of every user, it can not be resumed.",
+            )
 
-    if not user:
+        return StreamingResponse(
+            stream_snapshot(format),
+            media_type=CSV_MEDIA_TYPE
+            if format == "csv"
+            else NDJSON_MEDIA_TYPE,
+            headers={"X-Export-Checkpoint": get_snapshot_checkpoint()},
+        )
+
+    if format != "ndjson":
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with id {user_id} was not found",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only snapshots can be exported as CSV.",
         )
 
-    if user.deleted_at:
+    try:
+        after: Tuple[datetime, UUID] = (
+            decode_cursor(cursor)
+            if cursor
+            else get_export_start(modified_since)
+        )
+    except ValueError as e:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with id {user_id} has been deleted.",
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
         )
 
-    return user
+    return StreamingResponse(
+        stream_modified_users(after=after), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+async def stream_user_changes(after: int) -> AsyncIterator[str]:
+    while True:
+        changes: List[Change] = await change_relay.read(
+            after,
+            limit=settings.CHANGES_BATCH_SIZE,
+            timeout=settings.CHANGES_KEEPALIVE_INTERVAL,
+        )
+
+        if not changes:
+            # keeps proxies from closing the idle connection
+            yield ": keep-alive\n\n"
+            continue
+
+        yield render_change_events(changes)
+        after = changes[-1].seq
+
+
+@router.get(
+    "/changes",
+    response_model=UserChangesPage,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {EVENT_STREAM_MEDIA_TYPE: {}},
+            "description": (
+                "The changes made to users after ``since``, in the order "
+                "they were committed, waiting up to ``wait`` seconds for "
+                "some when there are none yet. Streamed as server-sent "
+                "events, resuming after any ``Last-Event-ID``, when asked "
+                "for."
+            ),
+        },
+    },
+)
+async def list_user_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(
+        settings.USERS_PAGE_SIZE, ge=1, le=settings.USERS_MAX_PAGE_SIZE
+    ),
+    wait: float = Query(0, ge=0, le=settings.CHANGES_MAX_WAIT),
+    last_event_id: Optional[int] = Header(None, ge=0),
+):
+    if EVENT_STREAM_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_user_changes(
+                after=since if last_event_id is None else last_event_id
+            ),
+            media_type=EVENT_STREAM_MEDIA_TYPE,
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    changes: List[Change] = await change_relay.read(
+        since, limit=limit, timeout=wait
+    )
+
+    return Response(
+        content=render_changes_page(changes, since),
+        media_type="application/json",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def get_user_not_found_detail(user_id: str, deleted: bool) -> str:
+    if deleted:
+        return f"User with id {user_id} has been deleted."
+
+    return f"User with id {user_id} was not found"
+
+
+async def raise_user_not_found(
+    user_id: str, connection: Optional[BaseDBAsyncClient] = None
+) -> NoReturn:
+    # only a miss pays for the extra query telling deleted users apart
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=get_user_not_found_detail(
+            user_id,
+            deleted=await User.filter(id=user_id)
+            .using_db(connection)
+            .exists(),
+        ),
+    )
+
+
+async def load_user_response(user_id: str) -> CachedResponse:
+    try:
+        row: Optional[Dict] = await user_loader.load(UUID(user_id))
+    except ValueError:
+        row = None
+
+    if row and row["deleted_at"] is None:
+        return CachedResponse(
+            status_code=status.HTTP_200_OK,
+            body=render_display_user(row),
+            modified_at=row["modified_at"],
+        )
+
+    return CachedResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        body=get_user_not_found_detail(
+            user_id, deleted=row is not None
+        ).encode("utf-8"),
+    )
+
+
+async def load_user_modified_at(user_id: str) -> Optional[datetime]:
+    try:
+        UUID(user_id)
+    except ValueError:
+        return None
+
+    return await replica_router.read(
+        lambda connection: User.filter(id=user_id, deleted_at__isnull=True)
+        .using_db(connection)
+        .first()
+        .values_list("modified_at", flat=True),
+        key=user_id,
+    )
+
+
+def get_user_validators(
+    user_id: Union[UUID, str], modified_at: datetime
+) -> Dict[str, str]:
+    return {
+        "ETag": get_user_etag(user_id, modified_at),
+        "Last-Modified": format_http_date(modified_at),
+    }
 
 
 @router.get(
     "/{user_id}",
     response_model=DisplayUser,
     status_code=status.HTTP_200_OK,
-    responses={status.HTTP_404_NOT_FOUND: {"model": HTTPNotFoundError}},
+    responses={
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "The user did not change since the client got it"
+        },
+        status.HTTP_404_NOT_FOUND: {"model": HTTPNotFoundError},
+    },
 )
-async def get_user(user_id: str):
-    return DisplayUser.from_orm(await get_user_by_id(user_id))
+async def get_user(user_id: str, request: Request):
+    cached_response: Optional[CachedResponse] = await user_cache.get(user_id)
+    modified_at: Optional[datetime] = (
+        cached_response.modified_at if cached_response else None
+    )
+
+    # on a miss, a conditional request first checks whether the user changed,
+    #  which skips loading and rendering the user when it did not
+    if cached_response is None and (
+        "if-none-match" in request.headers
+        or "if-modified-since" in request.headers
+    ):
+        modified_at = await load_user_modified_at(user_id)
+
+    if modified_at is not None and is_not_modified(
+        request.headers, get_user_etag(user_id, modified_at), modified_at
+    ):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers=get_user_validators(user_id, modified_at),
+        )
+
+    if cached_response is None:
+        cached_response = await user_cache.load(
+            user_id, loader=lambda: load_user_response(user_id)
+        )
+
+    if cached_response.status_code == status.HTTP_404_NOT_FOUND:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=cached_response.body.decode("utf-8"),
+        )
+
+    return Response(
+        content=cached_response.body,
+        media_type="application/json",
+        headers=get_user_validators(user_id, cached_response.modified_at),
+    )
+
+
+def check_if_match(
+    user_id: Union[UUID, str],
+    if_match: Optional[str],
+    modified_at: Optional[datetime],
+):
+    if if_match is None:
+        return
+
+    if modified_at is None or not matches_entity_tag(
+        if_match, get_user_etag(user_id, modified_at)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail=f"User with id {user_id} does not match If-Match.",
+        )
+
+
+async def get_precondition_modified_at(
+    user_id: UUID, if_match: Optional[str]
+) -> Optional[datetime]:
+    """
+    The ``modified_at`` the user has to still have when written, checked
+    against ``if_match`` beforehand, None without ``if_match``.
+    """
+    if if_match is None:
+        return None
+
+    modified_at: Optional[datetime] = (
+        await User.filter(id=user_id, deleted_at__isnull=True)
+        .first()
+        .values_list("modified_at", flat=True)
+    )
+    if modified_at is None:
+        await raise_user_not_found(str(user_id))
+
+    check_if_match(user_id, if_match, modified_at)
+    return modified_at
+
+
+async def check_user_written(
+    user_id: UUID, if_match: Optional[str], previous: Optional[Dict]
+):
+    """
+    Raises why a write answering with ``previous``, the user as it was
+    once locked, did not go through, if anything but the user already being
+    as requested kept it from it.
+    """
+    if previous is None:
+        await raise_user_not_found(str(user_id))
+
+    check_if_match(user_id, if_match, previous["modified_at"])
+
+
+async def release_unused_profile_image(user_info: Dict):
+    if user_info.get("profile_image_status") == ProfileImageStatus.READY:
+        await profile_image_ingestor.release(user_info["profile_image"])
+
+
+def parse_user_id(user_id: str) -> UUID:
+    try:
+        return UUID(user_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=get_user_not_found_detail(user_id, deleted=False),
+        )
 
 
 @router.put(
@@ -85,41 +779,105 @@ async def get_user(user_id: str):
     responses={
         status.HTTP_404_NOT_FOUND: {"model": HTTPNotFoundError},
         status.HTTP_409_CONFLICT: {"model": UsernameAlreadyInUseErrorMessage},
+        status.HTTP_412_PRECONDITION_FAILED: {"model": HTTPNotFoundError},
     },
 )
-async def update_user(user_id: str, updated_user: UpdateUser):
-    user: User = await get_user_by_id(user_id)
+async def update_user(
+    user_id: str,
+    updated_user: UpdateUser,
+    defer_image_processing: bool = settings.PROFILE_IMAGE_DEFER_PROCESSING,
+    if_match: Optional[str] = Header(None),
+):
+    user_uuid: UUID = parse_user_id(user_id)
+    # checked before downloading any new profile image, then again in the
+    #  update
+    modified_at: Optional[datetime] = await get_precondition_modified_at(
+        user_uuid, if_match
+    )
 
-    user = await user.update_from_dict(
-        process_user_upsert_info(
-            upsert_user=updated_user,
-            user=user,
-        )
+    if updated_user.username and await is_username_taken(
+        updated_user.username, user_id=user_uuid
+    ):
+        raise get_username_in_use_error(updated_user.username)
+
+    user_info: Dict = await process_user_upsert_info(
+        upsert_user=updated_user,
+        defer_image_processing=defer_image_processing,
     )
-    
-    try:
-        await user.save()
-    except IntegrityError as e:
-        if e.args[0].constraint_name != "user_username_key":
-            raise e
 
-        raise UsernameAlreadyInUseError(
-            status_code=status.HTTP_409_CONFLICT,
-            msg=f'The username "{updated_user.username}" is already in use.',
+    # a single statement, only writing the user when a column changes
+    try:
+        previous, updated = await update_user_columns(
+            user_uuid,
+            user_info,
+            event=UserChangeType.UPDATED,
+            modified_at=modified_at,
         )
+        await check_user_written(user_uuid, if_match, previous)
+    except (HTTPException, IntegrityError) as e:
+        await release_unused_profile_image(user_info)
 
-    return DisplayUser.from_orm(user)
+        if (
+            isinstance(e, IntegrityError)
+            and e.args[0].constraint_name == "user_username_key"
+        ):
+            raise get_username_in_use_error(updated_user.username)
+
+        raise e
+
+    # the reference of the image replaced, or the extra one an unchanged
+    #  image just got
+    if "profile_image" in user_info and (
+        previous["profile_image_status"] == ProfileImageStatus.READY
+    ):
+        await profile_image_ingestor.release(previous["profile_image"])
+
+    if updated is not None:
+        replica_router.mark_written(user_id)
+        users_list_cache.bump_version()
+        username_index.rename(previous["username"], updated["username"])
+        username_filter.add(updated["username"])
+        await user_cache.invalidate(user_id)
+
+        if updated_user.profile_image and (
+            updated["profile_image_status"] == ProfileImageStatus.PENDING
+        ):
+            profile_image_ingestor.enqueue(
+                user_id=user_uuid, url=updated["profile_image"]
+            )
+
+    user: Dict = updated or previous
+
+    return Response(
+        content=render_display_user(user),
+        media_type="application/json",
+        headers=get_user_validators(user_uuid, user["modified_at"]),
+    )
 
 
 @router.delete(
     "/{user_id}",
-    responses={status.HTTP_404_NOT_FOUND: {"model": HTTPNotFoundError}},
+    responses={
+        status.HTTP_404_NOT_FOUND: {"model": HTTPNotFoundError},
+        status.HTTP_412_PRECONDITION_FAILED: {"model": HTTPNotFoundError},
+    },
     status_code=status.HTTP_204_NO_CONTENT,
 )
-async def delete_user(user_id: str):
-    user = await get_user_by_id(user_id)
-    user.deleted_at = get_utc_now()
-    await user.save(update_fields=["deleted_at"])
+async def delete_user(user_id: str, if_match: Optional[str] = Header(None)):
+    user_uuid: UUID = parse_user_id(user_id)
+    previous, _ = await soft_delete_user(
+        user_uuid,
+        modified_at=await get_precondition_modified_at(user_uuid, if_match),
+    )
+    await check_user_written(user_uuid, if_match, previous)
+
+    replica_router.mark_written(user_id)
+    users_list_cache.bump_version()
+    username_index.remove(previous["username"])
+    await user_cache.invalidate(user_id)
+
+    if previous["profile_image_status"] == ProfileImageStatus.READY:
+        await profile_image_ingestor.release(previous["profile_image"])
 
     return PlainTextResponse(
         content=f"Deleted user {user_id}",
@@ -0,0 +1,350 @@
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from fastapi import APIRouter, Body, status
+from pydantic import conlist
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
+
+from app.config import settings
+from app.db import PRIMARY_CONNECTION
+from app.db.models import ProfileImageStatus, UserChangeType
+from app.db.queries import (
+    bulk_insert_users,
+    bulk_soft_delete_users,
+    bulk_update_users,
+    find_taken_usernames,
+    record_user_changes,
+)
+from app.db.routing import replica_router
+from app.schemas import BulkUpdateUser, BulkUserResult, CreateUser, DisplayUser
+from app.services import (
+    password_hasher,
+    profile_image_ingestor,
+    user_cache,
+    username_filter,
+    username_index,
+    users_list_cache,
+)
+
+
+router: APIRouter = APIRouter()
+
+
+def username_conflict(
+    index: int, username: str, user_id: Optional[UUID] = None
+) -> BulkUserResult:
+    return BulkUserResult(
+        index=index,
+        id=user_id,
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f'The username "{username}" is already in use.',
+    )
+
+
+async def insert_users(users: List[Dict]) -> List[Dict]:
+    async with in_transaction(PRIMARY_CONNECTION) as connection:
+        inserted_users: List[Dict] = await bulk_insert_users(users, connection)
+        await record_user_changes(
+            UserChangeType.CREATED,
+            [user["id"] for user in inserted_users],
+            connection,
+        )
+
+    return inserted_users
+
+
+@router.post(
+    "/bulk",
+    response_model=List[BulkUserResult],
+    status_code=status.HTTP_200_OK,
+)
+async def bulk_create_users(
+    users_in: conlist(
+        CreateUser, min_items=1, max_items=settings.USERS_BULK_MAX_SIZE
+    ),
+):
+    """
+    Creates every user of the batch, answering with one result per user.
+    Profile images are always processed in the background.
+    """
+    results: List[Optional[BulkUserResult]] = [None] * len(users_in)
+    taken_usernames: Dict[str, UUID] = await find_taken_usernames(
+        [user_in.username for user_in in users_in]
+    )
+
+    # known conflicts are weeded out before paying for their password hash
+    to_insert: Dict[str, int] = {}
+    for index, user_in in enumerate(users_in):
+        if (
+            user_in.username in taken_usernames
+            or user_in.username in to_insert
+        ):
+            results[index] = username_conflict(index, user_in.username)
+        else:
+            to_insert[user_in.username] = index
+
+    hashed_passwords: List[str] = await password_hasher.hash_many(
+        [
+            users_in[index].password.get_secret_value()
+            for index in to_insert.values()
+        ]
+    )
+
+    inserted_users: List[Dict] = (
+        await insert_users(
+            [
+                {
+                    "id": uuid4(),
+                    "username": users_in[index].username,
+                    "first_name": users_in[index].first_name,
+                    "last_name": users_in[index].last_name,
+                    "password": hashed_password,
+                    "profile_image": str(users_in[index].profile_image),
+                    "profile_image_status": ProfileImageStatus.PENDING.value,
+                }
+                for index, hashed_password in zip(
+                    to_insert.values(), hashed_passwords
+                )
+            ]
+        )
+        if to_insert
+        else []
+    )
+
+    for user in inserted_users:
+        index: int = to_insert.pop(user["username"])
+        results[index] = BulkUserResult(
+            index=index,
+            id=user["id"],
+            status_code=status.HTTP_201_CREATED,
+            user=DisplayUser.parse_obj(user),
+        )
+        replica_router.mark_written(str(user["id"]))
+        users_list_cache.bump_version()
+        username_index.add(user["username"])
+        username_filter.add(user["username"])
+        profile_image_ingestor.enqueue(
+            user_id=user["id"], url=user["profile_image"]
+        )
+
+    # whatever was not inserted lost a race for its username
+    for username, index in to_insert.items():
+        results[index] = username_conflict(index, username)
+
+    return results
+
+
+async def update_users(rows: List[Dict]) -> List[Dict]:
+    async with in_transaction(PRIMARY_CONNECTION) as connection:
+        updated_users: List[Dict] = await bulk_update_users(rows, connection)
+        await record_user_changes(
+            UserChangeType.UPDATED,
+            [user["id"] for user in updated_users],
+            connection,
+        )
+
+    return updated_users
+
+
+async def apply_bulk_update(rows: List[Dict]) -> Tuple[List[Dict], Set[UUID]]:
+    """
+    Runs the batch as a single statement. Should another request grab one of
+    the usernames in the meantime, the whole statement is rejected and the
+    rows are retried one by one to find out which of them conflict.
+    """
+    try:
+        return await update_users(rows), set()
+    except IntegrityError as e:
+        if e.args[0].constraint_name != "user_username_key":
+            raise e
+
+    updated_users: List[Dict] = []
+    conflicts: Set[UUID] = set()
+
+    for row in rows:
+        try:
+            updated_users.extend(await update_users([row]))
+        except IntegrityError as e:
+            if e.args[0].constraint_name != "user_username_key":
+                raise e
+
+            conflicts.add(row["id"])
+
+    return updated_users, conflicts
+
+
+@router.patch(
+    "/bulk",
+    response_model=List[BulkUserResult],
+    status_code=status.HTTP_200_OK,
+)
+async def bulk_update_users_endpoint(
+    users_in: conlist(
+        BulkUpdateUser, min_items=1, max_items=settings.USERS_BULK_MAX_SIZE
+    ),
+):
+    """
+    Partially updates every user of the batch, answering with one result per
+    user. New profile images are always processed in the background.
+    """
+    results: List[Optional[BulkUserResult]] = [None] * len(users_in)
+    taken_usernames: Dict[str, UUID] = await find_taken_usernames(
+        [user_in.username for user_in in users_in if user_in.username]
+    )
+
+    to_update: Dict[UUID, int] = {}
+    claimed_usernames: Set[str] = set()
+    for index, user_in in enumerate(users_in):
+        if user_in.id in to_update:
+            results[index] = BulkUserResult(
+                index=index,
+                id=user_in.id,
+                status_code=status.HTTP_409_CONFLICT,
+                detail=(
+                    f"User with id {user_in.id} appears more than once in "
+                    f"the batch."
+                ),
+            )
+        elif user_in.username and (
+            taken_usernames.get(user_in.username, user_in.id) != user_in.id
+            or user_in.username in claimed_usernames
+        ):
+            results[index] = username_conflict(
+                index, user_in.username, user_in.id
+            )
+        else:
+            to_update[user_in.id] = index
+            claimed_usernames.add(user_in.username)
+
+    rows: List[Dict] = [
+        {
+            **users_in[index].dict(
+                exclude={"password", "profile_image"}, exclude_none=True
+            ),
+            "profile_image": (
+                str(users_in[index].profile_image)
+                if users_in[index].profile_image
+                else None
+            ),
+        }
+        for index in to_update.values()
+    ]
+
+    with_password: List[Dict] = [
+        row for row in rows if users_in[to_update[row["id"]]].password
+    ]
+    for row, hashed_password in zip(
+        with_password,
+        await password_hasher.hash_many(
+            [
+                users_in[to_update[row["id"]]].password.get_secret_value()
+                for row in with_password
+            ]
+        ),
+    ):
+        row["password"] = hashed_password
+
+    updated_users, conflicts = (
+        await apply_bulk_update(rows) if rows else ([], set())
+    )
+
+    for user in updated_users:
+        index: int = to_update.pop(user["id"])
+        results[index] = BulkUserResult(
+            index=index,
+            id=user["id"],
+            status_code=status.HTTP_200_OK,
+            user=DisplayUser.parse_obj(user),
+        )
+        replica_router.mark_written(str(user["id"]))
+        users_list_cache.bump_version()
+        username_index.rename(user["previous_username"], user["username"])
+        username_filter.add(user["username"])
+        await user_cache.invalidate(str(user["id"]))
+
+        if user["profile_image_status"] != ProfileImageStatus.PENDING:
+            continue
+
+        if user["previous_profile_image_status"] == ProfileImageStatus.READY:
+            await profile_image_ingestor.release(
+                user["previous_profile_image"]
+            )
+
+        profile_image_ingestor.enqueue(
+            user_id=user["id"], url=user["profile_image"]
+        )
+
+    for user_id, index in to_update.items():
+        results[index] = (
+            username_conflict(index, users_in[index].username, user_id)
+            if user_id in conflicts
+            else BulkUserResult(
+                index=index,
+                id=user_id,
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User with id {user_id} was not found",
+            )
+        )
+
+    return results
+
+
+async def soft_delete_users(user_ids: List[UUID]) -> List[Dict]:
+    async with in_transaction(PRIMARY_CONNECTION) as connection:
+        deleted_users: List[Dict] = await bulk_soft_delete_users(
+            user_ids, connection
+        )
+        await record_user_changes(
+            UserChangeType.DELETED,
+            [user["id"] for user in deleted_users],
+            connection,
+        )
+
+    return deleted_users
+
+
+@router.delete(
+    "/bulk",
+    response_model=List[BulkUserResult],
+    status_code=status.HTTP_200_OK,
+)
+async def bulk_delete_users(
+    user_ids: conlist(
+        UUID, min_items=1, max_items=settings.USERS_BULK_MAX_SIZE
+    ) = Body(...),
+):
+    deleted_users: List[Dict] = await soft_delete_users(user_ids)
+    deleted_usernames: Dict[UUID, str] = {
+        user["id"]: user["username"] for user in deleted_users
+    }
+    results: List[BulkUserResult] = []
+
+    for index, user_id in enumerate(user_ids):
+        if user_id in deleted_usernames:
+            username_index.remove(deleted_usernames.pop(user_id))
+            replica_router.mark_written(str(user_id))
+            users_list_cache.bump_version()
+            await user_cache.invalidate(str(user_id))
+            results.append(
+                BulkUserResult(
+                    index=index,
+                    id=user_id,
+                    status_code=status.HTTP_204_NO_CONTENT,
+                )
+            )
+        else:
+            results.append(
+                BulkUserResult(
+                    index=index,
+                    id=user_id,
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"User with id {user_id} was not found",
+                )
+            )
+
+    for user in deleted_users:
+        if user["profile_image_status"] == ProfileImageStatus.READY:
+            await profile_image_ingestor.release(user["profile_image"])
+
+    return results
@@ -1,5 +1,9 @@
+from typing import Literal
+
 from .base import BaseSettings
 
 
 class LocalDevelopmentSettings(BaseSettings):
-    pass
+    DB_GENERATE_SCHEMAS: bool = True
+    DB_SCHEMA_CHECK: bool = False
+    RATE_LIMIT_BACKEND: Literal["memory", "redis", "none"] = "none"
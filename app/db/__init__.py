@@ -1,17 +1,41 @@
 from typing import Dict
 
 from fastapi import FastAPI
+from tortoise import Tortoise
+from tortoise.backends.base.config_generator import expand_db_url
 from tortoise.contrib.fastapi import register_tortoise
 
 from app.config import settings
 
 
+PRIMARY_CONNECTION: str = "default"
+
+
+def get_connection_config(db_uri: str) -> Dict:
+    config: Dict = expand_db_url(db_uri)
+    config["engine"] = "app.db.backends.asyncpg"
+    config["credentials"].update(
+        minsize=settings.POSTGRES_POOL_MIN_SIZE,
+        maxsize=settings.POSTGRES_POOL_MAX_SIZE,
+        statement_cache_size=settings.POSTGRES_STATEMENT_CACHE_SIZE,
+        command_timeout=settings.POSTGRES_COMMAND_TIMEOUT,
+        max_queries=settings.POSTGRES_MAX_QUERIES,
+        max_inactive_connection_lifetime=(
+            settings.POSTGRES_MAX_INACTIVE_CONNECTION_LIFETIME
+        ),
+    )
+    return config
+
+
 TORTOISE_ORM: Dict = {
-    "connections": {"default": settings.POSTGRES_DB_URI},
+    # the read replicas are managed by ``app.db.routing.replica_router``
+    "connections": {
+        PRIMARY_CONNECTION: get_connection_config(settings.POSTGRES_DB_URI),
+    },
     "apps": {
         "models": {
             "models": ["app.db.models", "aerich.models"],
-            "default_connection": "default",
+            "default_connection": PRIMARY_CONNECTION,
         },
     },
     "use_tz": True,
@@ -25,6 +49,18 @@ def init_db(app: FastAPI):
         config=TORTOISE_ORM,
         # db_url=settings.POSTGRES_DB_URI,
         # modules={"models": ["db.models", "aerich.models"]},
-        generate_schemas=True,
+        # the schema is managed by the aerich migrations, see
+        #  ``app.db.schema.check_schema_version``
+        generate_schemas=settings.DB_GENERATE_SCHEMAS,
         add_exception_handlers=True,
     )
+
+
+def forget_connections():
+    """
+    Drops, without closing them, the connections a forked worker inherited
+    from its parent: their sockets are shared with the parent, closing them
+    here would close them there too. Each worker opens its own on startup.
+    """
+    Tortoise._connections = {}
+    Tortoise._inited = False
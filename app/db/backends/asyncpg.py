@@ -0,0 +1,76 @@
+from time import perf_counter
+from typing import Any
+
+from tortoise.backends.asyncpg.client import (
+    AsyncpgDBClient,
+    TransactionWrapper,
+)
+from tortoise.backends.base.client import (
+    TransactionContext,
+    TransactionContextPooled,
+)
+
+from app.metrics import Histogram
+
+
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds",
+    "Time spent running a query, including waiting for a pool connection.",
+    labelnames=("connection", "operation"),
+)
+
+OPERATIONS = frozenset(("SELECT", "INSERT", "UPDATE", "DELETE"))
+
+
+def get_operation(query: str) -> str:
+    operation: str = query.lstrip()[:6].upper()
+    return operation if operation in OPERATIONS else "OTHER"
+
+
+class QueryMetricsMixin:
+    connection_name: str
+
+    async def _timed(self, query: str, run: Any) -> Any:
+        started_at: float = perf_counter()
+
+        try:
+            return await run
+        finally:
+            db_query_duration_seconds.labels(
+                self.connection_name, get_operation(query)
+            ).observe(perf_counter() - started_at)
+
+    async def execute_insert(self, query: str, values: list) -> Any:
+        return await self._timed(query, super().execute_insert(query, values))
+
+    async def execute_many(self, query: str, values: list) -> None:
+        await self._timed(query, super().execute_many(query, values))
+
+    async def execute_query(self, query: str, values: Any = None) -> Any:
+        return await self._timed(query, super().execute_query(query, values))
+
+    async def execute_query_dict(self, query: str, values: Any = None) -> Any:
+        return await self._timed(
+            query, super().execute_query_dict(query, values)
+        )
+
+    async def execute_script(self, query: str) -> None:
+        await self._timed(query, super().execute_script(query))
+
+
+class InstrumentedTransactionWrapper(QueryMetricsMixin, TransactionWrapper):
+    pass
+
+
+class InstrumentedAsyncpgDBClient(QueryMetricsMixin, AsyncpgDBClient):
+    """
+    asyncpg client recording the duration of every query it runs, its
+    transactions included.
+    """
+
+    def _in_transaction(self) -> TransactionContext:
+        return TransactionContextPooled(InstrumentedTransactionWrapper(self))
+
+
+# looked up by Tortoise when this module is used as a connection's engine
+client_class = InstrumentedAsyncpgDBClient
@@ -2,3 +2,8 @@ class UsernameAlreadyInUseError(Exception):
     def __init__(self, msg: str, status_code: int):
         self.msg = msg
         self.status_code = status_code
+
+
+class SchemaVersionError(Exception):
+    def __init__(self, msg: str):
+        self.msg = msg
@@ -0,0 +1,91 @@
+from typing import TYPE_CHECKING, Optional, Sequence, Type
+
+from pypika.terms import Term
+from tortoise.indexes import Index
+
+
+if TYPE_CHECKING:
+    from tortoise.backends.base.schema_generator import BaseSchemaGenerator
+    from tortoise.models import Model
+
+
+class PartialIndex(Index):
+    """
+    Index restricted to the rows matching ``condition``, a raw SQL predicate
+    such as ``deleted_at IS NULL``.
+    """
+
+    def __init__(
+        self,
+        *expressions: Term,
+        condition: str,
+        fields: Optional[Sequence[str]] = None,
+        name: Optional[str] = None,
+    ):
+        super().__init__(*expressions, fields=fields, name=name)
+        self.condition = condition
+        self.extra = f" WHERE {condition}"
+
+
+class OperatorClassIndex(PartialIndex):
+    """
+    Partial index of expressions indexed with the operator class
+    ``operator_class``, through the index ``method``, neither of which the
+    ORM can express.
+    """
+
+    def __init__(
+        self,
+        *expressions: Term,
+        condition: str,
+        name: str,
+        operator_class: str,
+        method: str = "btree",
+    ):
+        super().__init__(*expressions, condition=condition, name=name)
+        self.operator_class = operator_class
+        self.method = method
+
+    def get_sql(
+        self,
+        schema_generator: "BaseSchemaGenerator",
+        model: "Type[Model]",
+        safe: bool,
+    ) -> str:
+        expressions: str = ", ".join(
+            f"({expression.get_sql()}) {self.operator_class}"
+            for expression in self.expressions
+        )
+        return (
+            f"CREATE INDEX {'IF NOT EXISTS ' if safe else ''}"
+            f"{schema_generator.quote(self.name)} ON "
+            f"{schema_generator.quote(model._meta.db_table)} "
+            f"USING {self.method} ({expressions}){self.extra};"
+        )
+
+
+class TrigramIndex(OperatorClassIndex):
+    """
+    GIN index of the trigrams of ``expressions``, backing ``LIKE`` and
+    ``ILIKE`` patterns wherever the wildcards are, and the similarity
+    operators of pg_trgm. The extension is created along with the index.
+    """
+
+    def __init__(self, *expressions: Term, condition: str, name: str):
+        super().__init__(
+            *expressions,
+            condition=condition,
+            name=name,
+            operator_class="gin_trgm_ops",
+            method="gin",
+        )
+
+    def get_sql(
+        self,
+        schema_generator: "BaseSchemaGenerator",
+        model: "Type[Model]",
+        safe: bool,
+    ) -> str:
+        return "CREATE EXTENSION IF NOT EXISTS pg_trgm;\n" + super().get_sql(
+            schema_generator, model, safe
+        )
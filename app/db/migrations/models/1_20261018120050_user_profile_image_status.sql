@@ -0,0 +1,5 @@
+-- upgrade --
+ALTER TABLE "user" ADD COLUMN IF NOT EXISTS "profile_image_status" VARCHAR(16) NOT NULL  DEFAULT 'ready';
+COMMENT ON COLUMN "user"."profile_image_status" IS 'PENDING: pending\nREADY: ready\nFAILED: failed';
+-- downgrade --
+ALTER TABLE "user" DROP COLUMN IF EXISTS "profile_image_status";
@@ -0,0 +1,6 @@
+-- upgrade --
+CREATE INDEX IF NOT EXISTS "user_active_created_at_id_idx" ON "user" ("created_at", "id") WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS "user_active_lower_username_idx" ON "user" ((LOWER(username))) WHERE deleted_at IS NULL;
+-- downgrade --
+DROP INDEX IF EXISTS "user_active_lower_username_idx";
+DROP INDEX IF EXISTS "user_active_created_at_id_idx";
@@ -0,0 +1,18 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "profile_image" (
+    "hash" VARCHAR(64) NOT NULL  PRIMARY KEY,
+    "extension" VARCHAR(8) NOT NULL,
+    "size" BIGINT NOT NULL,
+    "ref_count" INT NOT NULL  DEFAULT 0,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE "profile_image" IS 'A stored profile image, along with its thumbnails.';
+CREATE TABLE IF NOT EXISTS "profile_image_source" (
+    "url" VARCHAR(255) NOT NULL  PRIMARY KEY,
+    "image_id" VARCHAR(64) NOT NULL REFERENCES "profile_image" ("hash") ON DELETE CASCADE
+);
+COMMENT ON TABLE "profile_image_source" IS 'Url an image was downloaded from, so that it is never downloaded again.';
+CREATE INDEX IF NOT EXISTS "idx_profile_ima_image_i_a075f6" ON "profile_image_source" ("image_id");
+-- downgrade --
+DROP TABLE IF EXISTS "profile_image_source";
+DROP TABLE IF EXISTS "profile_image";
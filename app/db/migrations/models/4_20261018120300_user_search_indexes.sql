@@ -0,0 +1,11 @@
+-- upgrade --
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS "user_active_username_prefix_idx" ON "user" USING btree ((LOWER(username)) text_pattern_ops) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS "user_active_username_trgm_idx" ON "user" USING gin ((LOWER(username)) gin_trgm_ops) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS "user_active_first_name_trgm_idx" ON "user" USING gin ((LOWER(first_name)) gin_trgm_ops) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS "user_active_last_name_trgm_idx" ON "user" USING gin ((LOWER(last_name)) gin_trgm_ops) WHERE deleted_at IS NULL;
+-- downgrade --
+DROP INDEX IF EXISTS "user_active_last_name_trgm_idx";
+DROP INDEX IF EXISTS "user_active_first_name_trgm_idx";
+DROP INDEX IF EXISTS "user_active_username_trgm_idx";
+DROP INDEX IF EXISTS "user_active_username_prefix_idx";
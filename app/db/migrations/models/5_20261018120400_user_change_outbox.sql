@@ -0,0 +1,11 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "user_change" (
+    "seq" BIGSERIAL NOT NULL PRIMARY KEY,
+    "user_id" UUID NOT NULL,
+    "event" VARCHAR(16) NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON COLUMN "user_change"."event" IS 'CREATED: created\nUPDATED: updated\nDELETED: deleted';
+COMMENT ON TABLE "user_change" IS 'Outbox of the writes made to users.';
+-- downgrade --
+DROP TABLE IF EXISTS "user_change";
@@ -0,0 +1,4 @@
+-- upgrade --
+CREATE INDEX IF NOT EXISTS "user_modified_at_id_idx" ON "user" ("modified_at", "id");
+-- downgrade --
+DROP INDEX IF EXISTS "user_modified_at_id_idx";
@@ -0,0 +1,14 @@
+-- upgrade --
+CREATE INDEX IF NOT EXISTS "profile_image_released_idx" ON "profile_image" ("hash") WHERE ref_count <= 0;
+CREATE INDEX IF NOT EXISTS "user_active_profile_image_idx" ON "user" ("profile_image") WHERE deleted_at IS NULL;
+-- the references soft deleted users kept, released on delete from now on
+UPDATE "profile_image" AS image SET "ref_count" = image."ref_count" - deleted."count"
+FROM (
+    SELECT "profile_image", count(*) AS "count" FROM "user"
+    WHERE "deleted_at" IS NOT NULL AND "profile_image_status" = 'ready'
+    GROUP BY "profile_image"
+) AS deleted
+WHERE deleted."profile_image" = left(image."hash", 2) || '/' || image."hash" || image."extension";
+-- downgrade --
+DROP INDEX IF EXISTS "user_active_profile_image_idx";
+DROP INDEX IF EXISTS "profile_image_released_idx";
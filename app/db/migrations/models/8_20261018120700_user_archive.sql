@@ -0,0 +1,19 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "user_archive" (
+    "id" UUID NOT NULL  PRIMARY KEY,
+    "username" VARCHAR(24) NOT NULL,
+    "first_name" VARCHAR(30) NOT NULL,
+    "last_name" VARCHAR(60) NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL,
+    "modified_at" TIMESTAMPTZ NOT NULL,
+    "deleted_at" TIMESTAMPTZ NOT NULL,
+    "archived_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "profile_image" VARCHAR(255) NOT NULL,
+    "profile_image_status" VARCHAR(16) NOT NULL
+);
+COMMENT ON COLUMN "user_archive"."profile_image_status" IS 'PENDING: pending\nREADY: ready\nFAILED: failed';
+COMMENT ON TABLE "user_archive" IS 'A user purged after being deleted for longer than the retention.';
+CREATE INDEX IF NOT EXISTS "user_deleted_at_idx" ON "user" ("deleted_at") WHERE deleted_at IS NOT NULL;
+-- downgrade --
+DROP INDEX IF EXISTS "user_deleted_at_idx";
+DROP TABLE IF EXISTS "user_archive";
@@ -1,6 +1,14 @@
-from .user import User
+from .change import UserChange, UserChangeType
+from .image import ProfileImage, ProfileImageSource
+from .user import ArchivedUser, ProfileImageStatus, User
 
 
 __all__ = [
+    "ArchivedUser",
+    "ProfileImage",
+    "ProfileImageSource",
+    "ProfileImageStatus",
     "User",
+    "UserChange",
+    "UserChangeType",
 ]
@@ -0,0 +1,33 @@
+from enum import Enum
+
+from tortoise.fields import (
+    BigIntField,
+    CharEnumField,
+    DatetimeField,
+    UUIDField,
+)
+from tortoise.models import Model
+
+
+class UserChangeType(str, Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+
+
+class UserChange(Model):
+    """
+    Outbox of the writes made to users.
+
+    Recorded in the transaction of the write, see
+    ``app.db.queries.record_user_changes``.
+    """
+
+    seq = BigIntField(pk=True)
+    # not a foreign key, changes outlive the users they are about
+    user_id = UUIDField()
+    event = CharEnumField(UserChangeType, max_length=16)
+    created_at = DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "user_change"
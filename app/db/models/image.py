@@ -0,0 +1,58 @@
+from tortoise.fields import (
+    CASCADE,
+    BigIntField,
+    CharField,
+    DatetimeField,
+    ForeignKeyField,
+    IntField,
+)
+from tortoise.models import Model
+
+from app.db.indexes import PartialIndex
+
+
+class ProfileImage(Model):
+    """
+    A stored profile image, along with its thumbnails.
+
+    Shared by every user whose image has the same content.
+    """
+
+    # sha256 of the decoded pixels, see ``app.services.images.store_image``
+    hash = CharField(max_length=64, pk=True)
+    extension = CharField(max_length=8)
+    # of the image and its thumbnails together
+    size = BigIntField()
+    # number of users having this image as their profile image, the files
+    #  are removed along with the row by the collector once it drops to 0
+    ref_count = IntField(default=0)
+    created_at = DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "profile_image"
+        indexes = (
+            # the images left for the collector
+            PartialIndex(
+                fields=("hash",),
+                condition="ref_count <= 0",
+                name="profile_image_released_idx",
+            ),
+        )
+
+
+class ProfileImageSource(Model):
+    """
+    Url an image was downloaded from, so that it is never downloaded again.
+    """
+
+    url = CharField(max_length=255, pk=True)
+    image = ForeignKeyField(
+        "models.ProfileImage",
+        related_name="sources",
+        on_delete=CASCADE,
+        # backs the cascading deletes
+        index=True,
+    )
+
+    class Meta:
+        table = "profile_image_source"
@@ -1,8 +1,21 @@
+from enum import Enum
 from uuid import uuid4
 
-from tortoise.fields import CharField, DatetimeField, UUIDField
+from pypika.functions import Lower
+from pypika.terms import Field
+from tortoise.fields import CharEnumField, CharField, DatetimeField, UUIDField
+from tortoise.indexes import Index
 from tortoise.models import Model
 
+from app.db.indexes import OperatorClassIndex, PartialIndex, TrigramIndex
+
+
+class ProfileImageStatus(str, Enum):
+    # while pending, ``User.profile_image`` holds the source url of the image
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+
 
 class User(Model):
     id = UUIDField(pk=True, default=uuid4)
@@ -14,6 +27,81 @@ class User(Model):
     modified_at = DatetimeField(auto_now=True)
     deleted_at = DatetimeField(null=True)
     profile_image = CharField(max_length=255)
+    profile_image_status = CharEnumField(
+        ProfileImageStatus, max_length=16, default=ProfileImageStatus.READY
+    )
+
+    class Meta:
+        # soft deleted users are never read back, so they are left out of the
+        #  indexes backing the read paths
+        indexes = (
+            PartialIndex(
+                fields=("created_at", "id"),
+                condition="deleted_at IS NULL",
+                name="user_active_created_at_id_idx",
+            ),
+            PartialIndex(
+                Lower(Field("username")),
+                condition="deleted_at IS NULL",
+                name="user_active_lower_username_idx",
+            ),
+            # username prefixes, whatever the collation of the database
+            OperatorClassIndex(
+                Lower(Field("username")),
+                condition="deleted_at IS NULL",
+                name="user_active_username_prefix_idx",
+                operator_class="text_pattern_ops",
+            ),
+            *(
+                TrigramIndex(
+                    Lower(Field(field)),
+                    condition="deleted_at IS NULL",
+                    name=f"user_active_{field}_trgm_idx",
+                )
+                for field in ("username", "first_name", "last_name")
+            ),
+            # the soft deleted users, for the purge
+            PartialIndex(
+                fields=("deleted_at",),
+                condition="deleted_at IS NOT NULL",
+                name="user_deleted_at_idx",
+            ),
+            # the files of the profile images folder still in use
+            PartialIndex(
+                fields=("profile_image",),
+                condition="deleted_at IS NULL",
+                name="user_active_profile_image_idx",
+            ),
+            # deleted users included, the exports of the users modified
+            #  since a watermark sending them as tombstones
+            Index(
+                fields=("modified_at", "id"),
+                name="user_modified_at_id_idx",
+            ),
+        )
 
     class PydanticMeta:
         exclude = ["password", "deleted_at"]
+
+
+class ArchivedUser(Model):
+    """
+    A user purged after being deleted for longer than the retention.
+
+    Moved out of the ``user`` table by the purge, password aside.
+    """
+
+    id = UUIDField(pk=True)
+    # not unique, the username is free again once its user is archived
+    username = CharField(max_length=24)
+    first_name = CharField(max_length=30)
+    last_name = CharField(max_length=60)
+    created_at = DatetimeField()
+    modified_at = DatetimeField()
+    deleted_at = DatetimeField()
+    archived_at = DatetimeField(auto_now_add=True)
+    profile_image = CharField(max_length=255)
+    profile_image_status = CharEnumField(ProfileImageStatus, max_length=16)
+
+    class Meta:
+        table = "user_archive"
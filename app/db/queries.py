@@ -0,0 +1,747 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+from uuid import UUID
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.db import PRIMARY_CONNECTION
+from app.db.models import UserChangeType
+
+
+# Hand written, Postgres only, SQL for the paths where going through the ORM
+#  one row at a time is too slow.
+
+DISPLAY_USER_COLUMNS: str = (
+    "id, username, first_name, last_name, profile_image, "
+    "profile_image_status, created_at, modified_at"
+)
+
+# the timestamps of the rendered users, see ``DisplayUser``
+ISO_TIMESTAMP: str = (
+    """to_char({} AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+00:00"')"""
+)
+
+# every active user, as the rows of a CSV file and as the lines of NDJSON
+SNAPSHOT_QUERIES: Dict[str, str] = {
+    "csv": f"""
+        SELECT id, username, first_name, last_name, profile_image,
+            profile_image_status,
+            {ISO_TIMESTAMP.format("created_at")} AS created_at,
+            {ISO_TIMESTAMP.format("modified_at")} AS modified_at
+        FROM "user" WHERE deleted_at IS NULL
+    """,
+    "ndjson": f"""
+        SELECT json_build_object(
+            'id', id,
+            'username', username,
+            'firstName', first_name,
+            'lastName', last_name,
+            'profileImage', profile_image,
+            'profileImageStatus', profile_image_status,
+            'createdAt', {ISO_TIMESTAMP.format("created_at")},
+            'modifiedAt', {ISO_TIMESTAMP.format("modified_at")}
+        )
+        FROM "user" WHERE deleted_at IS NULL
+    """,
+}
+
+# woken up on every commit recording user changes, with the last ``seq``
+USER_CHANGES_CHANNEL: str = "user_changes"
+# the advisory lock serializing the commits recording user changes
+USER_CHANGES_LOCK: int = 0x75736572
+# held by the worker going through the profile images folder
+PROFILE_IMAGES_RECONCILE_LOCK: int = 0x696D6167
+
+
+def get_connection(
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> BaseDBAsyncClient:
+    return connection or Tortoise.get_connection(PRIMARY_CONNECTION)
+
+
+async def find_taken_usernames(
+    usernames: Sequence[str],
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> Dict[str, UUID]:
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        'SELECT id, username FROM "user" WHERE username = ANY($1::text[])',
+        [list(usernames)],
+    )
+    return {row["username"]: row["id"] for row in rows}
+
+
+async def get_users_by_ids(
+    user_ids: Sequence[UUID],
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[Dict]:
+    """
+    Fetches the given users, soft deleted ones included so that callers can
+    tell them apart from users that never existed. Whatever the number of
+    ids, this is the same statement, prepared once per connection.
+    """
+    return await get_connection(connection).execute_query_dict(
+        f"""
+        SELECT {DISPLAY_USER_COLUMNS}, deleted_at FROM "user"
+        WHERE id = ANY($1::uuid[])
+        """,
+        [list(user_ids)],
+    )
+
+
+async def get_users_modified_after(
+    modified_at: datetime,
+    user_id: UUID,
+    settle_delay: float,
+    limit: int,
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[Dict]:
+    """
+    The users following the given one in the ``(modified_at, id)`` order,
+    soft deleted ones included.
+
+    Users modified in the last ``settle_delay`` seconds are left out: a
+    transaction still running might commit a user modified before them,
+    which a reader resuming after them would never see.
+    """
+    return await get_connection(connection).execute_query_dict(
+        f"""
+        SELECT {DISPLAY_USER_COLUMNS}, deleted_at FROM "user"
+        WHERE (modified_at, id) > ($1, $2)
+            AND modified_at < now() - $3 * interval '1 second'
+        ORDER BY modified_at, id
+        LIMIT $4
+        """,
+        [modified_at, user_id, settle_delay, limit],
+    )
+
+
+async def copy_active_users(
+    output: Callable[[bytes], Awaitable],
+    format: str,
+    connection: Optional[BaseDBAsyncClient] = None,
+):
+    """
+    Has Postgres render every active user, as CSV or NDJSON, handing the
+    chunks of its ``COPY`` output to ``output`` as they come.
+    """
+    async with get_connection(connection).acquire_connection() as client:
+        if format == "csv":
+            await client.copy_from_query(
+                SNAPSHOT_QUERIES[format],
+                output=output,
+                format="csv",
+                header=True,
+            )
+            return
+
+        # no JSON document holds these control characters unescaped, so
+        #  the lines go through CSV quoting untouched
+        await client.copy_from_query(
+            SNAPSHOT_QUERIES[format],
+            output=output,
+            format="csv",
+            quote="\x01",
+            delimiter="\x02",
+        )
+
+
+async def bulk_insert_users(
+    users: Sequence[Dict],
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[Dict]:
+    """
+    Inserts every user in a single statement, skipping the ones whose
+    username is taken, either by an existing user or by an earlier user of
+    the same batch. Only the inserted users are returned.
+
+    The rows are sent as one array per column, so the statement takes the
+    same 7 parameters whatever the size of the batch.
+    """
+    return await get_connection(connection).execute_query_dict(
+        f"""
+        INSERT INTO "user" (
+            id, username, first_name, last_name, password, profile_image,
+            profile_image_status, created_at, modified_at
+        )
+        SELECT *, now(), now() FROM unnest(
+            $1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[],
+            $6::text[], $7::text[]
+        )
+        ON CONFLICT (username) DO NOTHING
+        RETURNING {DISPLAY_USER_COLUMNS}
+        """,
+        [
+            [user[column] for user in users]
+            for column in (
+                "id",
+                "username",
+                "first_name",
+                "last_name",
+                "password",
+                "profile_image",
+                "profile_image_status",
+            )
+        ],
+    )
+
+
+async def bulk_update_users(
+    users: Sequence[Dict],
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[Dict]:
+    """
+    Updates every (not deleted) user in a single statement. Fields missing
+    from a user's dict are left untouched, and a new profile image puts the
+    user back into the ``pending`` image state.
+
+    The updated users are returned along with the profile image they had
+    before the update, as ``previous_profile_image`` and
+    ``previous_profile_image_status``, and their ``previous_username``.
+    """
+    return await get_connection(connection).execute_query_dict(
+        """
+        UPDATE "user" AS u SET
+            username = COALESCE(v.username, u.username),
+            first_name = COALESCE(v.first_name, u.first_name),
+            last_name = COALESCE(v.last_name, u.last_name),
+            password = COALESCE(v.password, u.password),
+            profile_image = COALESCE(v.profile_image, u.profile_image),
+            profile_image_status = CASE
+                WHEN v.profile_image IS NULL THEN u.profile_image_status
+                ELSE 'pending'
+            END,
+            modified_at = now()
+        FROM unnest(
+            $1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[],
+            $6::text[]
+        ) AS v(id, username, first_name, last_name, password, profile_image),
+            "user" AS previous
+        WHERE u.id = v.id AND previous.id = u.id AND u.deleted_at IS NULL
+        RETURNING u.id, u.username, u.first_name, u.last_name,
+            u.profile_image, u.profile_image_status, u.created_at,
+            u.modified_at, previous.profile_image AS previous_profile_image,
+            previous.profile_image_status AS previous_profile_image_status,
+            previous.username AS previous_username
+        """,
+        [
+            [user.get(column) for user in users]
+            for column in (
+                "id",
+                "username",
+                "first_name",
+                "last_name",
+                "password",
+                "profile_image",
+            )
+        ],
+    )
+
+
+async def write_user(
+    user_id: UUID,
+    assignments: List[str],
+    changed: str,
+    values: List[Any],
+    event: str,
+    modified_at: Optional[datetime],
+    connection: Optional[BaseDBAsyncClient],
+) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Applies ``assignments`` to an active user, along with a new
+    ``modified_at``, as long as ``changed`` holds, recording the change in
+    the outbox, all in a single statement. ``values`` are the parameters of
+    both, from ``$6`` on.
+
+    Answers with the user as it was, None when there is no active user,
+    and the user as it is now, None when nothing had to change or the user
+    was modified after ``modified_at``.
+    """
+    # the lock of record_user_changes, only taken once the user was
+    #  written. The user row is locked first, so that the previous values
+    #  are those of the version being updated
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        f"""
+        WITH previous AS (
+            SELECT {DISPLAY_USER_COLUMNS} FROM "user"
+            WHERE id = $1 AND deleted_at IS NULL
+            FOR UPDATE
+        ),
+        updated AS (
+            UPDATE "user" AS u
+            SET {", ".join([*assignments, "modified_at = now()"])}
+            FROM previous
+            WHERE u.id = previous.id
+                AND ($2::timestamptz IS NULL OR previous.modified_at = $2)
+                AND {changed}
+            RETURNING u.id, u.username, u.first_name, u.last_name,
+                u.profile_image, u.profile_image_status, u.created_at,
+                u.modified_at
+        ),
+        lock AS (
+            SELECT pg_advisory_xact_lock($4) FROM updated
+        ),
+        change AS (
+            INSERT INTO user_change (user_id, event, created_at)
+            SELECT updated.id, $3, now() FROM updated, lock
+            RETURNING pg_notify($5, seq::text)
+        )
+        SELECT 'previous' AS version, * FROM previous
+        UNION ALL
+        SELECT 'updated', * FROM updated
+        """,
+        [
+            user_id,
+            modified_at,
+            event,
+            USER_CHANGES_LOCK,
+            USER_CHANGES_CHANNEL,
+            *values,
+        ],
+    )
+    versions: Dict[str, Dict] = {row.pop("version"): row for row in rows}
+
+    return versions.get("previous"), versions.get("updated")
+
+
+async def update_user_columns(
+    user_id: UUID,
+    columns: Dict[str, Any],
+    event: str,
+    modified_at: Optional[datetime] = None,
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Sets ``columns``, trusted names mapped to their new values, writing
+    the user only when one of them actually changes, see ``write_user``.
+    """
+    if not columns:
+        return await write_user(
+            user_id, [], "FALSE", [], event, modified_at, connection
+        )
+
+    names: List[str] = list(columns)
+    parameters: List[str] = [f"${6 + index}" for index in range(len(names))]
+
+    return await write_user(
+        user_id,
+        assignments=[
+            f"{name} = {parameter}"
+            for name, parameter in zip(names, parameters)
+        ],
+        changed=(
+            f"(u.{', u.'.join(names)}) IS DISTINCT FROM "
+            f"({', '.join(parameters)})"
+        ),
+        values=list(columns.values()),
+        event=event,
+        modified_at=modified_at,
+        connection=connection,
+    )
+
+
+async def soft_delete_user(
+    user_id: UUID,
+    modified_at: Optional[datetime] = None,
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> Tuple[Optional[Dict], Optional[Dict]]:
+    return await write_user(
+        user_id,
+        assignments=["deleted_at = now()"],
+        changed="TRUE",
+        values=[],
+        event=UserChangeType.DELETED,
+        modified_at=modified_at,
+        connection=connection,
+    )
+
+
+async def bulk_soft_delete_users(
+    user_ids: Sequence[UUID],
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[Dict]:
+    return await get_connection(connection).execute_query_dict(
+        """
+        UPDATE "user" SET deleted_at = now(), modified_at = now()
+        WHERE id = ANY($1::uuid[]) AND deleted_at IS NULL
+        RETURNING id, username, profile_image, profile_image_status
+        """,
+        [list(user_ids)],
+    )
+
+
+async def archive_deleted_users(
+    deleted_before: datetime,
+    limit: int,
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[Dict]:
+    """
+    Moves up to ``limit`` of the users deleted before ``deleted_before`` to
+    ``user_archive``, the oldest first, returning their ``id`` and
+    ``username``. The users another purge is moving are skipped.
+    """
+    return await get_connection(connection).execute_query_dict(
+        """
+        WITH purged AS (
+            DELETE FROM "user" WHERE id IN (
+                SELECT id FROM "user"
+                WHERE deleted_at IS NOT NULL AND deleted_at < $1
+                ORDER BY deleted_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, username, first_name, last_name, created_at,
+                modified_at, deleted_at, profile_image, profile_image_status
+        ),
+        archived AS (
+            INSERT INTO user_archive (
+                id, username, first_name, last_name, created_at,
+                modified_at, deleted_at, archived_at, profile_image,
+                profile_image_status
+            )
+            SELECT id, username, first_name, last_name, created_at,
+                modified_at, deleted_at, now(), profile_image,
+                profile_image_status
+            FROM purged
+        )
+        SELECT id, username FROM purged
+        """,
+        [deleted_before, limit],
+    )
+
+
+async def get_deleted_users_summary(
+    deleted_before: datetime,
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> Dict:
+    """
+    The number of soft deleted users, of those deleted before
+    ``deleted_before``, and when the oldest was deleted, all read from the
+    index of the deleted users.
+    """
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        """
+        SELECT count(*) AS deleted,
+            count(*) FILTER (WHERE deleted_at < $1) AS pending,
+            min(deleted_at) AS oldest_deleted_at
+        FROM "user" WHERE deleted_at IS NOT NULL
+        """,
+        [deleted_before],
+    )
+    return rows[0]
+
+
+async def record_user_changes(
+    event: str, user_ids: Sequence[UUID], connection: BaseDBAsyncClient
+):
+    """
+    Appends a change per user to the ``user_change`` outbox, notifying
+    ``USER_CHANGES_CHANNEL`` once the transaction commits.
+
+    Meant to be the last statements of the transaction of the write: the
+    lock they take, held until the commit, makes the changes commit in the
+    order of their ``seq``. Readers can then go through the outbox by
+    ``seq`` without ever missing a change committed after a later one.
+    """
+    if not user_ids:
+        return
+
+    await connection.execute_query(
+        "SELECT pg_advisory_xact_lock($1)", [USER_CHANGES_LOCK]
+    )
+    await connection.execute_query(
+        """
+        WITH change AS (
+            INSERT INTO user_change (user_id, event, created_at)
+            SELECT user_id, $2, now() FROM unnest($1::uuid[]) AS user_id
+            RETURNING seq
+        )
+        SELECT pg_notify($3, max(seq)::text) FROM change
+        """,
+        [list(user_ids), event, USER_CHANGES_CHANNEL],
+    )
+
+
+async def get_user_changes(
+    after: int, limit: int, connection: Optional[BaseDBAsyncClient] = None
+) -> List[Dict]:
+    """
+    The changes following ``after``, along with the display columns of
+    their user as it is now, null once purged.
+    """
+    return await get_connection(connection).execute_query_dict(
+        """
+        SELECT change.seq, change.event, change.user_id,
+            change.created_at AS changed_at, u.id, u.username, u.first_name,
+            u.last_name, u.profile_image, u.profile_image_status,
+            u.created_at, u.modified_at
+        FROM user_change AS change
+        LEFT JOIN "user" AS u ON u.id = change.user_id
+        WHERE change.seq > $1
+        ORDER BY change.seq
+        LIMIT $2
+        """,
+        [after, limit],
+    )
+
+
+async def get_last_user_change_seq(
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> int:
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        "SELECT coalesce(max(seq), 0) AS seq FROM user_change"
+    )
+    return rows[0]["seq"]
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_users(
+    query: str, limit: int, connection: Optional[BaseDBAsyncClient] = None
+) -> List[Dict]:
+    """
+    Active users whose username, first or last name starts with ``query``
+    or is similar enough to it, as pg_trgm has it. Usernames starting with
+    the query come first, then the closest matches.
+
+    Every condition is backed by an index of the lowercased column, the
+    trigram indexes covering the prefixes of the names too.
+    """
+    return await get_connection(connection).execute_query_dict(
+        f"""
+        SELECT {DISPLAY_USER_COLUMNS} FROM "user"
+        WHERE deleted_at IS NULL AND (
+            lower(username) LIKE $2
+            OR lower(first_name) LIKE $2
+            OR lower(last_name) LIKE $2
+            OR lower(username) % $1
+            OR lower(first_name) % $1
+            OR lower(last_name) % $1
+        )
+        ORDER BY
+            lower(username) LIKE $2 DESC,
+            greatest(
+                similarity(lower(username), $1),
+                similarity(lower(first_name), $1),
+                similarity(lower(last_name), $1)
+            ) DESC,
+            lower(username)
+        LIMIT $3
+        """,
+        [query.lower(), f"{escape_like(query.lower())}%", limit],
+    )
+
+
+async def get_usernames_by_prefix(
+    prefix: str, limit: int, connection: Optional[BaseDBAsyncClient] = None
+) -> List[str]:
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        """
+        SELECT username FROM "user"
+        WHERE deleted_at IS NULL AND lower(username) LIKE $1
+        ORDER BY lower(username), username
+        LIMIT $2
+        """,
+        [f"{escape_like(prefix.lower())}%", limit],
+    )
+    return [row["username"] for row in rows]
+
+
+async def get_active_usernames(
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[str]:
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        'SELECT username FROM "user" WHERE deleted_at IS NULL'
+    )
+    return [row["username"] for row in rows]
+
+
+async def get_all_usernames(
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> List[str]:
+    # deleted users keep their username
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        'SELECT username FROM "user"'
+    )
+    return [row["username"] for row in rows]
+
+
+async def get_applied_migrations(
+    app: str, connection: Optional[BaseDBAsyncClient] = None
+) -> List[str]:
+    # the table aerich records the migrations it applied in
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        "SELECT version FROM aerich WHERE app = $1", [app]
+    )
+    return [row["version"] for row in rows]
+
+
+async def acquire_profile_image_by_url(
+    url: str, connection: Optional[BaseDBAsyncClient] = None
+) -> Optional[Dict]:
+    """
+    Takes a reference to the image already downloaded from ``url``, if any,
+    returning its ``hash`` and ``extension``.
+    """
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        """
+        UPDATE profile_image AS image SET ref_count = image.ref_count + 1
+        FROM profile_image_source AS source
+        WHERE source.url = $1 AND image.hash = source.image_id
+        RETURNING image.hash, image.extension
+        """,
+        [url],
+    )
+    return rows[0] if rows else None
+
+
+async def acquire_profile_image(
+    url: str,
+    image_hash: str,
+    extension: str,
+    size: int,
+    connection: Optional[BaseDBAsyncClient] = None,
+):
+    """
+    Takes a reference to a freshly stored image, which might have been
+    stored already from another url, and records ``url`` as its source.
+    """
+    await get_connection(connection).execute_query(
+        """
+        WITH image AS (
+            INSERT INTO profile_image AS image (
+                hash, extension, size, ref_count, created_at
+            )
+            VALUES ($1, $2, $3, 1, now())
+            ON CONFLICT (hash) DO UPDATE
+            SET ref_count = image.ref_count + 1
+            RETURNING hash
+        )
+        INSERT INTO profile_image_source (url, image_id)
+        SELECT $4, hash FROM image
+        ON CONFLICT (url) DO UPDATE SET image_id = EXCLUDED.image_id
+        """,
+        [image_hash, extension, size, url],
+    )
+
+
+async def release_profile_image(
+    image_hash: str, connection: Optional[BaseDBAsyncClient] = None
+):
+    """
+    Drops a reference to an image. Images left without any are deleted
+    later on, along with their files, see ``delete_released_profile_images``.
+    """
+    await get_connection(connection).execute_query(
+        "UPDATE profile_image SET ref_count = ref_count - 1 WHERE hash = $1",
+        [image_hash],
+    )
+
+
+async def delete_released_profile_images(
+    limit: int, connection: Optional[BaseDBAsyncClient] = None
+) -> List[Dict]:
+    """
+    Deletes up to ``limit`` images no user has anymore, and their sources,
+    returning their ``hash``, ``extension`` and ``size``. The images being
+    deleted by another transaction are skipped.
+
+    Meant to run in a transaction, which keeps the rows locked until the
+    image files are removed.
+    """
+    return await get_connection(connection).execute_query_dict(
+        """
+        DELETE FROM profile_image WHERE hash IN (
+            SELECT hash FROM profile_image WHERE ref_count <= 0
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING hash, extension, size
+        """,
+        [limit],
+    )
+
+
+async def claim_unknown_profile_images(
+    image_hashes: Sequence[str], connection: BaseDBAsyncClient
+) -> List[str]:
+    """
+    Inserts a placeholder for each of the images without a row, returning
+    their hashes. Until the transaction ends, storing any of them again
+    waits on its placeholder, which is deleted along with the files with
+    ``delete_profile_images``.
+    """
+    rows: List[Dict] = await connection.execute_query_dict(
+        """
+        INSERT INTO profile_image (
+            hash, extension, size, ref_count, created_at
+        )
+        SELECT hash, '', 0, 0, now() FROM unnest($1::text[]) AS hash
+        ON CONFLICT (hash) DO NOTHING
+        RETURNING hash
+        """,
+        [list(image_hashes)],
+    )
+    return [row["hash"] for row in rows]
+
+
+async def delete_profile_images(
+    image_hashes: Sequence[str], connection: BaseDBAsyncClient
+):
+    await connection.execute_query(
+        "DELETE FROM profile_image WHERE hash = ANY($1::text[])",
+        [list(image_hashes)],
+    )
+
+
+async def find_active_profile_images(
+    profile_images: Sequence[str],
+    connection: Optional[BaseDBAsyncClient] = None,
+) -> Set[str]:
+    """
+    The ones of ``profile_images`` an active user has, through the partial
+    index on ``profile_image``.
+    """
+    rows: List[Dict] = await get_connection(connection).execute_query_dict(
+        """
+        SELECT DISTINCT profile_image FROM "user"
+        WHERE profile_image = ANY($1::text[]) AND deleted_at IS NULL
+        """,
+        [list(profile_images)],
+    )
+    return {row["profile_image"] for row in rows}
+
+
+@asynccontextmanager
+async def try_advisory_lock(
+    key: int, connection: Optional[BaseDBAsyncClient] = None
+) -> AsyncIterator[bool]:
+    """
+    Tries to take the session level advisory lock ``key``, answering
+    whether it did. The lock, and the connection holding it, are kept until
+    the block exits.
+    """
+    async with get_connection(connection).acquire_connection() as client:
+        locked: bool = await client.fetchval(
+            "SELECT pg_try_advisory_lock($1)", key
+        )
+
+        try:
+            yield locked
+        finally:
+            if locked:
+                await client.fetchval("SELECT pg_advisory_unlock($1)", key)
@@ -0,0 +1,235 @@
+from asyncio import (
+    CancelledError,
+    Task,
+    TimeoutError,
+    create_task,
+    sleep,
+    wait_for,
+)
+from collections import OrderedDict
+from itertools import cycle
+from logging import getLogger
+from time import monotonic
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Set,
+    TypeVar,
+)
+from uuid import UUID
+
+from asyncpg import (
+    CannotConnectNowError,
+    InterfaceError,
+    PostgresConnectionError,
+)
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.exceptions import DBConnectionError
+
+from app.config import settings
+from app.db import PRIMARY_CONNECTION, get_connection_config
+from app.db.backends.asyncpg import InstrumentedAsyncpgDBClient
+
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+# errors meaning the replica could not be reached, as opposed to errors in
+#  the query itself, which would fail on the primary just the same
+CONNECTION_ERRORS = (
+    OSError,
+    TimeoutError,
+    CannotConnectNowError,
+    InterfaceError,
+    PostgresConnectionError,
+    DBConnectionError,
+)
+
+
+class ReplicaRouter:
+    """
+    Spreads reads over the healthy read replicas, round robin, while writes
+    always go through the primary.
+
+    The replica clients are not registered with Tortoise, so that one being
+    down does not prevent the app from starting. They are connected, and
+    put in rotation, by the first health check to reach them, health checks
+    running every ``health_check_interval`` seconds. A replica failing a
+    read is taken out of rotation straight away, the read being retried on
+    the primary. Reads of a key written in the last
+    ``read_after_write_window`` seconds go to the primary as well, so that
+    they never see the replicas lagging behind their own write.
+    """
+
+    def __init__(
+        self,
+        primary: str,
+        replicas: Dict[str, BaseDBAsyncClient],
+        read_after_write_window: float,
+        health_check_interval: float,
+        health_check_timeout: float,
+        get_connection: Callable[
+            [str], BaseDBAsyncClient
+        ] = Tortoise.get_connection,
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.read_after_write_window = read_after_write_window
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.get_connection = get_connection
+        self.healthy: Set[str] = set()
+        self._connected: Set[str] = set()
+        self._rotation: Iterator[str] = cycle(list(self.replicas))
+        # keys by the time their window ends, oldest first
+        self._written: "OrderedDict[str, float]" = OrderedDict()
+        self._health_check_task: Optional[Task] = None
+
+    def get_client(self, name: str) -> BaseDBAsyncClient:
+        if name in self.replicas:
+            return self.replicas[name]
+
+        return self.get_connection(name)
+
+    @staticmethod
+    def get_key(key: str) -> str:
+        try:
+            return str(UUID(key))
+        except ValueError:
+            return key
+
+    def mark_written(self, key: str):
+        key = self.get_key(key)
+        self._written[key] = monotonic() + self.read_after_write_window
+        self._written.move_to_end(key)
+
+    def is_recently_written(self, key: str) -> bool:
+        now: float = monotonic()
+
+        while self._written:
+            oldest_key, expires_at = next(iter(self._written.items()))
+            if expires_at > now:
+                break
+
+            del self._written[oldest_key]
+
+        return self.get_key(key) in self._written
+
+    def get_read_connection_name(
+        self, key: Optional[str] = None, keys: Iterable[str] = ()
+    ) -> str:
+        if key is not None and self.is_recently_written(key):
+            return self.primary
+
+        # a batch read goes to the primary as soon as one of its keys does
+        if any(self.is_recently_written(key) for key in keys):
+            return self.primary
+
+        for _ in self.replicas:
+            name: str = next(self._rotation)
+            if name in self.healthy:
+                return name
+
+        return self.primary
+
+    async def read(
+        self,
+        run: Callable[[BaseDBAsyncClient], Awaitable[T]],
+        key: Optional[str] = None,
+        keys: Iterable[str] = (),
+    ) -> T:
+        """
+        Runs ``run`` against the connection picked for this read, falling
+        back to the primary when the replica can not be reached.
+        """
+        name: str = self.get_read_connection_name(key, keys)
+
+        if name == self.primary:
+            return await run(self.get_client(self.primary))
+
+        try:
+            return await run(self.get_client(name))
+        except CONNECTION_ERRORS:
+            logger.warning(
+                "Read replica %s failed, taking it out of rotation",
+                name,
+                exc_info=True,
+            )
+            self.healthy.discard(name)
+
+        return await run(self.get_client(self.primary))
+
+    async def check_health(self):
+        for name, client in self.replicas.items():
+            try:
+                if name not in self._connected:
+                    await wait_for(
+                        client.create_connection(with_db=True),
+                        self.health_check_timeout,
+                    )
+                    self._connected.add(name)
+
+                await wait_for(
+                    client.execute_query("SELECT 1"),
+                    self.health_check_timeout,
+                )
+            except Exception:
+                if name in self.healthy:
+                    logger.warning(
+                        "Read replica %s failed its health check",
+                        name,
+                        exc_info=True,
+                    )
+                    self.healthy.discard(name)
+            else:
+                if name not in self.healthy:
+                    logger.info("Read replica %s is back in rotation", name)
+                    self.healthy.add(name)
+
+    async def _health_check_loop(self):
+        while True:
+            await self.check_health()
+            await sleep(self.health_check_interval)
+
+    def start(self):
+        if self.replicas and self._health_check_task is None:
+            self._health_check_task = create_task(self._health_check_loop())
+
+    async def stop(self):
+        if self._health_check_task is None:
+            return
+
+        self._health_check_task.cancel()
+        try:
+            await self._health_check_task
+        except CancelledError:
+            pass
+
+        self._health_check_task = None
+
+        for name in self._connected:
+            await self.replicas[name].close()
+
+        self._connected.clear()
+        self.healthy.clear()
+
+
+replica_router = ReplicaRouter(
+    primary=PRIMARY_CONNECTION,
+    replicas={
+        f"replica_{index}": InstrumentedAsyncpgDBClient(
+            connection_name=f"replica_{index}",
+            **get_connection_config(db_uri)["credentials"],
+        )
+        for index, db_uri in enumerate(settings.POSTGRES_REPLICA_URIS)
+    },
+    read_after_write_window=settings.POSTGRES_READ_AFTER_WRITE_WINDOW,
+    health_check_interval=settings.POSTGRES_REPLICA_HEALTH_CHECK_INTERVAL,
+    health_check_timeout=settings.POSTGRES_REPLICA_HEALTH_CHECK_TIMEOUT,
+)
@@ -0,0 +1,45 @@
+from pathlib import Path
+from typing import List, Optional
+
+from tortoise.exceptions import OperationalError
+
+from app.db.exceptions import SchemaVersionError
+from app.db.queries import get_applied_migrations
+
+
+MIGRATIONS_FOLDER: Path = Path(__file__).parent.joinpath(
+    "migrations", "models"
+)
+
+
+def get_latest_migration(folder: Path = MIGRATIONS_FOLDER) -> Optional[str]:
+    # named ``<number>_<timestamp>_<name>.sql``, and applied in that order
+    return max(
+        (path.name for path in folder.glob("*.sql")),
+        key=lambda name: int(name.split("_", 1)[0]),
+        default=None,
+    )
+
+
+async def check_schema_version(folder: Path = MIGRATIONS_FOLDER):
+    """
+    Makes sure the last migration the code knows of was applied, by aerich,
+    which takes one query where generating the schemas takes one per table
+    and index. Newer migrations are fine, for the code to be deployed after
+    them.
+    """
+    latest: Optional[str] = get_latest_migration(folder)
+    if latest is None:
+        return
+
+    try:
+        applied: List[str] = await get_applied_migrations("models")
+    except OperationalError:
+        # no aerich table, no migration was ever applied
+        applied = []
+
+    if latest not in applied:
+        raise SchemaVersionError(
+            f'The database schema lacks the migration "{latest}", apply '
+            'the pending migrations with "aerich upgrade".'
+        )
@@ -1,13 +1,36 @@
-from time import perf_counter
+from asyncio import Task, create_task
+from typing import Optional
 
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse, RedirectResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api import api_router
+from app.api.endpoints import metrics_router
 from app.config import settings
 from app.db import init_db
 from app.db.exceptions import UsernameAlreadyInUseError
+from app.db.routing import replica_router
+from app.db.schema import check_schema_version
+from app.metrics import metrics_store
+from app.middleware import (
+    CompressionMiddleware,
+    MetricsMiddleware,
+    RateLimitMiddleware,
+)
+from app.services import (
+    ProfileImageError,
+    ServiceOverloadedError,
+    password_hasher,
+    profile_image_ingestor,
+    username_filter,
+    username_index,
+)
+from app.services.changes import change_relay
+from app.services.cleanup import profile_image_collector
+from app.services.media import media_files
+from app.services.purge import user_purger
+from app.services.warmup import warm_up
 
 
 app = FastAPI(
@@ -15,6 +38,9 @@ app = FastAPI(
     openapi_url=f"{settings.API_PREFIX}/openapi.json",
 )
 
+# innermost, for its rejections to still get the CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,14 +49,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CompressionMiddleware)
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = perf_counter() * 1000
-    response = await call_next(request)
-    process_time = perf_counter() * 1000 - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# added last so that it wraps, and measures, every other middleware
+app.add_middleware(MetricsMiddleware)
 
 
 @app.exception_handler(UsernameAlreadyInUseError)
@@ -43,6 +65,46 @@ async def unicorn_exception_handler(
     )
 
 
+@app.exception_handler(ServiceOverloadedError)
+async def service_overloaded_exception_handler(
+    request: Request, exc: ServiceOverloadedError
+):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": exc.msg},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(ProfileImageError)
+async def profile_image_exception_handler(
+    request: Request, exc: ProfileImageError
+):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"detail": exc.msg},
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_worker_pools():
+    warm_up_task: Optional[Task] = getattr(app.state, "warm_up_task", None)
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+
+    if metrics_store is not None:
+        await metrics_store.stop()
+
+    await replica_router.stop()
+    await username_index.stop()
+    await username_filter.stop()
+    await change_relay.stop()
+    await profile_image_collector.stop()
+    await user_purger.stop()
+    await profile_image_ingestor.aclose()
+    password_hasher.shutdown()
+
+
 @app.get("/")
 def index():
     return RedirectResponse(
@@ -51,5 +113,41 @@ def index():
 
 
 app.include_router(api_router, prefix=settings.API_PREFIX)
+app.include_router(metrics_router)
+app.mount(settings.PROFILE_IMAGES_URL_PATH, media_files)
 
 init_db(app=app)
+
+
+# registered after ``init_db`` so that the ORM is ready when workers start
+@app.on_event("startup")
+async def check_database_schema():
+    if settings.DB_SCHEMA_CHECK:
+        await check_schema_version()
+
+
+@app.on_event("startup")
+async def start_profile_image_workers():
+    if metrics_store is not None:
+        metrics_store.start()
+
+    replica_router.start()
+    await profile_image_ingestor.start()
+
+    if settings.USERNAME_INDEX_ENABLED:
+        username_index.start()
+
+    if settings.USERNAME_FILTER_ENABLED:
+        username_filter.start()
+
+    if settings.CHANGES_RELAY_ENABLED:
+        change_relay.start()
+
+    if settings.PROFILE_IMAGE_GC_ENABLED:
+        profile_image_collector.start()
+
+    if settings.USERS_PURGE_ENABLED:
+        user_purger.start()
+
+    if settings.STARTUP_WARM_UP:
+        app.state.warm_up_task = create_task(warm_up())
@@ -0,0 +1,18 @@
+from .exposition import CONTENT_TYPE, collect, merge, render
+from .multiprocess import MultiprocessStore, metrics_store
+from .registry import DEFAULT_BUCKETS, REGISTRY, Counter, Gauge, Histogram
+
+
+__all__ = [
+    "CONTENT_TYPE",
+    "DEFAULT_BUCKETS",
+    "REGISTRY",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MultiprocessStore",
+    "collect",
+    "merge",
+    "metrics_store",
+    "render",
+]
@@ -0,0 +1,158 @@
+from math import inf
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from app.metrics.registry import REGISTRY, Metric
+
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+# A snapshot maps each metric name to a JSON serializable description of the
+#  metric and its samples, as ``[label values, value]`` pairs. Histogram
+#  values are dicts of their per bucket counts, count and sum.
+Snapshot = Dict[str, Dict]
+
+
+def collect(registry: Mapping[str, Metric] = REGISTRY) -> Snapshot:
+    snapshot: Snapshot = {}
+
+    for metric in registry.values():
+        samples: List[list] = []
+
+        for labelvalues, child in metric.children():
+            if metric.type == "histogram":
+                value = {
+                    "bucket_counts": list(child.bucket_counts),
+                    "count": child.count,
+                    "sum": child.sum,
+                }
+            else:
+                value = child.value
+
+            samples.append([list(labelvalues), value])
+
+        snapshot[metric.name] = {
+            "type": metric.type,
+            "documentation": metric.documentation,
+            "labelnames": list(metric.labelnames),
+            "buckets": list(getattr(metric, "buckets", [])),
+            "samples": samples,
+        }
+
+    return snapshot
+
+
+def merge(snapshots: Iterable[Snapshot]) -> Snapshot:
+    """
+    Adds up the samples of several snapshots, typically one per worker.
+    """
+    merged: Snapshot = {}
+    merged_samples: Dict[str, Dict[Tuple[str, ...], object]] = {}
+
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = {**metric, "samples": []}
+                merged_samples[name] = {}
+
+            samples = merged_samples[name]
+            for labelvalues, value in metric["samples"]:
+                key: Tuple[str, ...] = tuple(labelvalues)
+                current = samples.get(key)
+
+                if current is None:
+                    samples[key] = (
+                        {
+                            **value,
+                            "bucket_counts": list(value["bucket_counts"]),
+                        }
+                        if metric["type"] == "histogram"
+                        else value
+                    )
+                elif metric["type"] == "histogram":
+                    current["count"] += value["count"]
+                    current["sum"] += value["sum"]
+                    current["bucket_counts"] = [
+                        a + b
+                        for a, b in zip(
+                            current["bucket_counts"], value["bucket_counts"]
+                        )
+                    ]
+                else:
+                    samples[key] = current + value
+
+    for name, samples in merged_samples.items():
+        merged[name]["samples"] = [
+            [list(key), value] for key, value in samples.items()
+        ]
+
+    return merged
+
+
+def format_value(value: float) -> str:
+    if value == inf:
+        return "+Inf"
+
+    return repr(float(value))
+
+
+def format_sample(
+    name: str, labels: Sequence[Tuple[str, str]], value: float
+) -> str:
+    if not labels:
+        return f"{name} {format_value(value)}"
+
+    formatted_labels: str = ",".join(
+        '{}="{}"'.format(
+            label,
+            str(label_value)
+            .replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"'),
+        )
+        for label, label_value in labels
+    )
+    return f"{name}{{{formatted_labels}}} {format_value(value)}"
+
+
+def render(snapshot: Snapshot) -> str:
+    """
+    Renders a snapshot in the Prometheus text exposition format.
+    """
+    lines: List[str] = []
+
+    for name, metric in snapshot.items():
+        documentation: str = (
+            metric["documentation"].replace("\\", "\\\\").replace("\n", "\\n")
+        )
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+
+        for labelvalues, value in metric["samples"]:
+            labels: List[Tuple[str, str]] = list(
+                zip(metric["labelnames"], labelvalues)
+            )
+
+            if metric["type"] != "histogram":
+                lines.append(format_sample(name, labels, value))
+                continue
+
+            # buckets are exposed cumulatively
+            cumulative: int = 0
+            for bound, count in zip(
+                [*metric["buckets"], inf], value["bucket_counts"]
+            ):
+                cumulative += count
+                lines.append(
+                    format_sample(
+                        f"{name}_bucket",
+                        [*labels, ("le", format_value(bound))],
+                        cumulative,
+                    )
+                )
+
+            lines.append(format_sample(f"{name}_sum", labels, value["sum"]))
+            lines.append(
+                format_sample(f"{name}_count", labels, value["count"])
+            )
+
+    return "\n".join(lines) + "\n"
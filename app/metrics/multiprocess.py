@@ -0,0 +1,127 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from json import JSONDecodeError, dumps, loads
+from logging import getLogger
+from os import getpid, kill, replace
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from app.config import settings
+from app.metrics.exposition import Snapshot, collect, merge
+
+
+logger = getLogger(__name__)
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class MultiprocessStore:
+    """
+    Shares metrics between the worker processes of a server through one
+    file per worker in ``directory``. Workers keep recording in memory and
+    only write their file every ``flush_interval`` seconds, plus right
+    before answering a scrape, which then adds up every worker's file.
+
+    Counters and histograms of workers that went away keep counting
+    towards the totals, their gauges are dropped. The directory has to be
+    emptied before the server starts.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        flush_interval: float,
+        collect_local: Callable[[], Snapshot] = collect,
+    ):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.collect_local = collect_local
+        self._flush_task: Optional[Task] = None
+
+    @property
+    def path(self) -> Path:
+        # resolved on every call, as gunicorn forks workers after import
+        return self.directory.joinpath(f"{getpid()}.json")
+
+    def flush(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary_path: Path = self.path.with_suffix(".tmp")
+        temporary_path.write_text(
+            dumps({"pid": getpid(), "metrics": self.collect_local()})
+        )
+        replace(temporary_path, self.path)
+
+    def clear(self):
+        # the files of a previous run, whose workers are long gone
+        for path in self.directory.glob("*.json"):
+            path.unlink(missing_ok=True)
+
+    def read_snapshots(self) -> List[Snapshot]:
+        snapshots: List[Snapshot] = []
+
+        for path in self.directory.glob("*.json"):
+            try:
+                content: Dict = loads(path.read_text())
+            except (OSError, JSONDecodeError):
+                logger.warning("Skipping unreadable metrics file %s", path)
+                continue
+
+            metrics: Snapshot = content["metrics"]
+            if not is_process_alive(content["pid"]):
+                metrics = {
+                    name: metric
+                    for name, metric in metrics.items()
+                    if metric["type"] != "gauge"
+                }
+
+            snapshots.append(metrics)
+
+        return snapshots
+
+    def collect(self) -> Snapshot:
+        self.flush()
+        return merge(self.read_snapshots())
+
+    async def _flush_loop(self):
+        while True:
+            await sleep(self.flush_interval)
+
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Failed to write metrics to %s", self.path)
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is None:
+            return
+
+        self._flush_task.cancel()
+        try:
+            await self._flush_task
+        except CancelledError:
+            pass
+
+        self._flush_task = None
+        self.flush()
+
+
+metrics_store: Optional[MultiprocessStore] = (
+    MultiprocessStore(
+        directory=settings.METRICS_MULTIPROCESS_DIR,
+        flush_interval=settings.METRICS_FLUSH_INTERVAL,
+    )
+    if settings.METRICS_MULTIPROCESS_DIR
+    else None
+)
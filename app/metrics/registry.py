@@ -0,0 +1,133 @@
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Metric:
+    """
+    Base of the Prometheus style metrics below. Metrics are only ever updated
+    from the event loop thread, so plain attribute updates are safe without
+    locks, and every worker process keeps its own values.
+
+    A metric declared with ``labelnames`` is only a parent: values are
+    recorded on the children returned by ``labels``.
+    """
+
+    type: str = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        register: bool = True,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+
+        if register:
+            REGISTRY[name] = self
+
+    def _new_child(self) -> "Metric":
+        return type(self)(self.name, self.documentation, register=False)
+
+    def labels(self, *labelvalues: str) -> "Metric":
+        child = self._children.get(labelvalues)
+
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects the labels {self.labelnames}."
+                )
+
+            child = self._children[labelvalues] = self._new_child()
+
+        return child
+
+    def children(self) -> Iterator[Tuple[Tuple[str, ...], "Metric"]]:
+        if self.labelnames:
+            yield from self._children.items()
+        else:
+            yield (), self
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value: float = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value: float = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram(Metric):
+    """
+    Prometheus style histogram, keeping per bucket (non cumulative) counts.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        register: bool = True,
+    ):
+        super().__init__(name, documentation, labelnames, register)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.bucket_counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(
+            self.name,
+            self.documentation,
+            buckets=self.buckets,
+            register=False,
+        )
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+REGISTRY: Dict[str, Union[Counter, Gauge, Histogram]] = {}
@@ -0,0 +1,6 @@
+from .compression import CompressionMiddleware
+from .metrics import MetricsMiddleware
+from .ratelimit import RateLimitMiddleware
+
+
+__all__ = ["CompressionMiddleware", "MetricsMiddleware", "RateLimitMiddleware"]
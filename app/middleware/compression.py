@@ -0,0 +1,184 @@
+from typing import List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.compression import (
+    Compressor,
+    ResponseCompression,
+    response_compression,
+)
+
+
+CONDITIONAL_HEADERS: Tuple[bytes, ...] = (b"if-match", b"if-none-match")
+
+
+class CompressionMiddleware:
+    """
+    Compresses the responses of compressible content types with the
+    encoding negotiated from the request's ``Accept-Encoding``. Streamed
+    responses are compressed as their chunks come in.
+
+    Responses that already have a ``Content-Encoding`` go through untouched,
+    which is how endpoints send payloads they compressed themselves.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        compression: ResponseCompression = response_compression,
+    ):
+        self.app = app
+        self.compression = compression
+
+    def decode_etags(self, scope: Scope) -> Scope:
+        # the app only ever deals with the etags of uncompressed bodies
+        if not any(
+            name in CONDITIONAL_HEADERS for name, _ in scope["headers"]
+        ):
+            return scope
+
+        headers: List[Tuple[bytes, bytes]] = [
+            (
+                name,
+                self.compression.decode_etags(value.decode("latin-1")).encode(
+                    "latin-1"
+                )
+                if name in CONDITIONAL_HEADERS
+                else value,
+            )
+            for name, value in scope["headers"]
+        ]
+        # updated in place, the scope being where the router leaves the
+        #  matched endpoint for the outer middlewares
+        scope["headers"] = headers
+        return scope
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding: Optional[str] = self.compression.choose_encoding(
+            request_headers.get("accept-encoding")
+        )
+
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(
+            self.compression, encoding, request_headers, send
+        )
+        await self.app(self.decode_etags(scope), receive, responder.send)
+
+
+class CompressionResponder:
+    """
+    Compresses the one response of a request, once its first body message
+    tells whether it is worth it.
+    """
+
+    def __init__(
+        self,
+        compression: ResponseCompression,
+        encoding: str,
+        request_headers: Headers,
+        send: Send,
+    ):
+        self.compression = compression
+        self.encoding = encoding
+        self._send = send
+        # whether the client validates a body it got compressed
+        self.validates_encoded: bool = f'-{encoding}"' in request_headers.get(
+            "if-none-match", ""
+        )
+        self.start: Optional[Message] = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough: bool = False
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start = message
+        elif self.passthrough:
+            await self._send(message)
+        elif message["type"] != "http.response.body":
+            # such as the zero copy sends of files, never compressed
+            await self.send_unchanged(message)
+        elif self.compressor is None:
+            await self.send_first_body(message)
+        else:
+            await self.send_chunk(message)
+
+    async def send_unchanged(self, message: Message):
+        self.passthrough = True
+        await self._send(self.start)
+        await self._send(message)
+
+    async def send_first_body(self, message: Message):
+        headers = MutableHeaders(raw=self.start["headers"])
+        body: bytes = message.get("body", b"")
+        more_body: bool = message.get("more_body", False)
+
+        if self.start["status"] == 304:
+            if self.validates_encoded and "etag" in headers:
+                headers["ETag"] = self.compression.encode_etag(
+                    headers["ETag"], self.encoding
+                )
+
+            await self.send_unchanged(message)
+            return
+
+        if "content-encoding" in headers or not (
+            self.compression.is_compressible(headers.get("content-type"))
+        ):
+            await self.send_unchanged(message)
+            return
+
+        headers.add_vary_header("Accept-Encoding")
+
+        if not more_body and len(body) < self.compression.minimum_size:
+            await self.send_unchanged(message)
+            return
+
+        headers["Content-Encoding"] = self.encoding
+        if "etag" in headers:
+            headers["ETag"] = self.compression.encode_etag(
+                headers["ETag"], self.encoding
+            )
+
+        if not more_body:
+            body = await self.compression.compress(body, self.encoding)
+            headers["Content-Length"] = str(len(body))
+            await self._send(self.start)
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        # the length of a streamed body is only known at its end
+        if "content-length" in headers:
+            del headers["Content-Length"]
+
+        self.compressor = self.compression.get_compressor(self.encoding)
+        await self._send(self.start)
+        await self.send_chunk(message)
+
+    async def send_chunk(self, message: Message):
+        chunk: bytes = self.compressor.compress(message.get("body", b""))
+
+        if not message.get("more_body", False):
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk + self.compressor.finish(),
+                }
+            )
+        elif chunk:
+            # the compressor buffers small chunks until it has enough
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": True,
+                }
+            )
@@ -0,0 +1,81 @@
+from time import perf_counter
+from typing import Callable, Dict, Optional
+
+from starlette.routing import BaseRoute, Mount
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.metrics import Gauge, Histogram
+
+
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress",
+    "Requests currently being handled.",
+    labelnames=("method",),
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request, until its response was fully sent.",
+    labelnames=("method", "route", "status_code"),
+)
+
+UNMATCHED_ROUTE: str = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    Records the latency of every request, labelled with its route template
+    rather than its path so that ids in the path do not blow up the number
+    of series.
+
+    Written as a plain ASGI middleware, as ``BaseHTTPMiddleware`` would add
+    its own overhead to every request it measures.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Optional[Dict[Callable, str]] = None
+
+    def get_route(self, scope: Scope) -> str:
+        # the router leaves the matched endpoint in the scope, routes are
+        #  looked up by it once they are all registered
+        if self._route_paths is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._route_paths = {}
+
+            for route in routes:
+                if isinstance(route, Mount):
+                    # mounted apps are left as the endpoint of their requests
+                    self._route_paths[route.app] = route.path
+                elif isinstance(route, BaseRoute) and hasattr(
+                    route, "endpoint"
+                ):
+                    self._route_paths[route.endpoint] = route.path
+
+        return self._route_paths.get(scope.get("endpoint"), UNMATCHED_ROUTE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method: str = scope["method"]
+        status_code: int = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            await send(message)
+
+        in_progress = http_requests_in_progress.labels(method)
+        in_progress.inc()
+        started_at: float = perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            http_request_duration_seconds.labels(
+                method, self.get_route(scope), str(status_code)
+            ).observe(perf_counter() - started_at)
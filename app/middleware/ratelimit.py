@@ -0,0 +1,95 @@
+from json import dumps
+from math import ceil
+from typing import Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.services.ratelimit import (
+    EXPENSIVE_METHODS,
+    AdmissionControl,
+    RateLimiter,
+    rate_limiter,
+    write_admission,
+)
+
+
+class RateLimitMiddleware:
+    """
+    Rejects, with a 429, the requests of clients over their rate limit, and
+    with a 503 the expensive writes beyond what the worker takes at once,
+    both before they reach the app and with a ``Retry-After``.
+
+    A plain ASGI middleware, for the few microseconds it adds to every
+    request to stay that way.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limiter: RateLimiter = rate_limiter,
+        admission: AdmissionControl = write_admission,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.admission = admission
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method: str = scope["method"]
+
+        if self.limiter.enabled:
+            client: Optional[Tuple[str, int]] = scope.get("client")
+            retry_after: float = await self.limiter.acquire(
+                client[0] if client else "",
+                self.limiter.get_route_class(method),
+            )
+
+            if retry_after:
+                await send_rejection(
+                    send,
+                    429,
+                    "Too many requests, try again later.",
+                    retry_after,
+                )
+                return
+
+        if method not in EXPENSIVE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        if not self.admission.try_acquire():
+            await send_rejection(
+                send,
+                503,
+                "Too many requests being processed, try again later.",
+                self.admission.retry_after,
+            )
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release()
+
+
+async def send_rejection(
+    send: Send, status_code: int, detail: str, retry_after: float
+):
+    body: bytes = dumps({"detail": detail}).encode("utf-8")
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", b"%d" % len(body)),
+                # whole seconds, rounded up so that the retry gets through
+                (b"retry-after", b"%d" % ceil(retry_after)),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -1,14 +1,26 @@
 from .users import (
+    BulkUpdateUser,
+    BulkUserResult,
     CreateUser,
     DisplayUser,
+    DisplayUserChange,
     UpdateUser,
+    UserChangesPage,
     UsernameAlreadyInUseErrorMessage,
+    UsernameAvailability,
+    UserPurgeBacklog,
 )
 
 
 __all__ = [
+    "BulkUpdateUser",
+    "BulkUserResult",
     "DisplayUser",
+    "DisplayUserChange",
     "CreateUser",
     "UpdateUser",
+    "UserChangesPage",
     "UsernameAlreadyInUseErrorMessage",
+    "UsernameAvailability",
+    "UserPurgeBacklog",
 ]
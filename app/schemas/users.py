@@ -1,9 +1,11 @@
 from datetime import datetime
-from typing import Dict, Optional, Union
+from typing import Dict, List, Optional, Union
 from uuid import UUID
 
 from pydantic import BaseModel, SecretStr, constr, stricturl
 
+from app.db.models import ProfileImageStatus, UserChangeType
+
 from .base import BaseConfig
 
 
@@ -11,12 +13,21 @@ class UsernameAlreadyInUseErrorMessage(BaseModel):
     detail: str
 
 
+class UsernameAvailability(BaseModel):
+    username: str
+    available: bool
+
+    class Config(BaseConfig):
+        pass
+
+
 class DisplayUser(BaseModel):
     id: Union[UUID, str]
     username: str
     first_name: str
     last_name: str
     profile_image: str
+    profile_image_status: ProfileImageStatus
     created_at: datetime
     modified_at: datetime
 
@@ -34,6 +45,7 @@ class CreateUser(BaseModel):
     password: SecretStr
     profile_image: stricturl(
         tld_required=False,
+        max_length=255,
         allowed_schemes={"https"},  # noqa: F821
     )
 
@@ -49,9 +61,62 @@ class UpdateUser(BaseModel):
     profile_image: Optional[
         stricturl(
             tld_required=False,
+            max_length=255,
             allowed_schemes={"https"},  # noqa: F821
         )
     ]
 
     class Config(BaseConfig):
         pass
+
+
+class BulkUpdateUser(UpdateUser):
+    id: UUID
+
+    class Config(BaseConfig):
+        pass
+
+
+class BulkUserResult(BaseModel):
+    index: int
+    status_code: int
+    id: Optional[UUID]
+    user: Optional[DisplayUser]
+    detail: Optional[str]
+
+    class Config(BaseConfig):
+        json_encoders: Dict = DisplayUser.Config.json_encoders
+
+
+class DisplayUserChange(BaseModel):
+    seq: int
+    event: UserChangeType
+    user_id: UUID
+    changed_at: datetime
+    # the user as it is when the change is read, null once deleted
+    user: Optional[DisplayUser]
+
+    class Config(BaseConfig):
+        json_encoders: Dict = DisplayUser.Config.json_encoders
+
+
+class UserPurgeBacklog(BaseModel):
+    retention_days: int
+    # the users deleted before are due for the purge
+    deleted_before: datetime
+    # the soft deleted users still in the user table, the ones due included
+    deleted: int
+    pending: int
+    oldest_deleted_at: Optional[datetime]
+
+    class Config(BaseConfig):
+        json_encoders: Dict = DisplayUser.Config.json_encoders
+
+
+class UserChangesPage(BaseModel):
+    changes: List[DisplayUserChange]
+    # the ``since`` of the next page
+    next: int
+
+    class Config(BaseConfig):
+        pass
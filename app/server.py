@@ -0,0 +1,131 @@
+from logging import getLogger
+from math import ceil
+from os import cpu_count
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from gunicorn.workers.base import Worker
+from uvicorn.workers import UvicornWorker
+
+from app.config import settings
+from app.db import forget_connections
+from app.metrics import metrics_store
+
+
+# uvloop and httptools are optional, both come with uvicorn[standard]
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import httptools
+except ImportError:
+    httptools = None
+
+
+logger = getLogger("gunicorn.error")
+
+
+def get_worker_count(
+    cpus: int,
+    workers_per_core: float,
+    pool_max_size: int,
+    max_connections: int,
+) -> int:
+    """
+    Workers for the given CPUs, as many as the database connections allow
+    with each worker holding up to ``pool_max_size`` of them.
+    """
+    by_cpu: int = ceil(cpus * workers_per_core)
+    by_connections: int = max_connections // pool_max_size
+
+    return max(min(by_cpu, by_connections), 1)
+
+
+class ServerWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": "asyncio" if uvloop is None else "uvloop",
+        "http": "h11" if httptools is None else "httptools",
+        # a worker failing to start, on a schema behind the code for one,
+        #  has to exit rather than serve without its startup
+        "lifespan": "on",
+    }
+
+
+def on_starting(arbiter: Arbiter):
+    if metrics_store is not None:
+        metrics_store.clear()
+
+    logger.info(
+        "Starting %d workers, %s event loop, %s parser",
+        arbiter.cfg.workers,
+        ServerWorker.CONFIG_KWARGS["loop"],
+        ServerWorker.CONFIG_KWARGS["http"],
+    )
+
+
+def post_fork(arbiter: Arbiter, worker: Worker):
+    # nothing opens connections while the app is preloaded, this only makes
+    #  sure a worker never uses, nor closes, the ones of the arbiter
+    forget_connections()
+
+
+def get_options(workers: Optional[int] = None) -> Dict[str, Any]:
+    return {
+        "bind": f"{settings.SERVER_HOST}:{settings.SERVER_PORT}",
+        "workers": workers
+        or settings.SERVER_WORKERS
+        or get_worker_count(
+            cpus=cpu_count() or 1,
+            workers_per_core=settings.SERVER_WORKERS_PER_CORE,
+            pool_max_size=settings.POSTGRES_POOL_MAX_SIZE,
+            max_connections=settings.POSTGRES_MAX_CONNECTIONS,
+        ),
+        "worker_class": "app.server.ServerWorker",
+        # imported once, by the arbiter, which then forks ready workers
+        "preload_app": True,
+        "backlog": settings.SERVER_BACKLOG,
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER,
+        "timeout": settings.SERVER_TIMEOUT,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+        # the heartbeat files, kept off the disk where there is a tmpfs
+        "worker_tmp_dir": "/dev/shm" if Path("/dev/shm").is_dir() else None,
+        "on_starting": on_starting,
+        "post_fork": post_fork,
+    }
+
+
+class Server(BaseApplication):
+    """
+    Gunicorn managing uvicorn workers, for production. Workers are forked
+    from an arbiter that already imported the app, and replaced after
+    ``SERVER_MAX_REQUESTS`` requests. On SIGTERM, or when replaced, a worker
+    stops accepting connections and gets ``SERVER_GRACEFUL_TIMEOUT`` seconds
+    to answer the requests it has, then runs the app shutdown.
+    """
+
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+
+        return app
+
+
+def main():
+    Server(get_options()).run()
+
+
+if __name__ == "__main__":
+    main()
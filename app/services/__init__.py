@@ -0,0 +1,19 @@
+from .cache import user_cache, users_list_cache
+from .exceptions import ProfileImageError, ServiceOverloadedError
+from .hashing import password_hasher
+from .images import profile_image_ingestor
+from .loader import user_loader
+from .usernames import username_filter, username_index
+
+
+__all__ = [
+    "ProfileImageError",
+    "ServiceOverloadedError",
+    "password_hasher",
+    "profile_image_ingestor",
+    "user_cache",
+    "user_loader",
+    "username_filter",
+    "username_index",
+    "users_list_cache",
+]
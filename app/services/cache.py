@@ -0,0 +1,331 @@
+from abc import ABC, abstractmethod
+from asyncio import Future, get_running_loop, shield
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from app.config import settings
+from app.metrics import Counter
+
+
+user_cache_hits = Counter(
+    "user_cache_hits_total", "Single user lookups answered from the cache."
+)
+user_cache_misses = Counter(
+    "user_cache_misses_total", "Single user lookups that missed the cache."
+)
+user_cache_evictions = Counter(
+    "user_cache_evictions_total",
+    "Entries evicted from the in-process cache to stay within its size.",
+)
+users_list_cache_hits = Counter(
+    "users_list_cache_hits_total",
+    "Pages of users answered from the payload cache.",
+)
+users_list_cache_misses = Counter(
+    "users_list_cache_misses_total",
+    "Pages of users that missed the payload cache.",
+)
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float):
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    In-process cache bounded both in entries and in time. Each worker keeps
+    its own copy, so invalidations only reach the worker doing the write and
+    the other workers serve stale entries for up to their ttl.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry: Optional[Tuple[float, bytes]] = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            user_cache_evictions.inc()
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache shared by every worker. ``client`` can be anything exposing the
+    ``redis.asyncio.Redis`` get/set/delete coroutines.
+    """
+
+    def __init__(self, client: Any, prefix: str = "crud-user-api:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(f"{self.prefix}{key}")
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(
+            f"{self.prefix}{key}", value, px=max(int(ttl * 1000), 1)
+        )
+
+    async def delete(self, key: str):
+        await self.client.delete(f"{self.prefix}{key}")
+
+
+EPOCH: datetime = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND: timedelta = timedelta(microseconds=1)
+
+
+class CachedResponse(NamedTuple):
+    status_code: int
+    body: bytes
+    # of the user, which the response's validators are derived from
+    modified_at: Optional[datetime] = None
+
+    def encode(self) -> bytes:
+        modified_at: bytes = (
+            b""
+            if self.modified_at is None
+            else b"%d" % ((self.modified_at - EPOCH) // MICROSECOND)
+        )
+        return b"%d:%b:%b" % (self.status_code, modified_at, self.body)
+
+    @classmethod
+    def decode(cls, value: bytes) -> "CachedResponse":
+        status_code, modified_at, body = value.split(b":", 2)
+        return cls(
+            status_code=int(status_code),
+            body=body,
+            modified_at=(
+                EPOCH + int(modified_at) * MICROSECOND if modified_at else None
+            ),
+        )
+
+
+class UserCache:
+    """
+    Read-through cache of rendered single user responses.
+
+    Not found responses are cached too, for ``negative_ttl`` seconds. When
+    several requests miss the same user at once, only the first one runs the
+    loader and the others wait for its result.
+    """
+
+    def __init__(
+        self, backend: Optional[CacheBackend], ttl: float, negative_ttl: float
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._in_flight: Dict[str, Future] = {}
+
+    @staticmethod
+    def get_key(user_id: str) -> str:
+        # the same user can be requested with differently formatted ids, the
+        #  version is that of the encoding of the cached responses
+        try:
+            return f"user:v2:{UUID(user_id)}"
+        except ValueError:
+            return f"user:v2:{user_id}"
+
+    async def get(self, user_id: str) -> Optional[CachedResponse]:
+        if self.backend is not None:
+            value: Optional[bytes] = await self.backend.get(
+                self.get_key(user_id)
+            )
+
+            if value is not None:
+                user_cache_hits.inc()
+                return CachedResponse.decode(value)
+
+        user_cache_misses.inc()
+        return None
+
+    async def get_or_load(
+        self,
+        user_id: str,
+        loader: Callable[[], Awaitable[CachedResponse]],
+    ) -> CachedResponse:
+        response: Optional[CachedResponse] = await self.get(user_id)
+
+        if response is not None:
+            return response
+
+        return await self.load(user_id, loader)
+
+    async def load(
+        self,
+        user_id: str,
+        loader: Callable[[], Awaitable[CachedResponse]],
+    ) -> CachedResponse:
+        """
+        Loads, and caches, a response that missed the cache, sharing the
+        load with the concurrent requests for the same user.
+        """
+        key: str = self.get_key(user_id)
+
+        in_flight: Optional[Future] = self._in_flight.get(key)
+        if in_flight is not None:
+            return await shield(in_flight)
+
+        future: Future = get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            response: CachedResponse = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # marks the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            is_current: bool = self._in_flight.get(key) is future
+            if is_current:
+                del self._in_flight[key]
+
+        future.set_result(response)
+
+        # an invalidation that happened while loading makes the result stale
+        if is_current and self.backend is not None:
+            await self.backend.set(
+                key,
+                response.encode(),
+                self.ttl if response.status_code == 200 else self.negative_ttl,
+            )
+
+        return response
+
+    async def invalidate(self, user_id: str):
+        key: str = self.get_key(user_id)
+        self._in_flight.pop(key, None)
+
+        if self.backend is not None:
+            await self.backend.delete(key)
+
+
+class CachedPayload(NamedTuple):
+    body: bytes
+    # the ETag among them is that of the uncompressed body
+    headers: Dict[str, str]
+    modified_at: Optional[datetime]
+
+
+class PayloadCache:
+    """
+    In-process cache of rendered, and compressed, responses, which are then
+    sent as they are.
+
+    Entries are keyed by the version of the data they were rendered from,
+    which every write bumps through ``bump_version``, so that a response
+    rendered before a write is never served after it. Only the writes of
+    the worker itself bump its version, the writes made through the other
+    workers showing up once the entries expire, after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version: int = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, CachedPayload]]" = (
+            OrderedDict()
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def bump_version(self):
+        self.version += 1
+        # the entries of the previous versions can never be hit again
+        self._entries.clear()
+
+    def get(self, key: Tuple) -> Optional[CachedPayload]:
+        entry: Optional[Tuple[float, CachedPayload]] = self._entries.get(
+            (self.version, *key)
+        )
+
+        if entry is None or entry[0] <= monotonic():
+            if entry is not None:
+                del self._entries[(self.version, *key)]
+
+            users_list_cache_misses.inc()
+            return None
+
+        self._entries.move_to_end((self.version, *key))
+        users_list_cache_hits.inc()
+        return entry[1]
+
+    def set(self, key: Tuple, payload: CachedPayload, version: int):
+        """
+        Caches a payload rendered from the data as of ``version``, which is
+        dropped if a write happened since.
+        """
+        if version != self.version or not self.enabled:
+            return
+
+        self._entries[(version, *key)] = (monotonic() + self.ttl, payload)
+        self._entries.move_to_end((version, *key))
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def build_cache_backend(backend: str) -> Optional[CacheBackend]:
+    if backend == "memory":
+        return LRUCacheBackend(max_size=settings.USER_CACHE_MAX_SIZE)
+
+    if backend == "redis":
+        # redis is an optional dependency, only needed for this backend
+        from redis.asyncio import Redis
+
+        return RedisCacheBackend(client=Redis.from_url(settings.REDIS_URL))
+
+    return None
+
+
+user_cache = UserCache(
+    backend=build_cache_backend(settings.USER_CACHE_BACKEND),
+    ttl=settings.USER_CACHE_TTL,
+    negative_ttl=settings.USER_CACHE_NEGATIVE_TTL,
+)
+
+users_list_cache = PayloadCache(
+    max_size=settings.USERS_LIST_CACHE_SIZE, ttl=settings.USERS_LIST_CACHE_TTL
+)
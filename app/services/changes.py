@@ -0,0 +1,283 @@
+from asyncio import (
+    CancelledError,
+    Event,
+    Task,
+    TimeoutError as AsyncioTimeoutError,
+    create_task,
+    sleep,
+    wait_for,
+)
+from bisect import bisect_right
+from datetime import datetime
+from logging import getLogger
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import asyncpg
+import ujson
+
+from app.config import settings
+from app.db.models import UserChangeType
+from app.db.queries import (
+    USER_CHANGES_CHANNEL,
+    get_last_user_change_seq,
+    get_user_changes,
+)
+from app.metrics import Counter
+from app.utils import DISPLAY_USER_ENCODERS, get_display_user_dict
+
+
+logger = getLogger(__name__)
+
+user_changes_published = Counter(
+    "user_changes_published_total",
+    "User changes the relay of the worker fetched from the outbox.",
+)
+user_changes_read_from_database = Counter(
+    "user_changes_read_from_database_total",
+    "Reads of the change feed too far behind for the relay's buffer.",
+)
+
+
+class Change(NamedTuple):
+    seq: int
+    # rendered once, whatever the number of consumers reading it
+    json: str
+
+
+def render_change(row: Dict) -> Change:
+    """
+    Renders a row of ``get_user_changes`` as a ``DisplayUserChange``.
+    """
+    user: Optional[Dict] = (
+        get_display_user_dict(row)
+        if row["id"] is not None and row["event"] != UserChangeType.DELETED
+        else None
+    )
+
+    return Change(
+        seq=row["seq"],
+        json=ujson.dumps(
+            {
+                "seq": row["seq"],
+                "event": row["event"],
+                "userId": str(row["user_id"]),
+                "changedAt": DISPLAY_USER_ENCODERS[datetime](
+                    row["changed_at"]
+                ),
+                "user": user,
+            },
+            ensure_ascii=False,
+            escape_forward_slashes=False,
+        ),
+    )
+
+
+def render_changes_page(changes: List[Change], since: int) -> bytes:
+    next_seq: int = changes[-1].seq if changes else since
+
+    return (
+        f'{{"changes":[{",".join(change.json for change in changes)}],'
+        f'"next":{next_seq}}}'
+    ).encode("utf-8")
+
+
+def render_change_events(changes: List[Change]) -> str:
+    # server-sent events, the ids being what a reconnecting client sends
+    #  back as its Last-Event-ID
+    return "".join(
+        f"id: {change.seq}\ndata: {change.json}\n\n" for change in changes
+    )
+
+
+class ChangeRelay:
+    """
+    Tails the ``user_change`` outbox for the consumers of the worker's
+    change feed: a dedicated connection LISTENs for the commits recording
+    changes, on which the new changes are fetched in batches and kept in
+    memory, so that consumers waiting for changes are answered without a
+    query of their own.
+
+    The relay polls every ``poll_interval`` too, as notifications are lost
+    along with the connection. Consumers behind the ``buffer_size`` latest
+    changes, or reading while the relay is not running, are answered from
+    the database.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[int, int], Awaitable[List[Dict]]],
+        dsn: Optional[str],
+        batch_size: int,
+        buffer_size: int,
+        poll_interval: float,
+    ):
+        self.load = load
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        # the buffer holds every change after ``_first_seq``, up to
+        #  ``last_seq``, both unknown until the relay started
+        self.last_seq: Optional[int] = None
+        self._first_seq: Optional[int] = None
+        self._seqs: List[int] = []
+        self._changes: List[Change] = []
+        # created once running, to belong to the loop of the worker
+        self._wakeup: Optional[Event] = None
+        self._published: Optional[Event] = None
+        self._task: Optional[Task] = None
+
+    def reset(self, last_seq: int):
+        self.last_seq = self._first_seq = last_seq
+        self._seqs = []
+        self._changes = []
+
+    def publish(self, changes: List[Change]):
+        self._seqs.extend(change.seq for change in changes)
+        self._changes.extend(changes)
+        self.last_seq = self._seqs[-1]
+        user_changes_published.inc(len(changes))
+
+        overflow: int = len(self._changes) - self.buffer_size
+        if overflow > 0:
+            self._first_seq = self._seqs[overflow - 1]
+            del self._seqs[:overflow]
+            del self._changes[:overflow]
+
+        if self._published is not None:
+            self._published.set()
+            self._published = Event()
+
+    def get_buffered(self, after: int, limit: int) -> Optional[List[Change]]:
+        if self._first_seq is None or after < self._first_seq:
+            return None
+
+        start: int = bisect_right(self._seqs, after)
+        return self._changes[start : start + limit]
+
+    async def fetch(self, after: int, limit: int) -> List[Change]:
+        changes: Optional[List[Change]] = self.get_buffered(after, limit)
+
+        if changes is None:
+            user_changes_read_from_database.inc()
+            changes = [
+                render_change(row) for row in await self.load(after, limit)
+            ]
+
+        return changes
+
+    async def wait(self, after: int, timeout: float) -> bool:
+        """
+        Waits up to ``timeout`` seconds for the relay to publish a change
+        following ``after``, answering whether it did.
+        """
+        deadline: float = monotonic() + timeout
+
+        while self.last_seq is None or self.last_seq <= after:
+            remaining: float = deadline - monotonic()
+            if remaining <= 0:
+                return False
+
+            if self._published is None:
+                await sleep(remaining)
+                return False
+
+            try:
+                await wait_for(self._published.wait(), timeout=remaining)
+            except AsyncioTimeoutError:
+                return False
+
+        return True
+
+    async def read(
+        self, after: int, limit: int, timeout: float = 0
+    ) -> List[Change]:
+        """
+        The changes following ``after``, waiting up to ``timeout`` seconds
+        for some when there are none yet.
+        """
+        deadline: float = monotonic() + timeout
+
+        while True:
+            changes: List[Change] = await self.fetch(after, limit)
+            remaining: float = deadline - monotonic()
+
+            if changes or remaining <= 0:
+                return changes
+
+            # the database is read again every poll interval, should the
+            #  relay not be running
+            await self.wait(after, min(remaining, self.poll_interval))
+
+    async def publish_pending(self):
+        while True:
+            rows: List[Dict] = await self.load(self.last_seq, self.batch_size)
+            if rows:
+                self.publish([render_change(row) for row in rows])
+
+            if len(rows) < self.batch_size:
+                return
+
+    def _notify(self, connection, pid: int, channel: str, payload: str):
+        self._wakeup.set()
+
+    async def _listen(self):
+        connection = await asyncpg.connect(self.dsn)
+
+        try:
+            await connection.add_listener(USER_CHANGES_CHANNEL, self._notify)
+            if self.last_seq is None:
+                self.reset(await get_last_user_change_seq())
+
+            while not connection.is_closed():
+                # notifications arriving while fetching coalesce into a
+                #  single wake up
+                self._wakeup.clear()
+                await self.publish_pending()
+
+                try:
+                    await wait_for(
+                        self._wakeup.wait(), timeout=self.poll_interval
+                    )
+                except AsyncioTimeoutError:
+                    pass
+        finally:
+            await connection.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("The change relay failed, restarting it")
+                await sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = Event()
+            self._published = Event()
+            self._task = create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+
+        self._task = None
+
+
+change_relay = ChangeRelay(
+    load=get_user_changes,
+    dsn=settings.POSTGRES_DB_URI,
+    batch_size=settings.CHANGES_BATCH_SIZE,
+    buffer_size=settings.CHANGES_BUFFER_SIZE,
+    poll_interval=settings.CHANGES_POLL_INTERVAL,
+)
@@ -0,0 +1,316 @@
+from asyncio import (
+    AbstractEventLoop,
+    CancelledError,
+    Task,
+    create_task,
+    get_running_loop,
+    sleep,
+)
+from logging import getLogger
+from os import walk
+from pathlib import Path
+from time import monotonic, time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Set
+
+from tortoise.transactions import in_transaction
+
+from app.config import settings
+from app.db import PRIMARY_CONNECTION
+from app.db.queries import (
+    PROFILE_IMAGES_RECONCILE_LOCK,
+    claim_unknown_profile_images,
+    delete_profile_images,
+    delete_released_profile_images,
+    find_active_profile_images,
+    try_advisory_lock,
+)
+from app.metrics import Counter
+from app.services.images import (
+    get_image_file_hash,
+    get_image_files,
+    get_image_path,
+    remove_image_files,
+)
+from app.services.ratelimit import MemoryRateLimitBackend, RateLimit
+
+
+logger = getLogger(__name__)
+
+profile_images_collected = Counter(
+    "profile_images_collected_total",
+    "Profile images removed for no user having them anymore.",
+    labelnames=("reason",),
+)
+profile_image_bytes_reclaimed = Counter(
+    "profile_image_bytes_reclaimed_total",
+    "Bytes of profile image files removed, thumbnails included.",
+    labelnames=("reason",),
+)
+
+
+class ImageFile(NamedTuple):
+    # relative to the images folder
+    path: str
+    size: int
+    modified_at: float
+
+
+def list_image_files(folder: Path) -> Iterator[List[ImageFile]]:
+    """
+    The files of ``folder``, a directory at a time, for the folder to be
+    gone through without ever being listed whole.
+    """
+    for directory, _, names in walk(folder):
+        files: List[ImageFile] = []
+
+        for name in names:
+            path: Path = Path(directory, name)
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            files.append(
+                ImageFile(
+                    path=path.relative_to(folder).as_posix(),
+                    size=stat.st_size,
+                    modified_at=stat.st_mtime,
+                )
+            )
+
+        yield files
+
+
+def remove_empty_folders(folder: Path, paths: Set[str]):
+    for path in paths:
+        try:
+            folder.joinpath(path).rmdir()
+        except OSError:
+            # other files are still in there
+            pass
+
+
+class ProfileImageCollector:
+    """
+    Removes, in the background, the profile images no user has anymore:
+    every ``interval`` seconds the images whose last reference was released,
+    ``batch_size`` at a time, and every ``reconcile_interval`` seconds the
+    files of the images folder neither an image row nor an active user
+    accounts for, such as the images stored per user, or the files left
+    behind by a crash.
+
+    At most ``rate`` files are gone through per second, to leave the disk
+    to the requests.
+    """
+
+    def __init__(
+        self,
+        images_folder: Path,
+        thumbnail_sizes: Sequence[int],
+        interval: float,
+        batch_size: int,
+        rate: float,
+        reconcile_interval: float,
+        grace_period: float,
+    ):
+        self.images_folder = images_folder
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reconcile_interval = reconcile_interval
+        self.grace_period = grace_period
+        self._rate_limit = RateLimit(rate=rate, burst=batch_size)
+        self._limiter = MemoryRateLimitBackend(max_size=1)
+        self._task: Optional[Task] = None
+
+    async def throttle(self, files: int):
+        for _ in range(files):
+            retry_after: float = await self._limiter.acquire(
+                "files", self._rate_limit
+            )
+            while retry_after:
+                await sleep(retry_after)
+                retry_after = await self._limiter.acquire(
+                    "files", self._rate_limit
+                )
+
+    async def remove(self, paths: Sequence[str]):
+        await get_running_loop().run_in_executor(
+            None, remove_image_files, self.images_folder, paths
+        )
+
+    async def collect_released(self) -> int:
+        """
+        Removes the images whose last reference was released, returning the
+        bytes reclaimed.
+        """
+        reclaimed: int = 0
+
+        while True:
+            async with in_transaction(PRIMARY_CONNECTION) as connection:
+                images: List[Dict] = await delete_released_profile_images(
+                    self.batch_size, connection=connection
+                )
+                paths: List[str] = [
+                    path
+                    for image in images
+                    for path in get_image_files(
+                        get_image_path(image["hash"], image["extension"]),
+                        self.thumbnail_sizes,
+                    )
+                ]
+                # removed while the rows are still locked, before anyone
+                #  can store the images again
+                await self.remove(paths)
+
+            size: int = sum(image["size"] for image in images)
+            profile_images_collected.labels("released").inc(len(images))
+            profile_image_bytes_reclaimed.labels("released").inc(size)
+            reclaimed += size
+
+            if len(images) < self.batch_size:
+                return reclaimed
+
+            await self.throttle(len(paths))
+
+    async def reconcile_files(self, files: List[ImageFile]) -> int:
+        settled_before: float = time() - self.grace_period
+        orphans: List[ImageFile] = []
+        stored: Dict[str, List[ImageFile]] = {}
+        legacy: List[ImageFile] = []
+        # the images stored per user no active user has anymore
+        unused: List[ImageFile] = []
+
+        for file in files:
+            # younger files might belong to an image still being stored
+            if file.modified_at >= settled_before:
+                continue
+
+            # left behind by an interrupted write
+            if file.path.endswith(".tmp"):
+                orphans.append(file)
+                continue
+
+            image_hash: Optional[str] = get_image_file_hash(file.path)
+            if image_hash is None:
+                legacy.append(file)
+            else:
+                stored.setdefault(image_hash, []).append(file)
+
+        if legacy:
+            active: Set[str] = await find_active_profile_images(
+                [file.path for file in legacy]
+            )
+            unused = [file for file in legacy if file.path not in active]
+            orphans.extend(unused)
+
+        await self.remove([file.path for file in orphans])
+        # their folders go along with the last of their images
+        await get_running_loop().run_in_executor(
+            None,
+            remove_empty_folders,
+            self.images_folder,
+            {str(Path(file.path).parent) for file in unused},
+        )
+
+        if stored:
+            async with in_transaction(PRIMARY_CONNECTION) as connection:
+                # the images are claimed while their files are removed, any
+                #  attempt to store them again waiting for them to be gone
+                unknown: List[str] = await claim_unknown_profile_images(
+                    list(stored), connection=connection
+                )
+                unknown_files: List[ImageFile] = [
+                    file
+                    for image_hash in unknown
+                    for file in stored[image_hash]
+                ]
+                await self.remove([file.path for file in unknown_files])
+                await delete_profile_images(unknown, connection=connection)
+
+            orphans.extend(unknown_files)
+
+        size: int = sum(file.size for file in orphans)
+        profile_images_collected.labels("orphaned").inc(len(orphans))
+        profile_image_bytes_reclaimed.labels("orphaned").inc(size)
+        return size
+
+    async def reconcile(self) -> int:
+        """
+        Goes through the images folder, removing the files no image, nor
+        active user, accounts for, returning the bytes reclaimed. Only one
+        worker reconciles at a time, the others skip it.
+        """
+        async with try_advisory_lock(PROFILE_IMAGES_RECONCILE_LOCK) as locked:
+            if not locked:
+                return 0
+
+            loop: AbstractEventLoop = get_running_loop()
+            reclaimed: int = 0
+            directories: Iterator[List[ImageFile]] = list_image_files(
+                self.images_folder
+            )
+
+            while True:
+                files: Optional[List[ImageFile]] = await loop.run_in_executor(
+                    None, next, directories, None
+                )
+                if files is None:
+                    return reclaimed
+
+                for start in range(0, len(files), self.batch_size):
+                    batch: List[ImageFile] = files[
+                        start : start + self.batch_size
+                    ]
+                    reclaimed += await self.reconcile_files(batch)
+                    await self.throttle(len(batch))
+
+    async def _run(self):
+        reconcile_at: float = monotonic()
+
+        while True:
+            try:
+                reclaimed: int = await self.collect_released()
+
+                # the released images wait for the reconciliation to end
+                if monotonic() >= reconcile_at:
+                    reconcile_at = monotonic() + self.reconcile_interval
+                    reclaimed += await self.reconcile()
+
+                if reclaimed:
+                    logger.info(
+                        "Reclaimed %d bytes of profile images", reclaimed
+                    )
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to collect profile images")
+
+            await sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+
+        self._task = None
+
+
+profile_image_collector = ProfileImageCollector(
+    images_folder=settings.UPLOAD_FOLDER.joinpath("profile_images"),
+    thumbnail_sizes=settings.PROFILE_IMAGE_THUMBNAIL_SIZES,
+    interval=settings.PROFILE_IMAGE_GC_INTERVAL,
+    batch_size=settings.PROFILE_IMAGE_GC_BATCH_SIZE,
+    rate=settings.PROFILE_IMAGE_GC_RATE,
+    reconcile_interval=settings.PROFILE_IMAGE_GC_RECONCILE_INTERVAL,
+    grace_period=settings.PROFILE_IMAGE_GC_GRACE_PERIOD,
+)
@@ -0,0 +1,192 @@
+from abc import ABC, abstractmethod
+from asyncio import get_running_loop
+from re import compile, escape
+from typing import Callable, Dict, List, Optional, Pattern, Sequence, Tuple
+from zlib import DEFLATED, MAX_WBITS, compressobj
+
+from app.config import settings
+
+
+# brotli and zstandard are optional dependencies, the encodings they
+#  provide are only offered when they are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# preferred first, when the client accepts several with the same weight
+ENCODINGS: Tuple[str, ...] = ("zstd", "br", "gzip")
+
+
+class Compressor(ABC):
+    """
+    Compresses a body incrementally, chunk by chunk, for streamed responses.
+    """
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        pass
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int):
+        # a gzip header and trailer around the deflate stream
+        self._compressor = compressobj(level, DEFLATED, MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def get_available_compressors() -> Dict[str, Callable[[int], Compressor]]:
+    compressors: Dict[str, Callable[[int], Compressor]] = {
+        "gzip": GzipCompressor
+    }
+
+    if brotli is not None:
+        compressors["br"] = BrotliCompressor
+
+    if zstandard is not None:
+        compressors["zstd"] = ZstdCompressor
+
+    return compressors
+
+
+class ResponseCompression:
+    """
+    Negotiates, from ``Accept-Encoding``, and applies the compression of
+    response bodies of at least ``minimum_size`` bytes. Bodies of at least
+    ``offload_size`` bytes are compressed on a thread, the compressors
+    releasing the GIL, so that the event loop keeps serving requests.
+
+    A compressed body is a different representation from the uncompressed
+    one, so its strong ETag has to differ too: the encoding is appended to
+    it, and stripped again from the tags the client sends back.
+    """
+
+    def __init__(
+        self,
+        levels: Dict[str, int],
+        minimum_size: int,
+        offload_size: int,
+        content_types: Sequence[str],
+    ):
+        self.levels = levels
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.content_types = tuple(content_types)
+        self.compressors: Dict[str, Callable[[int], Compressor]] = {
+            encoding: compressor
+            for encoding, compressor in get_available_compressors().items()
+            if encoding in levels
+        }
+        self._encoded_etag: Pattern = compile(
+            '-(?:{})"'.format("|".join(map(escape, self.compressors)))
+        )
+
+    def choose_encoding(self, accept_encoding: Optional[str]) -> Optional[str]:
+        if not accept_encoding:
+            return None
+
+        weights: Dict[str, float] = {}
+        for coding in accept_encoding.split(","):
+            name, _, parameters = coding.partition(";")
+            weight: float = 1.0
+
+            for parameter in parameters.split(";"):
+                key, _, value = parameter.partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        weight = float(value)
+                    except ValueError:
+                        weight = 0.0
+
+            weights[name.strip().lower()] = weight
+
+        candidates: List[Tuple[float, int, str]] = [
+            (weights.get(encoding, weights.get("*", 0.0)), -index, encoding)
+            for index, encoding in enumerate(ENCODINGS)
+            if encoding in self.compressors
+        ]
+        if not candidates:
+            return None
+
+        weight, _, encoding = max(candidates)
+        return encoding if weight > 0 else None
+
+    def is_compressible(self, content_type: Optional[str]) -> bool:
+        # the compressors hold small chunks back, where each event of a
+        #  stream has to reach the client as soon as it is sent
+        return (
+            bool(content_type)
+            and content_type.startswith(self.content_types)
+            and not content_type.startswith("text/event-stream")
+        )
+
+    def get_compressor(self, encoding: str) -> Compressor:
+        return self.compressors[encoding](self.levels[encoding])
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        compressor: Compressor = self.get_compressor(encoding)
+        return compressor.compress(body) + compressor.finish()
+
+    async def compress(self, body: bytes, encoding: str) -> bytes:
+        if len(body) < self.offload_size:
+            return self._compress(body, encoding)
+
+        return await get_running_loop().run_in_executor(
+            None, self._compress, body, encoding
+        )
+
+    @staticmethod
+    def encode_etag(etag: str, encoding: str) -> str:
+        return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+    def decode_etags(self, header: str) -> str:
+        return self._encoded_etag.sub('"', header)
+
+
+response_compression = ResponseCompression(
+    levels={
+        "gzip": settings.COMPRESSION_GZIP_LEVEL,
+        "br": settings.COMPRESSION_BROTLI_QUALITY,
+        "zstd": settings.COMPRESSION_ZSTD_LEVEL,
+    },
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    offload_size=settings.COMPRESSION_OFFLOAD_SIZE,
+    content_types=("application/json", "application/x-ndjson", "text/"),
+)
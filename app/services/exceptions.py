@@ -0,0 +1,9 @@
+class ServiceOverloadedError(Exception):
+    def __init__(self, msg: str, retry_after: int):
+        self.msg = msg
+        self.retry_after = retry_after
+
+
+class ProfileImageError(Exception):
+    def __init__(self, msg: str):
+        self.msg = msg
@@ -0,0 +1,136 @@
+from asyncio import CancelledError, Queue, create_task
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import ujson
+
+from app.config import settings
+from app.db.queries import copy_active_users, get_users_modified_after
+from app.utils import (
+    DISPLAY_USER_ENCODERS,
+    encode_cursor,
+    get_display_user_dict,
+    get_utc_now,
+)
+
+
+# the id sorting first, pointing right before any user of a timestamp
+NIL_USER_ID: UUID = UUID(int=0)
+
+
+def get_export_start(
+    modified_since: Optional[datetime],
+) -> Tuple[datetime, UUID]:
+    if modified_since is None:
+        return datetime.min.replace(tzinfo=timezone.utc), NIL_USER_ID
+
+    # timestamps without an offset are taken as UTC
+    if modified_since.tzinfo is None:
+        modified_since = modified_since.replace(tzinfo=timezone.utc)
+
+    return modified_since, NIL_USER_ID
+
+
+def get_snapshot_checkpoint() -> str:
+    """
+    The cursor to resume from after a snapshot starting now: whatever
+    commits once it started, and might not be in it, is modified after.
+    """
+    return encode_cursor(
+        get_utc_now() - timedelta(seconds=settings.USERS_EXPORT_SETTLE_DELAY),
+        NIL_USER_ID,
+    )
+
+
+def render_export_line(row: Dict) -> str:
+    # deleted users only go out as tombstones
+    line: Dict = (
+        get_display_user_dict(row)
+        if row["deleted_at"] is None
+        else {
+            "id": str(row["id"]),
+            "deletedAt": DISPLAY_USER_ENCODERS[datetime](row["deleted_at"]),
+        }
+    )
+
+    return (
+        ujson.dumps(line, ensure_ascii=False, escape_forward_slashes=False)
+        + "\n"
+    )
+
+
+def render_checkpoint(modified_at: datetime, user_id: UUID) -> str:
+    return (
+        ujson.dumps({"checkpoint": encode_cursor(modified_at, user_id)}) + "\n"
+    )
+
+
+async def stream_modified_users(
+    after: Tuple[datetime, UUID]
+) -> AsyncIterator[str]:
+    """
+    Every user modified after ``after``, as NDJSON, each batch followed by
+    a checkpoint line to resume the export from.
+    """
+    modified_at, user_id = after
+
+    while True:
+        rows: List[Dict] = await get_users_modified_after(
+            modified_at,
+            user_id,
+            settle_delay=settings.USERS_EXPORT_SETTLE_DELAY,
+            limit=settings.USERS_EXPORT_BATCH_SIZE,
+        )
+
+        if rows:
+            modified_at, user_id = rows[-1]["modified_at"], rows[-1]["id"]
+
+        yield "".join(map(render_export_line, rows)) + render_checkpoint(
+            modified_at, user_id
+        )
+
+        if len(rows) < settings.USERS_EXPORT_BATCH_SIZE:
+            return
+
+
+async def stream_snapshot(format: str) -> AsyncIterator[bytes]:
+    """
+    Streams the ``COPY`` of every active user, without the rows ever being
+    built in Python. At most ``USERS_EXPORT_BUFFERED_CHUNKS`` chunks wait
+    for a slow client, the copy being paused meanwhile.
+    """
+    chunks: "Queue[Optional[bytes]]" = Queue(
+        maxsize=settings.USERS_EXPORT_BUFFERED_CHUNKS
+    )
+
+    async def copy():
+        # the end of the copy is marked with None, unless it was cancelled,
+        #  in which case nobody is reading anymore
+        try:
+            await copy_active_users(chunks.put, format)
+        except Exception:
+            await chunks.put(None)
+            raise
+
+        await chunks.put(None)
+
+    task = create_task(copy())
+
+    try:
+        while True:
+            chunk: Optional[bytes] = await chunks.get()
+            if chunk is None:
+                break
+
+            yield chunk
+
+        # raises whatever interrupted the copy
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except CancelledError:
+                pass
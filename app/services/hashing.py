@@ -0,0 +1,154 @@
+from asyncio import Semaphore, gather, get_running_loop
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from functools import lru_cache
+from time import monotonic
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.metrics import Histogram
+from app.services.exceptions import ServiceOverloadedError
+
+
+# imported with the first hash, in whichever worker computes it
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+MIN_BCRYPT_ROUNDS: int = 4
+
+hashing_queue_wait_seconds = Histogram(
+    "password_hashing_queue_wait_seconds",
+    "Time a password spent waiting for a free hashing worker.",
+)
+hashing_duration_seconds = Histogram(
+    "password_hashing_duration_seconds",
+    "Time spent computing a single bcrypt hash.",
+)
+
+
+@lru_cache(maxsize=None)
+def get_password_context(rounds: int) -> "CryptContext":
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds
+    )
+
+
+def _hash_password(password: str, rounds: int) -> Tuple[str, float, float]:
+    # monotonic() reads a system wide clock, so the timestamps taken here are
+    #  comparable with the ones taken on the event loop even in a subprocess
+    started_at: float = monotonic()
+    hashed_password: str = get_password_context(rounds).hash(password)
+    return hashed_password, started_at, monotonic()
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a bounded worker pool so that hashing never blocks the
+    event loop. Once ``max_queue_depth`` hashes are pending, new requests are
+    rejected straight away instead of piling up behind the pool.
+    """
+
+    def __init__(
+        self,
+        pool_type: str,
+        pool_size: int,
+        max_queue_depth: int,
+        rounds: int,
+        retry_after: int,
+    ):
+        self.pool_type = pool_type
+        self.pool_size = pool_size
+        self.max_queue_depth = max_queue_depth
+        self.rounds = rounds
+        self.retry_after = retry_after
+        self.pending: int = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        # created lazily so that no worker is spawned before gunicorn forks
+        if self._executor is None:
+            self._executor = (
+                ProcessPoolExecutor(max_workers=self.pool_size)
+                if self.pool_type == "process"
+                else ThreadPoolExecutor(
+                    max_workers=self.pool_size,
+                    thread_name_prefix="password-hasher",
+                )
+            )
+
+        return self._executor
+
+    async def hash(self, password: str) -> str:
+        if self.pending >= self.max_queue_depth:
+            raise ServiceOverloadedError(
+                msg="Too many password hashing requests, try again later.",
+                retry_after=self.retry_after,
+            )
+
+        self.pending += 1
+        enqueued_at: float = monotonic()
+
+        try:
+            hashed_password, started_at, finished_at = await (
+                get_running_loop().run_in_executor(
+                    self.executor, _hash_password, password, self.rounds
+                )
+            )
+        finally:
+            self.pending -= 1
+
+        hashing_queue_wait_seconds.observe(started_at - enqueued_at)
+        hashing_duration_seconds.observe(finished_at - started_at)
+
+        return hashed_password
+
+    async def warm_up(self):
+        """
+        Loads the bcrypt backend in the workers of the pool, with the
+        cheapest hashes bcrypt allows, so that the first passwords to hash
+        do not pay for it.
+        """
+        loop = get_running_loop()
+        await gather(
+            *(
+                loop.run_in_executor(
+                    self.executor, _hash_password, "", MIN_BCRYPT_ROUNDS
+                )
+                for _ in range(self.pool_size)
+            )
+        )
+
+    async def hash_many(self, passwords: Sequence[str]) -> List[str]:
+        """
+        Hashes a whole batch in parallel while keeping at most ``pool_size``
+        of its passwords in the queue, so that a big batch neither trips the
+        queue depth limit nor starves single user requests.
+        """
+        semaphore: Semaphore = Semaphore(self.pool_size)
+
+        async def hash_one(password: str) -> str:
+            async with semaphore:
+                return await self.hash(password)
+
+        return list(await gather(*(hash_one(p) for p in passwords)))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    pool_type=settings.PASSWORD_HASHING_POOL_TYPE,
+    pool_size=settings.PASSWORD_HASHING_POOL_SIZE,
+    max_queue_depth=settings.PASSWORD_HASHING_MAX_QUEUE_DEPTH,
+    rounds=settings.BCRYPT_ROUNDS,
+    retry_after=settings.PASSWORD_HASHING_RETRY_AFTER,
+)
@@ -0,0 +1,593 @@
+from asyncio import (
+    CancelledError,
+    Queue,
+    QueueFull,
+    Task,
+    TimeoutError as AsyncioTimeoutError,
+    create_task,
+    gather,
+    get_running_loop,
+    sleep,
+    wait_for,
+)
+from concurrent.futures import Executor, ProcessPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from logging import getLogger
+from os import replace
+from pathlib import Path
+from re import compile
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    Match,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+from uuid import UUID
+
+from tortoise.expressions import RawSQL
+from tortoise.transactions import in_transaction
+
+from app.config import settings
+from app.db import PRIMARY_CONNECTION
+from app.db.models import ProfileImageStatus, User, UserChangeType
+from app.db.queries import (
+    acquire_profile_image,
+    acquire_profile_image_by_url,
+    record_user_changes,
+    release_profile_image,
+)
+from app.db.routing import replica_router
+from app.metrics import Histogram
+from app.services.cache import user_cache, users_list_cache
+from app.services.exceptions import ProfileImageError, ServiceOverloadedError
+
+
+# Pillow and httpx are imported on first use, or by the warm up once the
+#  worker started, instead of delaying every worker boot
+if TYPE_CHECKING:
+    from httpx import AsyncBaseTransport, AsyncClient
+    from PIL import Image
+
+
+logger = getLogger(__name__)
+
+profile_image_download_seconds = Histogram(
+    "profile_image_download_seconds",
+    "Time spent downloading a profile image, failed downloads included.",
+)
+profile_image_reencode_seconds = Histogram(
+    "profile_image_reencode_seconds",
+    "Time spent re-encoding a downloaded profile image.",
+)
+
+# webp images are re-encoded as png
+IMAGE_EXTENSIONS: Dict[str, str] = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".png",
+}
+
+
+IMAGE_PATH: Pattern = compile(r"[0-9a-f]{2}/([0-9a-f]{64})\.[a-z]+")
+# any of the files of a stored image: the image, its WebP copy, thumbnails
+IMAGE_FILE_PATH: Pattern = compile(
+    r"[0-9a-f]{2}/([0-9a-f]{64})(?:-[0-9]+)?\.[a-z]+"
+)
+
+
+class StoredImage(NamedTuple):
+    hash: str
+    extension: str
+    # of the image and its thumbnails together
+    size: int
+
+
+def get_image_path(image_hash: str, extension: str) -> str:
+    # sharded by the first byte of the hash to keep directories small
+    return f"{image_hash[:2]}/{image_hash}{extension}"
+
+
+def get_thumbnail_path(profile_image: str, size: int) -> str:
+    """
+    Path of the square WebP thumbnail of ``size`` pixels generated for a
+    stored profile image.
+    """
+    folder, name = profile_image.split("/")
+    return f"{folder}/{name.split('.')[0]}-{size}.webp"
+
+
+def get_webp_path(profile_image: str) -> str:
+    """
+    Path of the full size WebP copy of a stored profile image, sent instead
+    to the clients accepting WebP.
+    """
+    return f"{profile_image.split('.')[0]}.webp"
+
+
+def get_image_hash(profile_image: str) -> Optional[str]:
+    """
+    Hash of a content-addressed profile image, None for the images stored
+    per user, in date folders, before the images were deduplicated.
+    """
+    match: Optional[Match] = IMAGE_PATH.fullmatch(profile_image)
+    return match.group(1) if match else None
+
+
+def get_image_files(
+    profile_image: str, thumbnail_sizes: Sequence[int]
+) -> Tuple[str, ...]:
+    return (
+        profile_image,
+        get_webp_path(profile_image),
+        *(get_thumbnail_path(profile_image, size) for size in thumbnail_sizes),
+    )
+
+
+def get_image_file_hash(path: str) -> Optional[str]:
+    """
+    Hash of the stored image a file of the images folder belongs to, None
+    for the images stored per user.
+    """
+    match: Optional[Match] = IMAGE_FILE_PATH.fullmatch(path)
+    return match.group(1) if match else None
+
+
+def save_image(
+    img: "Image.Image", destination: Path, image_format: str, **kwargs
+):
+    # written next to its destination first so that readers never observe
+    #  a partially written file
+    temporary_destination: Path = destination.with_name(
+        f"{destination.name}.tmp"
+    )
+    img.save(temporary_destination, image_format, **kwargs)
+    replace(temporary_destination, destination)
+
+
+def store_image(
+    data: bytearray,
+    mime_type: str,
+    folder: str,
+    thumbnail_sizes: Sequence[int],
+) -> StoredImage:
+    """
+    Runs in the image processing pool, away from the event loop.
+
+    Images are stored under the sha256 of their decoded pixels, so that the
+    same image is only encoded and stored once, however many users have it
+    and whatever the urls it was downloaded from. The image is written
+    last, after its WebP copy and thumbnails, so that its presence tells
+    that they are all there.
+    """
+    from PIL import Image, ImageOps
+
+    img: Image.Image = Image.open(BytesIO(data))
+    img.load()
+
+    # webp images lose their transparency, as they always did
+    if mime_type == "image/png" and (
+        "A" in img.getbands() or "transparency" in img.info
+    ):
+        img = img.convert("RGBA")
+    else:
+        img = img.convert("RGB")
+
+    image_format: str = "JPEG" if mime_type == "image/jpeg" else "PNG"
+    digest = sha256(
+        f"{image_format}:{img.mode}:{img.width}x{img.height}:".encode()
+    )
+    digest.update(img.tobytes())
+    image_hash: str = digest.hexdigest()
+    extension: str = IMAGE_EXTENSIONS[mime_type]
+    profile_image: str = get_image_path(image_hash, extension)
+
+    destination: Path = Path(folder, profile_image)
+    webp_destination: Path = Path(folder, get_webp_path(profile_image))
+    thumbnails: List[Tuple[int, Path]] = [
+        (size, Path(folder, get_thumbnail_path(profile_image, size)))
+        for size in thumbnail_sizes
+    ]
+
+    if not destination.is_file():
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        save_image(img, webp_destination, "WEBP", quality=80)
+
+        for size, thumbnail_destination in thumbnails:
+            # square, cropped to the center, and never upscaled
+            side: int = min(size, img.width, img.height)
+            save_image(
+                ImageOps.fit(img, (side, side), Image.LANCZOS),
+                thumbnail_destination,
+                "WEBP",
+                quality=80,
+            )
+
+        if image_format == "JPEG":
+            save_image(
+                img,
+                destination,
+                "JPEG",
+                quality=85,
+                progressive=True,
+                optimize=True,
+            )
+        else:
+            save_image(img, destination, "PNG")
+
+    return StoredImage(
+        hash=image_hash,
+        extension=extension,
+        size=destination.stat().st_size
+        + webp_destination.stat().st_size
+        + sum(path.stat().st_size for _, path in thumbnails),
+    )
+
+
+def remove_image_files(folder: Path, paths: Sequence[str]):
+    for path in paths:
+        try:
+            folder.joinpath(path).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ProfileImageIngestor:
+    """
+    Downloads profile images with an async http client and re-encodes them
+    on a process pool.
+
+    Images can either be ingested inline, through ``download_image_from_url``
+    or queued with ``enqueue`` to be processed by the background workers
+    started with ``start``. While queued, the user's ``profile_image`` holds
+    the source url and its ``profile_image_status`` is ``pending``.
+    """
+
+    def __init__(
+        self,
+        upload_folder: Path,
+        max_bytes: int,
+        timeout: float,
+        pool_size: int,
+        workers: int,
+        queue_size: int,
+        retry_after: int,
+        requeue_interval: float,
+        thumbnail_sizes: Sequence[int] = (),
+        transport: Optional["AsyncBaseTransport"] = None,
+    ):
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.requeue_interval = requeue_interval
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        # lets the benchmarks send the downloads to a local server
+        self.transport = transport
+        self._executor: Optional[Executor] = None
+        self._http_client: Optional["AsyncClient"] = None
+        self._queue: Optional[Queue] = None
+        self._tasks: List[Task] = []
+
+    @property
+    def images_folder(self) -> Path:
+        return self.upload_folder.joinpath("profile_images")
+
+    @property
+    def executor(self) -> Executor:
+        # created lazily so that no worker is spawned before gunicorn forks
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+
+        return self._executor
+
+    @property
+    def http_client(self) -> "AsyncClient":
+        if self._http_client is None:
+            from httpx import AsyncClient, Limits, Timeout
+
+            self._http_client = AsyncClient(
+                follow_redirects=True,
+                timeout=Timeout(self.timeout),
+                limits=Limits(max_connections=100),
+                transport=self.transport,
+            )
+
+        return self._http_client
+
+    async def download(self, url: str) -> Tuple[bytearray, str]:
+        from httpx import HTTPError
+
+        try:
+            return await wait_for(self._download(url), timeout=self.timeout)
+        except AsyncioTimeoutError:
+            raise ProfileImageError(
+                f"Timed out after {self.timeout} seconds trying to read "
+                f'"{url}".'
+            )
+        except HTTPError as e:
+            raise ProfileImageError(
+                f'Error occurred trying to read "{url}". {e}'
+            )
+
+    async def _download(self, url: str) -> Tuple[bytearray, str]:
+        async with self.http_client.stream("GET", url) as res:
+            if res.is_error:
+                raise ProfileImageError(
+                    f'Error occurred trying to read "{url}". STATUS CODE: '
+                    f"{res.status_code}"
+                )
+
+            mime_type: str = (
+                res.headers.get("content-type", "").split(";")[0].lower()
+            )
+            if mime_type not in IMAGE_EXTENSIONS:
+                raise ProfileImageError(
+                    'Invalid mime type, only accepting: "image/jpeg", '
+                    '"image/png" or "image/webp". But we detected '
+                    f"{mime_type}."
+                )
+
+            content_length: int = int(res.headers.get("content-length") or 0)
+            if content_length > self.max_bytes:
+                raise ProfileImageError(
+                    f'The image at "{url}" is bigger than the allowed '
+                    f"{self.max_bytes} bytes."
+                )
+
+            # preallocating when the size is known avoids growing the buffer
+            #  (and copying it over) while the chunks come in
+            buffer: bytearray = bytearray(content_length)
+            size: int = 0
+
+            async for chunk in res.aiter_bytes():
+                end: int = size + len(chunk)
+                if end > self.max_bytes:
+                    raise ProfileImageError(
+                        f'The image at "{url}" is bigger than the allowed '
+                        f"{self.max_bytes} bytes."
+                    )
+
+                buffer[size:end] = chunk
+                size = end
+
+            del buffer[size:]
+
+            return buffer, mime_type
+
+    async def store_image_from_url(self, url: str) -> StoredImage:
+        started_at: float = perf_counter()
+        try:
+            data, mime_type = await self.download(url)
+        finally:
+            profile_image_download_seconds.observe(perf_counter() - started_at)
+
+        started_at = perf_counter()
+        try:
+            return await get_running_loop().run_in_executor(
+                self.executor,
+                store_image,
+                data,
+                mime_type,
+                str(self.images_folder),
+                self.thumbnail_sizes,
+            )
+        except (OSError, ValueError) as e:
+            raise ProfileImageError(
+                f'The file at "{url}" is not a valid image. {e}'
+            )
+        finally:
+            profile_image_reencode_seconds.observe(perf_counter() - started_at)
+
+    async def download_image_from_url(self, url: str) -> str:
+        """
+        Stores the image at ``url`` and takes a reference to it, to be
+        released with ``release`` once no longer used, returning its path.
+        Urls already downloaded from are not downloaded again.
+        """
+        image: Optional[Dict] = await acquire_profile_image_by_url(url)
+        if image is not None:
+            return get_image_path(image["hash"], image["extension"])
+
+        stored: StoredImage = await self.store_image_from_url(url)
+        await acquire_profile_image(
+            url,
+            image_hash=stored.hash,
+            extension=stored.extension,
+            size=stored.size,
+        )
+        profile_image: str = get_image_path(stored.hash, stored.extension)
+
+        # the files of an image found on disk might have been removed by
+        #  the collector, after the release of its last reference, before
+        #  this one was taken
+        if not self.images_folder.joinpath(profile_image).is_file():
+            await self.store_image_from_url(url)
+
+        return profile_image
+
+    async def release(self, profile_image: str):
+        """
+        Releases a user's reference to their profile image. The images no
+        user has anymore are removed in the background, by the
+        ``ProfileImageCollector``.
+        """
+        image_hash: Optional[str] = get_image_hash(profile_image)
+
+        # images stored per user are only ever used by a single user, their
+        #  files go once no active user has them
+        if image_hash is not None:
+            await release_profile_image(image_hash)
+
+    def ensure_capacity(self):
+        if self._queue is None:
+            raise RuntimeError("The profile image workers are not running.")
+
+        if self._queue.full():
+            raise ServiceOverloadedError(
+                msg="Too many profile images waiting to be processed.",
+                retry_after=self.retry_after,
+            )
+
+    def enqueue(self, user_id: Union[UUID, str], url: str):
+        try:
+            self._queue.put_nowait((user_id, url))
+        except QueueFull:
+            # the image stays pending until the queue drains and it is
+            #  loaded again from the database
+            logger.warning("Profile image queue is full, skipping %s", url)
+
+    async def start(self):
+        self._queue = Queue(maxsize=self.queue_size)
+        self._tasks = [create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(create_task(self._requeue_pending()))
+
+    async def _requeue_pending(self):
+        """
+        The queue only lives in memory, so whenever it drains the pending
+        images are loaded again from the database. This picks up the images
+        left behind by a restart and the ones ``enqueue`` found no room for.
+        """
+        while True:
+            await self._queue.join()
+
+            try:
+                pending: List[Tuple[UUID, str]] = (
+                    await User.filter(
+                        profile_image_status=ProfileImageStatus.PENDING,
+                        deleted_at__isnull=True,
+                    )
+                    .limit(self.queue_size)
+                    .values_list("id", "profile_image")
+                )
+            except Exception:
+                logger.exception("Failed to load pending profile images")
+                pending = []
+
+            for user_id, url in pending:
+                if self._queue.full():
+                    break
+
+                self._queue.put_nowait((user_id, url))
+
+            if len(pending) < self.queue_size:
+                await sleep(self.requeue_interval)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+        await gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def aclose(self):
+        await self.stop()
+
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _work(self):
+        while True:
+            user_id, url = await self._queue.get()
+
+            try:
+                await self._process(user_id=user_id, url=url)
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to process profile image %s", url)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    async def settle(
+        user_id: Union[UUID, str], url: str, **fields: Any
+    ) -> int:
+        """
+        Updates the profile image of the user, recording the change, as
+        long as the user still has ``url`` queued and was not deleted.
+        """
+        async with in_transaction(PRIMARY_CONNECTION) as connection:
+            # update() leaves auto_now alone, while the etags of the user and
+            #  the incremental export both follow modified_at
+            updated: int = (
+                await User.filter(
+                    id=user_id,
+                    profile_image=url,
+                    profile_image_status=ProfileImageStatus.PENDING,
+                    deleted_at__isnull=True,
+                )
+                .using_db(connection)
+                .update(modified_at=RawSQL("now()"), **fields)
+            )
+            if updated:
+                await record_user_changes(
+                    UserChangeType.UPDATED, [user_id], connection
+                )
+
+        return updated
+
+    async def _process(self, user_id: Union[UUID, str], url: str):
+        try:
+            profile_image: str = await self.download_image_from_url(url)
+        except ProfileImageError as e:
+            logger.warning(
+                "Profile image of user %s failed: %s", user_id, e.msg
+            )
+            await self.settle(
+                user_id, url, profile_image_status=ProfileImageStatus.FAILED
+            )
+            replica_router.mark_written(str(user_id))
+            users_list_cache.bump_version()
+            await user_cache.invalidate(str(user_id))
+            return
+
+        # only settle the image the user still has queued, a newer update
+        #  might have replaced it in the meantime
+        updated: int = await self.settle(
+            user_id,
+            url,
+            profile_image=profile_image,
+            profile_image_status=ProfileImageStatus.READY,
+        )
+        if not updated:
+            await self.release(profile_image)
+            return
+
+        replica_router.mark_written(str(user_id))
+        users_list_cache.bump_version()
+        await user_cache.invalidate(str(user_id))
+
+
+profile_image_ingestor = ProfileImageIngestor(
+    upload_folder=settings.UPLOAD_FOLDER,
+    max_bytes=settings.PROFILE_IMAGE_MAX_BYTES,
+    timeout=settings.PROFILE_IMAGE_DOWNLOAD_TIMEOUT,
+    pool_size=settings.PROFILE_IMAGE_PROCESSING_POOL_SIZE,
+    workers=settings.PROFILE_IMAGE_WORKERS,
+    queue_size=settings.PROFILE_IMAGE_QUEUE_SIZE,
+    retry_after=settings.PROFILE_IMAGE_RETRY_AFTER,
+    requeue_interval=settings.PROFILE_IMAGE_REQUEUE_INTERVAL,
+    thumbnail_sizes=settings.PROFILE_IMAGE_THUMBNAIL_SIZES,
+)
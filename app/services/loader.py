@@ -0,0 +1,116 @@
+from asyncio import (
+    Future,
+    Handle,
+    create_task,
+    gather,
+    get_running_loop,
+    shield,
+)
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from app.config import settings
+from app.db.queries import get_users_by_ids
+from app.db.routing import replica_router
+from app.metrics import Histogram
+
+
+user_loader_batch_size = Histogram(
+    "user_loader_batch_size",
+    "Number of distinct users fetched by each batched lookup query.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+
+class UserLoader:
+    """
+    Coalesces the user lookups made concurrently, by any number of requests,
+    into a single query.
+
+    The first lookup of a batch schedules its dispatch ``batch_window``
+    seconds later, or on the next iteration of the event loop when the
+    window is 0, and every lookup made in the meantime joins the batch. A
+    batch reaching ``max_batch_size`` users is dispatched straight away.
+
+    Lookups resolve to the user's row, soft deleted users included, or to
+    None when there is no such user.
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[List[UUID]], Awaitable[List[Dict]]],
+        batch_window: float,
+        max_batch_size: int,
+    ):
+        self.load_many = load_many
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._batch: Dict[UUID, Future] = {}
+        self._dispatch_handle: Optional[Handle] = None
+
+    async def load(self, user_id: UUID) -> Optional[Dict]:
+        future: Optional[Future] = self._batch.get(user_id)
+
+        if future is None:
+            loop = get_running_loop()
+            future = self._batch[user_id] = loop.create_future()
+
+            if len(self._batch) >= self.max_batch_size:
+                self.dispatch()
+            elif self._dispatch_handle is None:
+                if self.batch_window > 0:
+                    self._dispatch_handle = loop.call_later(
+                        self.batch_window, self.dispatch
+                    )
+                else:
+                    self._dispatch_handle = loop.call_soon(self.dispatch)
+
+        # one caller being cancelled must not cancel the lookup for the
+        #  others waiting on the same user
+        return await shield(future)
+
+    async def load_all(self, user_ids: Sequence[UUID]) -> List[Optional[Dict]]:
+        return list(await gather(*map(self.load, user_ids)))
+
+    def dispatch(self):
+        if self._dispatch_handle is not None:
+            self._dispatch_handle.cancel()
+            self._dispatch_handle = None
+
+        batch, self._batch = self._batch, {}
+        if batch:
+            create_task(self._run(batch))
+
+    async def _run(self, batch: Dict[UUID, Future]):
+        user_loader_batch_size.observe(len(batch))
+
+        try:
+            rows: List[Dict] = await self.load_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # marks the exception as retrieved when every caller of
+                    #  this user has been cancelled
+                    future.exception()
+
+            return
+
+        rows_by_id: Dict[UUID, Dict] = {row["id"]: row for row in rows}
+        for user_id, future in batch.items():
+            if not future.done():
+                future.set_result(rows_by_id.get(user_id))
+
+
+async def load_users(user_ids: List[UUID]) -> List[Dict]:
+    return await replica_router.read(
+        lambda connection: get_users_by_ids(user_ids, connection=connection),
+        keys=[str(user_id) for user_id in user_ids],
+    )
+
+
+user_loader = UserLoader(
+    load_many=load_users,
+    batch_window=settings.USER_LOADER_BATCH_WINDOW,
+    max_batch_size=settings.USER_LOADER_MAX_BATCH_SIZE,
+)
@@ -0,0 +1,433 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from os import fstat, stat_result
+from pathlib import Path
+from re import compile
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import aiofiles
+from aiofiles.threadpool.binary import AsyncBufferedReader
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+from app.config import settings
+from app.metrics import Counter
+from app.services.images import get_image_hash, get_webp_path
+from app.utils import format_http_date, is_not_modified
+
+
+media_cache_hits = Counter(
+    "media_cache_hits_total",
+    "Media files sent from the in-process cache.",
+)
+media_cache_misses = Counter(
+    "media_cache_misses_total",
+    "Media files read from disk, cacheable or not.",
+)
+
+MEDIA_TYPES: Dict[str, str] = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+}
+# content-addressed images and their thumbnails, or the images stored per
+#  user, in date folders, before the images were deduplicated
+MEDIA_PATH: Pattern = compile(
+    r"(?:[0-9a-f]{2}/[0-9a-f]{64}(?:-[0-9]+)?"
+    r"|[0-9]{4}-[0-9]{2}-[0-9]{2}/[0-9A-Za-z-]+)"
+    r"\.(jpg|png|webp)"
+)
+# a content-addressed file never changes, a new image gets a new path
+CONTENT_ADDRESSED: Pattern = compile(r"[0-9a-f]{2}/[0-9a-f]{64}")
+BYTE_RANGE: Pattern = compile(r"bytes=([0-9]*)-([0-9]*)")
+ZERO_COPY_SEND: str = "http.response.zerocopysend"
+
+IMMUTABLE: bytes = b"public, max-age=31536000, immutable"
+REVALIDATE: bytes = b"no-cache"
+
+
+class MediaFile(NamedTuple):
+    size: int
+    etag: str
+    last_modified: datetime
+    # every header but those depending on the range sent
+    headers: List[Tuple[bytes, bytes]]
+    immutable: bool
+
+
+class CachedMediaFile(NamedTuple):
+    file: MediaFile
+    body: bytes
+
+
+def parse_byte_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Start and end, exclusive, of the single byte range of a ``Range``
+    header, None when the whole file is to be sent instead, as for multiple
+    ranges or other units. Raises ValueError for unsatisfiable ranges.
+    """
+    match = BYTE_RANGE.fullmatch(value.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        if not last:
+            return None
+
+        # the last ``last`` bytes
+        if int(last) == 0:
+            raise ValueError(f"Unsatisfiable range {value}")
+
+        return max(size - int(last), 0), size
+
+    start: int = int(first)
+    if start >= size:
+        raise ValueError(f"Unsatisfiable range {value}")
+
+    end: int = min(int(last) + 1, size) if last else size
+    return (start, end) if end > start else None
+
+
+def accepts_webp(accept: Optional[str]) -> bool:
+    # only an explicit image/webp counts, not the */* every client sends
+    for media_range in (accept or "").split(","):
+        media_type, _, parameters = media_range.partition(";")
+        if media_type.strip().lower() == "image/webp":
+            return parameters.replace(" ", "") not in ("q=0", "q=0.0")
+
+    return False
+
+
+class MediaFileCache:
+    """
+    In-process LRU of small, immutable, media files bounded in bytes, for
+    the hottest thumbnails to be sent without touching the disk. Entries
+    are never checked against the disk again, so the files that can change
+    in place, those revalidated, are never cached. Files removed from the
+    disk are only dropped from it once evicted, which is harmless as no
+    user refers to them anymore.
+    """
+
+    def __init__(self, max_bytes: int, max_file_size: int):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.size: int = 0
+        self._entries: "OrderedDict[Tuple[str, ...], CachedMediaFile]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def accepts(self, file: MediaFile) -> bool:
+        return (
+            file.immutable
+            and file.size <= self.max_file_size
+            and file.size <= self.max_bytes
+        )
+
+    def get(self, key: Tuple[str, ...]) -> Optional[CachedMediaFile]:
+        entry: Optional[CachedMediaFile] = self._entries.get(key)
+
+        if entry is None:
+            media_cache_misses.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        media_cache_hits.inc()
+        return entry
+
+    def set(self, key: Tuple[str, ...], entry: CachedMediaFile):
+        previous: Optional[CachedMediaFile] = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous.body)
+
+        self._entries[key] = entry
+        self.size += len(entry.body)
+
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+
+class MediaFiles:
+    """
+    ASGI app serving the stored profile images, mounted like starlette's
+    ``StaticFiles``, with what a busy image server needs on top of it:
+
+    - single byte ``Range`` requests, and ``If-Range``
+    - ``ETag`` and ``Last-Modified`` validators, and the conditional
+      requests evaluating them
+    - immutable ``Cache-Control`` for content-addressed files
+    - the WebP copy of an image to the clients accepting WebP
+    - zero copy sends when the server supports the ASGI extension for it,
+      otherwise reads off the event loop through ``aiofiles``
+    - an in-process cache of the small files, see ``MediaFileCache``
+    """
+
+    def __init__(
+        self, directory: Path, cache: MediaFileCache, chunk_size: int
+    ):
+        self.directory = directory
+        self.cache = cache
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def is_negotiated(path: str) -> bool:
+        # content-addressed images, which all have a WebP copy
+        return not path.endswith(".webp") and get_image_hash(path) is not None
+
+    def get_representations(
+        self, path: str, accept: Optional[str]
+    ) -> List[str]:
+        """
+        Files that can be sent for ``path``, the preferred one first.
+        """
+        if self.is_negotiated(path) and accepts_webp(accept):
+            return [get_webp_path(path), path]
+
+        return [path]
+
+    @staticmethod
+    def is_immutable(path: str) -> bool:
+        return CONTENT_ADDRESSED.match(path) is not None
+
+    @staticmethod
+    def get_media_file(path: str, stat: stat_result, vary: bool) -> MediaFile:
+        immutable: bool = MediaFiles.is_immutable(path)
+        last_modified: datetime = datetime.fromtimestamp(
+            int(stat.st_mtime), tz=timezone.utc
+        )
+        # the hash, or the path, of the file and its modification time
+        etag: str = '"{}-{:x}"'.format(
+            path.split("/")[1].split(".")[0], stat.st_mtime_ns
+        )
+        headers: List[Tuple[bytes, bytes]] = [
+            (b"content-type", MEDIA_TYPES[path.rsplit(".", 1)[1]].encode()),
+            (b"etag", etag.encode()),
+            (b"last-modified", format_http_date(last_modified).encode()),
+            (b"cache-control", IMMUTABLE if immutable else REVALIDATE),
+            (b"accept-ranges", b"bytes"),
+        ]
+        if vary:
+            headers.append((b"vary", b"Accept"))
+
+        return MediaFile(
+            size=stat.st_size,
+            etag=etag,
+            last_modified=last_modified,
+            headers=headers,
+            immutable=immutable,
+        )
+
+    async def open(
+        self, paths: List[str]
+    ) -> Optional[Tuple[AsyncBufferedReader, MediaFile]]:
+        for path in paths:
+            try:
+                file: AsyncBufferedReader = await aiofiles.open(
+                    self.directory.joinpath(path), mode="rb"
+                )
+            except (FileNotFoundError, IsADirectoryError):
+                continue
+
+            # cheap on an open file, no need to leave the event loop
+            return file, self.get_media_file(
+                path, fstat(file.fileno()), vary=self.is_negotiated(paths[-1])
+            )
+
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        assert scope["type"] == "http"
+
+        if scope["method"] not in ("GET", "HEAD"):
+            await send_empty(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        path: str = scope["path"].lstrip("/")
+        if MEDIA_PATH.fullmatch(path) is None:
+            await send_empty(send, 404)
+            return
+
+        request_headers = Headers(scope=scope)
+        paths: List[str] = self.get_representations(
+            path, request_headers.get("accept")
+        )
+        key: Tuple[str, ...] = tuple(paths)
+        # the others are read from disk every time, to be sent as they are
+        #  now, see ``MediaFileCache``
+        cacheable: bool = all(self.is_immutable(path) for path in paths)
+
+        cached: Optional[CachedMediaFile] = (
+            self.cache.get(key) if cacheable else None
+        )
+        if cached is not None:
+            await self.send(scope, send, request_headers, cached.file, cached)
+            return
+
+        opened = await self.open(paths)
+        if opened is None:
+            await send_empty(send, 404)
+            return
+
+        file, media_file = opened
+        try:
+            if cacheable and self.cache.accepts(media_file):
+                cached = CachedMediaFile(media_file, await file.read())
+                self.cache.set(key, cached)
+
+            await self.send(
+                scope, send, request_headers, media_file, cached or file
+            )
+        finally:
+            await file.close()
+
+    async def send(
+        self,
+        scope: Scope,
+        send: Send,
+        request_headers: Headers,
+        media_file: MediaFile,
+        content: Union[CachedMediaFile, AsyncBufferedReader],
+    ):
+        if is_not_modified(
+            request_headers, media_file.etag, media_file.last_modified
+        ):
+            await send_empty(send, 304, media_file.headers)
+            return
+
+        try:
+            byte_range: Optional[Tuple[int, int]] = self.get_byte_range(
+                request_headers, media_file
+            )
+        except ValueError:
+            await send_empty(
+                send,
+                416,
+                [(b"content-range", b"bytes */%d" % media_file.size)],
+            )
+            return
+
+        start, end = byte_range or (0, media_file.size)
+        headers: List[Tuple[bytes, bytes]] = [
+            *media_file.headers,
+            (b"content-length", b"%d" % (end - start)),
+        ]
+        if byte_range is not None:
+            headers.append(
+                (
+                    b"content-range",
+                    b"bytes %d-%d/%d" % (start, end - 1, media_file.size),
+                )
+            )
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200 if byte_range is None else 206,
+                "headers": headers,
+            }
+        )
+
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+        elif isinstance(content, CachedMediaFile):
+            await send(
+                {"type": "http.response.body", "body": content.body[start:end]}
+            )
+        else:
+            await self.send_file(scope, send, content, start, end)
+
+    @staticmethod
+    def get_byte_range(
+        request_headers: Headers, media_file: MediaFile
+    ) -> Optional[Tuple[int, int]]:
+        range_header: Optional[str] = request_headers.get("range")
+        if range_header is None:
+            return None
+
+        # the range only applies to the representation the client has
+        if_range: Optional[str] = request_headers.get("if-range")
+        if if_range is not None and if_range not in (
+            media_file.etag,
+            format_http_date(media_file.last_modified),
+        ):
+            return None
+
+        return parse_byte_range(range_header, media_file.size)
+
+    async def send_file(
+        self,
+        scope: Scope,
+        send: Send,
+        file: AsyncBufferedReader,
+        start: int,
+        end: int,
+    ):
+        if ZERO_COPY_SEND in scope.get("extensions", {}):
+            await send(
+                {
+                    "type": ZERO_COPY_SEND,
+                    "file": file,
+                    "offset": start,
+                    "count": end - start,
+                }
+            )
+            return
+
+        if start:
+            await file.seek(start)
+
+        remaining: int = end - start
+        while True:
+            chunk: bytes = await file.read(min(self.chunk_size, remaining))
+            remaining -= len(chunk)
+            more_body: bool = bool(chunk) and remaining > 0
+
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": more_body,
+                }
+            )
+            if not more_body:
+                return
+
+
+async def send_empty(
+    send: Send, status_code: int, headers: Sequence[Tuple[bytes, bytes]] = ()
+):
+    # a 304 has no body, rather than an empty one
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [*headers]
+            if status_code == 304
+            else [*headers, (b"content-length", b"0")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+media_files = MediaFiles(
+    directory=settings.UPLOAD_FOLDER.joinpath("profile_images"),
+    cache=MediaFileCache(
+        max_bytes=settings.MEDIA_CACHE_MAX_BYTES,
+        max_file_size=settings.MEDIA_CACHE_MAX_FILE_SIZE,
+    ),
+    chunk_size=settings.MEDIA_CHUNK_SIZE,
+)
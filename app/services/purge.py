@@ -0,0 +1,104 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from datetime import datetime, timedelta
+from logging import getLogger
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.db.queries import archive_deleted_users, get_deleted_users_summary
+from app.metrics import Counter
+from app.services.cache import user_cache
+from app.utils import get_utc_now
+
+
+logger = getLogger(__name__)
+
+users_purged = Counter(
+    "users_purged_total",
+    "Soft deleted users moved to the archive once past the retention.",
+)
+
+
+class UserPurger:
+    """
+    Moves the users deleted for longer than ``retention_days`` to the
+    archive, every ``interval`` seconds, keeping the ``user`` table and its
+    indexes to the users still read.
+
+    Users are moved ``batch_size`` at a time, a statement each, so that no
+    lock is held for long, the workers purging at the same time skipping
+    each other's users. Their profile images were released when they were
+    deleted, the ``ProfileImageCollector`` removes them.
+    """
+
+    def __init__(self, retention_days: int, interval: float, batch_size: int):
+        self.retention_days = retention_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[Task] = None
+
+    def get_deleted_before(self) -> datetime:
+        return get_utc_now() - timedelta(days=self.retention_days)
+
+    async def purge(self) -> int:
+        deleted_before: datetime = self.get_deleted_before()
+        purged: int = 0
+
+        while True:
+            users: List[Dict] = await archive_deleted_users(
+                deleted_before, self.batch_size
+            )
+
+            # cached as deleted, they are not found anymore
+            for user in users:
+                await user_cache.invalidate(str(user["id"]))
+
+            users_purged.inc(len(users))
+            purged += len(users)
+
+            if len(users) < self.batch_size:
+                return purged
+
+    async def get_backlog(self) -> Dict:
+        deleted_before: datetime = self.get_deleted_before()
+
+        return {
+            "retention_days": self.retention_days,
+            "deleted_before": deleted_before,
+            **await get_deleted_users_summary(deleted_before),
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                purged: int = await self.purge()
+                if purged:
+                    logger.info("Purged %d deleted users", purged)
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to purge the deleted users")
+
+            await sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+
+        self._task = None
+
+
+user_purger = UserPurger(
+    retention_days=settings.USERS_DELETED_RETENTION_DAYS,
+    interval=settings.USERS_PURGE_INTERVAL,
+    batch_size=settings.USERS_PURGE_BATCH_SIZE,
+)
@@ -0,0 +1,225 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from logging import getLogger
+from time import monotonic, time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.config import settings
+from app.metrics import Counter
+
+
+logger = getLogger(__name__)
+
+rate_limited_requests = Counter(
+    "rate_limited_requests_total",
+    "Requests rejected for going over their client's rate limit.",
+    labelnames=("route_class",),
+)
+rate_limit_backend_errors = Counter(
+    "rate_limit_backend_errors_total",
+    "Rate limit checks that failed, letting their request through.",
+)
+admission_rejected_requests = Counter(
+    "admission_rejected_requests_total",
+    "Expensive requests rejected for the worker already having too many.",
+)
+
+READ_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+# the writes hashing a password and/or downloading a profile image
+EXPENSIVE_METHODS = frozenset(("POST", "PUT", "PATCH"))
+
+
+class RateLimit(NamedTuple):
+    # tokens added per second, and the most a bucket can hold
+    rate: float
+    burst: int
+
+
+class RateLimitBackend(ABC):
+    @abstractmethod
+    async def acquire(self, key: str, limit: RateLimit) -> float:
+        """
+        Takes a token from the bucket of ``key``, answering 0 when there
+        was one, otherwise how many seconds until there is.
+        """
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets kept by each worker, so that a client gets the limit once
+    per worker it reaches. Buckets idle for long are full, so the least
+    recently used ones are the ones dropped beyond ``max_size``.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # the tokens left and when they were counted, updated in place
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def acquire(self, key: str, limit: RateLimit) -> float:
+        now: float = monotonic()
+        bucket: Optional[List[float]] = self._buckets.get(key)
+
+        if bucket is None:
+            bucket = self._buckets[key] = [limit.burst, now]
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(
+                bucket[0] + (now - bucket[1]) * limit.rate, limit.burst
+            )
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+
+        return (1 - bucket[0]) / limit.rate
+
+
+# refills and takes from the bucket in one round trip, atomically. The
+#  result is a string, as redis truncates the numbers lua returns
+TOKEN_BUCKET_SCRIPT: str = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+
+tokens = math.min(tokens + math.max(now - updated_at, 0) * rate, burst)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets shared by every worker, and every server. ``client`` can
+    be anything exposing the ``redis.asyncio.Redis`` ``register_script``.
+    """
+
+    def __init__(self, client: Any, prefix: str = "crud-user-api:rate:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key: str, limit: RateLimit) -> float:
+        # the wall clock, shared by the servers, unlike monotonic()
+        retry_after: bytes = await self._script(
+            keys=[f"{self.prefix}{key}"],
+            args=[limit.rate, limit.burst, time()],
+        )
+        return float(retry_after)
+
+
+class RateLimiter:
+    """
+    Limits the requests of each client, per route class: reads, and writes,
+    each with their own token bucket. Clients are told apart by address,
+    the one of the proxy in front of the server once uvicorn resolved its
+    forwarded headers.
+
+    When the backend fails, requests go through rather than being rejected.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[RateLimitBackend],
+        limits: Dict[str, RateLimit],
+    ):
+        self.backend = backend
+        self.limits = limits
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def get_route_class(method: str) -> str:
+        return "read" if method in READ_METHODS else "write"
+
+    async def acquire(self, client: str, route_class: str) -> float:
+        try:
+            retry_after: float = await self.backend.acquire(
+                f"{route_class}:{client}", self.limits[route_class]
+            )
+        except Exception:
+            rate_limit_backend_errors.inc()
+            logger.exception("Failed to check the rate limit of %s", client)
+            return 0
+
+        if retry_after:
+            rate_limited_requests.labels(route_class).inc()
+
+        return retry_after
+
+
+class AdmissionControl:
+    """
+    Caps the expensive requests a worker handles at once, rejecting the ones
+    beyond ``max_concurrency`` straight away, so that a burst of them leaves
+    room for the cheap ones instead of piling up on the event loop and the
+    worker pools.
+    """
+
+    def __init__(self, max_concurrency: int, retry_after: int):
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.in_flight: int = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.max_concurrency:
+            admission_rejected_requests.inc()
+            return False
+
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+def build_rate_limit_backend(backend: str) -> Optional[RateLimitBackend]:
+    if backend == "memory":
+        return MemoryRateLimitBackend(max_size=settings.RATE_LIMIT_MAX_CLIENTS)
+
+    if backend == "redis":
+        # redis is an optional dependency, only needed for this backend
+        from redis.asyncio import Redis
+
+        return RedisRateLimitBackend(client=Redis.from_url(settings.REDIS_URL))
+
+    return None
+
+
+rate_limiter = RateLimiter(
+    backend=build_rate_limit_backend(settings.RATE_LIMIT_BACKEND),
+    limits={
+        "read": RateLimit(
+            rate=settings.RATE_LIMIT_READ_RATE,
+            burst=settings.RATE_LIMIT_READ_BURST,
+        ),
+        "write": RateLimit(
+            rate=settings.RATE_LIMIT_WRITE_RATE,
+            burst=settings.RATE_LIMIT_WRITE_BURST,
+        ),
+    },
+)
+
+write_admission = AdmissionControl(
+    max_concurrency=settings.WRITE_MAX_CONCURRENCY,
+    retry_after=settings.WRITE_RETRY_AFTER,
+)
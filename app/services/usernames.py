@@ -0,0 +1,275 @@
+from abc import ABC, abstractmethod
+from asyncio import CancelledError, Task, create_task, sleep
+from bisect import bisect_left
+from hashlib import blake2b
+from logging import getLogger
+from math import ceil, log
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from uuid import UUID
+
+from app.config import settings
+from app.db.queries import (
+    find_taken_usernames,
+    get_active_usernames,
+    get_all_usernames,
+)
+from app.db.routing import replica_router
+from app.metrics import Counter
+
+
+logger = getLogger(__name__)
+
+username_filter_negatives = Counter(
+    "username_filter_negatives_total",
+    "Username checks answered by the filter alone, as available.",
+)
+username_filter_positives = Counter(
+    "username_filter_positives_total",
+    "Username checks the filter could not answer, that went to the database.",
+)
+
+
+class PeriodicallyLoaded(ABC):
+    """
+    In-process copy of data that is fully reloaded, by ``load``, every
+    ``refresh_interval`` seconds once started. Until its first load
+    completes, it is not ``ready``.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], Awaitable[List[str]]],
+        refresh_interval: float,
+    ):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.ready: bool = False
+        self._refresh_task: Optional[Task] = None
+
+    @abstractmethod
+    def replace(self, items: List[str]):
+        pass
+
+    async def refresh(self):
+        self.replace(await self.load())
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to load %s", type(self).__name__)
+
+            await sleep(self.refresh_interval)
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is None:
+            return
+
+        self._refresh_task.cancel()
+        try:
+            await self._refresh_task
+        except CancelledError:
+            pass
+
+        self._refresh_task = None
+
+
+class UsernameIndex(PeriodicallyLoaded):
+    """
+    In-process sorted array of the usernames of active users, answering
+    prefix lookups with a binary search instead of a query.
+
+    The writes of the worker itself are applied as they happen, the ones
+    made through the other workers only once the whole index is reloaded,
+    every ``refresh_interval`` seconds. Until its first load completes, the
+    index is not ``ready`` and lookups have to go to the database.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], Awaitable[List[str]]],
+        refresh_interval: float,
+    ):
+        super().__init__(load, refresh_interval)
+        # lowercased, so that lookups are case insensitive, and paired with
+        #  the username as it was given
+        self._keys: List[str] = []
+        self._usernames: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def replace(self, usernames: List[str]):
+        entries = sorted(
+            (username.lower(), username) for username in usernames
+        )
+        self._keys = [key for key, _ in entries]
+        self._usernames = [username for _, username in entries]
+        self.ready = True
+
+    def _find(self, username: str) -> Optional[int]:
+        key: str = username.lower()
+        index: int = bisect_left(self._keys, key)
+
+        # usernames only unique as given, several can share a key
+        while index < len(self._keys) and self._keys[index] == key:
+            if self._usernames[index] == username:
+                return index
+
+            index += 1
+
+        return None
+
+    def add(self, username: str):
+        # the first load, still to come, will have it
+        if not self.ready or self._find(username) is not None:
+            return
+
+        index: int = bisect_left(self._keys, username.lower())
+        self._keys.insert(index, username.lower())
+        self._usernames.insert(index, username)
+
+    def remove(self, username: str):
+        index: Optional[int] = self._find(username) if self.ready else None
+
+        if index is not None:
+            del self._keys[index]
+            del self._usernames[index]
+
+    def rename(self, previous_username: str, username: str):
+        if previous_username != username:
+            self.remove(previous_username)
+            self.add(username)
+
+    def search(self, prefix: str, limit: int) -> List[str]:
+        key: str = prefix.lower()
+        start: int = bisect_left(self._keys, key)
+        usernames: List[str] = []
+
+        for index in range(start, min(start + limit, len(self._keys))):
+            if not self._keys[index].startswith(key):
+                break
+
+            usernames.append(self._usernames[index])
+
+        return usernames
+
+
+class BloomFilter:
+    """
+    Set of strings answering membership with no false negatives, and false
+    positives for about ``error_rate`` of the strings never added, in a
+    fraction of the memory the strings themselves would take.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size: int = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count: int = max(round(self.size / capacity * log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # the positions of the hashes derived from two halves of one digest
+        digest: bytes = blake2b(item.encode(), digest_size=16).digest()
+        first: int = int.from_bytes(digest[:8], "little")
+        second: int = int.from_bytes(digest[8:], "little") | 1
+
+        return (
+            (first + index * second) % self.size
+            for index in range(self.hash_count)
+        )
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class UsernameFilter(PeriodicallyLoaded):
+    """
+    Bloom filter of every username in use, deleted users included as the
+    unique constraint covers them, telling most available usernames apart
+    without a query. A username it might contain still has to be looked up,
+    and one it does not contain can have been taken through another worker
+    since the last reload: the unique constraint remains what settles it.
+
+    Sized for ``headroom`` times the usernames loaded, so that the usernames
+    added until the next reload keep the error rate down.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], Awaitable[List[str]]],
+        refresh_interval: float,
+        error_rate: float,
+        headroom: float = 2.0,
+    ):
+        super().__init__(load, refresh_interval)
+        self.error_rate = error_rate
+        self.headroom = headroom
+        self._filter: Optional[BloomFilter] = None
+
+    def replace(self, usernames: List[str]):
+        bloom_filter = BloomFilter(
+            capacity=ceil(len(usernames) * self.headroom),
+            error_rate=self.error_rate,
+        )
+        for username in usernames:
+            bloom_filter.add(username)
+
+        self._filter = bloom_filter
+        self.ready = True
+
+    def add(self, username: str):
+        if self._filter is not None:
+            self._filter.add(username)
+
+    def __contains__(self, username: str) -> bool:
+        # anything might be taken until the filter is loaded
+        return self._filter is None or username in self._filter
+
+
+username_index = UsernameIndex(
+    load=get_active_usernames,
+    refresh_interval=settings.USERNAME_INDEX_REFRESH_INTERVAL,
+)
+username_filter = UsernameFilter(
+    load=get_all_usernames,
+    refresh_interval=settings.USERNAME_FILTER_REFRESH_INTERVAL,
+    error_rate=settings.USERNAME_FILTER_ERROR_RATE,
+)
+
+
+async def is_username_taken(
+    username: str, user_id: Optional[UUID] = None, use_filter: bool = True
+) -> bool:
+    """
+    Whether a user, other than ``user_id``, has the username.
+
+    With ``use_filter``, usernames taken through other workers since the
+    last reload of the filter are answered as available, which only suits
+    the checks that the unique constraint settles afterwards.
+    """
+    if use_filter and username not in username_filter:
+        username_filter_negatives.inc()
+        return False
+
+    username_filter_positives.inc()
+    taken_usernames: Dict[str, UUID] = await replica_router.read(
+        lambda connection: find_taken_usernames(
+            [username], connection=connection
+        )
+    )
+    return taken_usernames.get(username, user_id) != user_id
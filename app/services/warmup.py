@@ -0,0 +1,64 @@
+from asyncio import gather, get_running_loop
+from importlib import import_module
+from logging import getLogger
+from time import perf_counter
+from typing import Awaitable, Dict, List, Tuple
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.config import settings
+from app.db import PRIMARY_CONNECTION
+from app.services.hashing import password_hasher
+
+
+logger = getLogger(__name__)
+
+# left out of the worker boot, see ``app.services.images``
+LAZY_MODULES: Tuple[str, ...] = ("httpx", "PIL.Image", "PIL.ImageOps")
+
+
+async def open_connections(connection: BaseDBAsyncClient, count: int):
+    # each concurrent query holds a connection of the pool, which opens as
+    #  many as it needs, up to its maximum size
+    await gather(*(connection.execute_query("SELECT 1") for _ in range(count)))
+
+
+async def import_modules(modules: Tuple[str, ...]):
+    loop = get_running_loop()
+    for module in modules:
+        await loop.run_in_executor(None, import_module, module)
+
+
+async def timed(name: str, step: Awaitable) -> Tuple[str, float]:
+    started_at: float = perf_counter()
+    await step
+    return name, perf_counter() - started_at
+
+
+async def warm_up():
+    """
+    Pays, in the background once the worker accepts requests, for what the
+    first requests would otherwise wait on: opening the connections of the
+    database pool, loading the bcrypt backend in the hashing workers and
+    importing the modules left out of the boot, which the image processing
+    workers forked afterwards inherit.
+    """
+    steps: Dict[str, Awaitable] = {
+        "database pool": open_connections(
+            Tortoise.get_connection(PRIMARY_CONNECTION),
+            settings.POSTGRES_POOL_MAX_SIZE,
+        ),
+        "password hasher": password_hasher.warm_up(),
+        "modules": import_modules(LAZY_MODULES),
+    }
+    results: List = await gather(
+        *(timed(name, step) for name, step in steps.items()),
+        return_exceptions=True,
+    )
+
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to warm up the %s", name, exc_info=result)
+        else:
+            logger.info("Warmed up the %s in %.3fs", name, result[1])
@@ -0,0 +1,30 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generator
+
+import pytest
+
+from app.tests.stub_server import StubImageServer
+
+
+@pytest.fixture(scope="module")
+def stub_server() -> Generator:
+    with StubImageServer(slow_response_delay=1.0) as server:
+        yield server
+
+
+@pytest.fixture
+def run() -> Callable[[Awaitable], Any]:
+    """
+    Runs a coroutine on an event loop of its own, where ``asyncio.run``
+    would leave no current event loop for the test clients of the modules
+    run next.
+    """
+
+    def run_until_complete(coroutine: Awaitable) -> Any:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    return run_until_complete
@@ -0,0 +1,209 @@
+import asyncio
+import json
+from secrets import token_hex
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.db.models import (
+    ProfileImage,
+    ProfileImageSource,
+    ProfileImageStatus,
+    User,
+)
+from app.services import profile_image_ingestor
+from app.services.cleanup import profile_image_collector
+from app.services.images import get_image_hash
+from app.tests.stub_server import StubImageServer
+
+
+BASE_URL: str = "/api/users"
+
+
+def create_pending_user(
+    event_loop: asyncio.AbstractEventLoop, profile_image: str
+) -> User:
+    return event_loop.run_until_complete(
+        User.create(
+            username=f"image-{token_hex(5)}",
+            first_name="Pending",
+            last_name="Image",
+            password="not-a-real-hash",
+            profile_image=profile_image,
+            profile_image_status=ProfileImageStatus.PENDING,
+        )
+    )
+
+
+def test_create_user_with_deferred_image(client: TestClient):
+    response = client.post(
+        BASE_URL,
+        params={"defer_image_processing": True},
+        json={
+            "username": f"image-{token_hex(5)}",
+            "firstName": "Deferred",
+            "lastName": "Image",
+            "password": "123123",
+            "profileImage": "https://www.dutchnews.nl/wpcms/wp-content/uploads/2017/01/Raccoon.jpg",  # noqa
+        },
+    )
+
+    assert response.status_code == 202
+    data = response.json()
+    assert data["profileImageStatus"] == "pending"
+    assert data["profileImage"].startswith("https://")
+
+
+def test_worker_processes_pending_image(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    stub_server: StubImageServer,
+):
+    url: str = stub_server.url("/image.png")
+    user = create_pending_user(event_loop, profile_image=url)
+
+    profile_image_ingestor.enqueue(user_id=user.id, url=url)
+    event_loop.run_until_complete(profile_image_ingestor.join())
+
+    event_loop.run_until_complete(user.refresh_from_db())
+    assert user.profile_image_status == ProfileImageStatus.READY
+    assert get_image_hash(user.profile_image)
+    assert settings.UPLOAD_FOLDER.joinpath(
+        "profile_images", *user.profile_image.split("/")
+    ).is_file()
+
+    response = client.get(f"{BASE_URL}/{user.id}")
+    assert response.json()["profileImageStatus"] == "ready"
+
+
+def test_settled_image_changes_etag(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    stub_server: StubImageServer,
+):
+    url: str = stub_server.url("/image.png")
+    user = create_pending_user(event_loop, profile_image=url)
+    pending = client.get(f"{BASE_URL}/{user.id}")
+    assert pending.json()["profileImageStatus"] == "pending"
+
+    profile_image_ingestor.enqueue(user_id=user.id, url=url)
+    event_loop.run_until_complete(profile_image_ingestor.join())
+
+    # revalidating the pending user gets the settled image
+    response = client.get(
+        f"{BASE_URL}/{user.id}",
+        headers={"If-None-Match": pending.headers["ETag"]},
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != pending.headers["ETag"]
+    assert response.json()["profileImageStatus"] == "ready"
+    assert response.json()["profileImage"] != url
+    assert response.json()["modifiedAt"] > pending.json()["modifiedAt"]
+
+
+def test_settled_image_is_exported_again(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    stub_server: StubImageServer,
+    monkeypatch,
+):
+    monkeypatch.setattr(settings, "USERS_EXPORT_SETTLE_DELAY", 0)
+    url: str = stub_server.url("/image.png")
+    user = create_pending_user(event_loop, profile_image=url)
+
+    lines = [
+        json.loads(line)
+        for line in client.get(f"{BASE_URL}/export").text.splitlines()
+    ]
+    exported = {line["id"]: line for line in lines if "id" in line}
+    assert exported[str(user.id)]["profileImageStatus"] == "pending"
+
+    profile_image_ingestor.enqueue(user_id=user.id, url=url)
+    event_loop.run_until_complete(profile_image_ingestor.join())
+
+    # resuming from the checkpoint of the first export
+    response = client.get(
+        f"{BASE_URL}/export", params={"cursor": lines[-1]["checkpoint"]}
+    )
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    exported = {line["id"]: line for line in lines if "id" in line}
+    assert exported[str(user.id)]["profileImageStatus"] == "ready"
+    assert exported[str(user.id)]["profileImage"] != url
+
+
+def test_worker_marks_failed_image(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    stub_server: StubImageServer,
+):
+    url: str = stub_server.url("/document.txt")
+    user = create_pending_user(event_loop, profile_image=url)
+
+    profile_image_ingestor.enqueue(user_id=user.id, url=url)
+    event_loop.run_until_complete(profile_image_ingestor.join())
+
+    event_loop.run_until_complete(user.refresh_from_db())
+    assert user.profile_image_status == ProfileImageStatus.FAILED
+    assert user.profile_image == url
+
+
+def test_same_image_is_shared(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    stub_server: StubImageServer,
+):
+    url: str = stub_server.url("/avatar.png")
+    users = [create_pending_user(event_loop, profile_image=url) for _ in "ab"]
+
+    for user in users:
+        profile_image_ingestor.enqueue(user_id=user.id, url=url)
+        event_loop.run_until_complete(profile_image_ingestor.join())
+        event_loop.run_until_complete(user.refresh_from_db())
+
+    # the url is only downloaded once
+    assert stub_server.requests["/avatar.png"] == 1
+    assert users[0].profile_image == users[1].profile_image
+    image_hash: str = get_image_hash(users[0].profile_image)
+    image = event_loop.run_until_complete(ProfileImage.get(hash=image_hash))
+    assert image.ref_count == 2
+
+    image_path = settings.UPLOAD_FOLDER.joinpath(
+        "profile_images", *users[0].profile_image.split("/")
+    )
+    event_loop.run_until_complete(
+        profile_image_ingestor.release(users[0].profile_image)
+    )
+    assert image_path.is_file()
+
+    event_loop.run_until_complete(
+        profile_image_ingestor.release(users[1].profile_image)
+    )
+    event_loop.run_until_complete(image.refresh_from_db())
+    assert image.ref_count == 0
+    # the files are left to the collector
+    assert image_path.is_file()
+
+    event_loop.run_until_complete(profile_image_collector.collect_released())
+    assert not image_path.exists()
+    assert not event_loop.run_until_complete(
+        ProfileImageSource.exists(url=url)
+    )
+
+    event_loop.run_until_complete(
+        User.filter(id__in=[user.id for user in users]).delete()
+    )
+
+
+def test_tear_down(event_loop: asyncio.AbstractEventLoop):
+    for user in event_loop.run_until_complete(
+        User.filter(username__startswith="image-")
+    ):
+        if user.profile_image_status == ProfileImageStatus.READY:
+            event_loop.run_until_complete(
+                profile_image_ingestor.release(user.profile_image)
+            )
+
+    event_loop.run_until_complete(
+        User.filter(username__startswith="image-").delete()
+    )
@@ -0,0 +1,160 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from app.api.endpoints.users import get_active_users_page
+from app.config import settings
+from app.db.queries import (
+    get_usernames_by_prefix,
+    get_users_by_ids,
+    search_users,
+)
+from app.utils import DISPLAY_USER_FIELDS
+
+
+SEEDED_ROWS: int = 1_000_000
+
+
+class Rollback(Exception):
+    pass
+
+
+def iter_plan_nodes(node: Dict) -> Iterator[Dict]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+async def explain(
+    connection: BaseDBAsyncClient, sql: str, values: Optional[List] = None
+) -> List[Dict]:
+    rows: List[Dict] = await connection.execute_query_dict(
+        f"EXPLAIN (FORMAT JSON) {sql}", values
+    )
+    # asyncpg leaves json undecoded
+    return list(iter_plan_nodes(json.loads(rows[0]["QUERY PLAN"])[0]["Plan"]))
+
+
+class ExplainingConnection:
+    """
+    Handed to the query functions in place of their connection, explains
+    the statement they send, with its parameters, instead of running it.
+    """
+
+    def __init__(self, connection: BaseDBAsyncClient):
+        self.connection = connection
+        self.plan: List[Dict] = []
+
+    async def execute_query_dict(
+        self, query: str, values: Optional[List] = None
+    ) -> List[Dict]:
+        self.plan = await explain(self.connection, query, values)
+        return []
+
+
+async def explain_read_paths() -> Dict[str, List[Dict]]:
+    plans: Dict[str, List[Dict]] = {}
+
+    # everything is seeded in a transaction that is rolled back at the end,
+    #  so the other tests never see these rows
+    try:
+        async with in_transaction() as connection:
+            await connection.execute_script(
+                f"""
+                INSERT INTO "user" (
+                    id, username, first_name, last_name, password,
+                    profile_image, created_at, modified_at, deleted_at
+                )
+                SELECT
+                    gen_random_uuid(), 'plan-' || i, 'First', 'Last', '',
+                    '2021/07/21/x.jpg',
+                    now() - i * interval '1 second', now(),
+                    CASE WHEN i % 10 = 0 THEN now() END
+                FROM generate_series(1, {SEEDED_ROWS}) AS i;
+                ANALYZE "user";
+                """
+            )
+
+            # the statements the endpoints send, with the parameters they
+            #  send them with
+            plans["first_page"] = await explain(
+                connection,
+                get_active_users_page(
+                    after=None, limit=settings.USERS_PAGE_SIZE + 1
+                )
+                .values(*DISPLAY_USER_FIELDS)
+                .sql(),
+            )
+            plans["next_page"] = await explain(
+                connection,
+                get_active_users_page(
+                    after=(datetime.now(tz=timezone.utc), uuid4()),
+                    limit=settings.USERS_PAGE_SIZE + 1,
+                )
+                .values(*DISPLAY_USER_FIELDS)
+                .sql(),
+            )
+
+            explaining = ExplainingConnection(connection)
+
+            await get_users_by_ids(
+                [uuid4() for _ in range(10)], connection=explaining
+            )
+            plans["users_by_ids"] = explaining.plan
+
+            await search_users(
+                "plan-12345",
+                settings.USERS_SEARCH_LIMIT,
+                connection=explaining,
+            )
+            plans["search"] = explaining.plan
+
+            await get_usernames_by_prefix(
+                "plan-1234", settings.USERS_SEARCH_LIMIT, connection=explaining
+            )
+            plans["prefix"] = explaining.plan
+
+            raise Rollback()
+    except Rollback:
+        pass
+
+    return plans
+
+
+def test_read_paths_use_index_scans(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    plans: Dict[str, List[Dict]] = event_loop.run_until_complete(
+        explain_read_paths()
+    )
+
+    for path in plans:
+        assert all(node["Node Type"] != "Seq Scan" for node in plans[path])
+
+    for page in ("first_page", "next_page"):
+        assert any(
+            node.get("Index Name") == "user_active_created_at_id_idx"
+            for node in plans[page]
+        )
+
+    # soft deleted users included, for their callers to tell them apart
+    assert any(
+        node.get("Index Name") == "user_pkey" for node in plans["users_by_ids"]
+    )
+
+    # every condition is served by an index of the lowercased columns
+    assert any(
+        node.get("Index Name", "").endswith("_trgm_idx")
+        for node in plans["search"]
+    )
+
+    assert any(
+        node.get("Index Name") == "user_active_username_prefix_idx"
+        for node in plans["prefix"]
+    )
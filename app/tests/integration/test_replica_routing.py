@@ -0,0 +1,105 @@
+import asyncio
+from typing import Generator
+
+import pytest
+from fastapi.testclient import TestClient
+from tortoise import Tortoise
+from tortoise.backends.asyncpg import AsyncpgDBClient
+
+from app.api.endpoints import users
+from app.db.models import User
+from app.db.routing import ReplicaRouter
+
+
+BASE_URL: str = "/api/users"
+
+
+def build_replica(name: str, port: int) -> AsyncpgDBClient:
+    primary: AsyncpgDBClient = Tortoise.get_connection("default")
+    return AsyncpgDBClient(
+        connection_name=name,
+        user=primary.user,
+        password=primary.password,
+        database=primary.database,
+        host=primary.host,
+        port=port,
+    )
+
+
+@pytest.fixture()
+def replica_router(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    monkeypatch: pytest.MonkeyPatch,
+) -> Generator:
+    # the test database under a second connection stands in for a healthy
+    #  replica, while nothing listens on port 1 for the unreachable one
+    router = ReplicaRouter(
+        primary="default",
+        replicas={
+            "replica_up": build_replica(
+                "replica_up", Tortoise.get_connection("default").port
+            ),
+            "replica_down": build_replica("replica_down", 1),
+        },
+        read_after_write_window=60.0,
+        health_check_interval=60.0,
+        health_check_timeout=1.0,
+    )
+    monkeypatch.setattr(users, "replica_router", router)
+    yield router
+    event_loop.run_until_complete(router.stop())
+
+
+def test_health_check_only_admits_reachable_replicas(
+    event_loop: asyncio.AbstractEventLoop, replica_router: ReplicaRouter
+):
+    event_loop.run_until_complete(replica_router.check_health())
+
+    assert replica_router.healthy == {"replica_up"}
+
+
+def test_list_users_reads_from_replica(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    replica_router: ReplicaRouter,
+):
+    event_loop.run_until_complete(replica_router.check_health())
+
+    for _ in range(3):
+        assert replica_router.get_read_connection_name() == "replica_up"
+        response = client.get(BASE_URL)
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+
+    assert replica_router.healthy == {"replica_up"}
+
+
+def test_get_user_after_write_reads_from_primary(
+    client: TestClient,
+    event_loop: asyncio.AbstractEventLoop,
+    replica_router: ReplicaRouter,
+):
+    event_loop.run_until_complete(replica_router.check_health())
+    response = client.post(
+        BASE_URL,
+        params={"defer_image_processing": True},
+        json={
+            "username": "replica-user",
+            "firstName": "Replica",
+            "lastName": "User",
+            "password": "123123",
+            "profileImage": "https://www.dutchnews.nl/wpcms/wp-content/uploads/2017/01/Raccoon.jpg",  # noqa
+        },
+    )
+    user_id: str = response.json()["id"]
+
+    assert replica_router.get_read_connection_name(user_id) == "default"
+    assert client.get(f"{BASE_URL}/{user_id}").status_code == 200
+    assert replica_router.get_read_connection_name() == "replica_up"
+
+
+def test_tear_down(event_loop: asyncio.AbstractEventLoop):
+    event_loop.run_until_complete(
+        User.filter(username="replica-user").delete()
+    )
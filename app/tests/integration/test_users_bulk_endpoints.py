@@ -0,0 +1,125 @@
+import asyncio
+from secrets import token_hex
+from typing import List
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app.db.models import ProfileImageStatus, User
+
+
+BASE_URL: str = "/api/users/bulk"
+PROFILE_IMAGE: str = "https://www.dutchnews.nl/wpcms/wp-content/uploads/2017/01/Raccoon.jpg"  # noqa
+user_ids: List[str] = []
+
+
+def build_user(username: str) -> dict:
+    return {
+        "username": username,
+        "firstName": "Bulk",
+        "lastName": "User",
+        "password": "123123",
+        "profileImage": PROFILE_IMAGE,
+    }
+
+
+def test_bulk_create_users(client: TestClient):
+    usernames: List[str] = [f"bulk-{token_hex(5)}" for _ in range(3)]
+    response = client.post(
+        BASE_URL,
+        json=[build_user(username) for username in usernames]
+        + [build_user(usernames[0])],
+    )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["statusCode"] for result in results] == [201, 201, 201, 409]
+    assert [result["user"]["username"] for result in results[:3]] == usernames
+    assert all(
+        result["user"]["profileImageStatus"] == "pending"
+        for result in results[:3]
+    )
+    assert results[3]["detail"] == (
+        f'The username "{usernames[0]}" is already in use.'
+    )
+
+    user_ids.extend(result["id"] for result in results[:3])
+
+
+def test_bulk_create_with_existing_username(client: TestClient):
+    username: str = f"bulk-{token_hex(5)}"
+    response = client.post(
+        BASE_URL,
+        json=[build_user(username), build_user(f"bulk-{token_hex(5)}")],
+    )
+    user_ids.extend(result["id"] for result in response.json())
+
+    response = client.post(BASE_URL, json=[build_user(username)])
+
+    assert response.status_code == 200
+    assert response.json()[0]["statusCode"] == 409
+
+
+def test_bulk_create_empty_batch(client: TestClient):
+    response = client.post(BASE_URL, json=[])
+
+    assert response.status_code == 422
+
+
+def test_bulk_update_users(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    missing_id: str = str(uuid4())
+    response = client.patch(
+        BASE_URL,
+        json=[
+            {"id": user_ids[0], "firstName": "Updated"},
+            {"id": user_ids[1], "profileImage": PROFILE_IMAGE},
+            {"id": user_ids[0], "lastName": "Twice"},
+            {"id": missing_id, "firstName": "Nobody"},
+        ],
+    )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["statusCode"] for result in results] == [200, 200, 409, 404]
+    assert results[0]["user"]["firstName"] == "Updated"
+    assert results[0]["user"]["lastName"] == "User"
+    assert results[1]["user"]["profileImageStatus"] == "pending"
+    assert results[3]["detail"] == f"User with id {missing_id} was not found"
+
+    user = event_loop.run_until_complete(User.get(id=user_ids[0]))
+    assert user.first_name == "Updated"
+    assert user.profile_image_status != ProfileImageStatus.FAILED
+
+
+def test_bulk_update_with_taken_username(client: TestClient):
+    taken_username: str = client.get(f"/api/users/{user_ids[1]}").json()[
+        "username"
+    ]
+    response = client.patch(
+        BASE_URL, json=[{"id": user_ids[0], "username": taken_username}]
+    )
+
+    assert response.status_code == 200
+    assert response.json()[0]["statusCode"] == 409
+    assert response.json()[0]["detail"] == (
+        f'The username "{taken_username}" is already in use.'
+    )
+
+
+def test_bulk_delete_users(client: TestClient):
+    response = client.delete(BASE_URL, json=[user_ids[2], user_ids[2]])
+
+    assert response.status_code == 200
+    assert [result["statusCode"] for result in response.json()] == [204, 404]
+
+    response = client.get(f"/api/users/{user_ids[2]}")
+    assert response.status_code == 404
+
+
+def test_tear_down(event_loop: asyncio.AbstractEventLoop):
+    event_loop.run_until_complete(
+        User.filter(username__startswith="bulk-").delete()
+    )
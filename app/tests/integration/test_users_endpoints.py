@@ -1,15 +1,25 @@
 import asyncio
-from datetime import datetime
+import json
+from base64 import urlsafe_b64encode
+from datetime import datetime, timezone
 from secrets import token_hex
 from typing import List
 from uuid import uuid4
 
 from faker import Faker
 from fastapi.testclient import TestClient
+from tortoise.backends.asyncpg.client import (
+    AsyncpgDBClient,
+    TransactionWrapper,
+)
 
 from app.config import settings
-from app.db.models import User
+from app.db.models import ArchivedUser, ProfileImageStatus, User
+from app.db.queries import get_all_usernames, get_last_user_change_seq
 from app.schemas import DisplayUser
+from app.services import usernames
+from app.services.purge import user_purger
+from app.services.usernames import UsernameFilter
 from app.utils import get_password_hash
 
 
@@ -60,7 +70,7 @@ def test_create_user(client: TestClient):
     )
 
     # Test that profile image was properly uploaded
-    assert data["profileImage"].endswith(f'{data["id"]}.jpg')
+    assert data["profileImage"].endswith(".jpg")
     assert settings.UPLOAD_FOLDER.joinpath(
         "profile_images", *data["profileImage"].split("/")
     ).is_file()
@@ -81,6 +91,44 @@ def test_create_with_existing_username(client: TestClient):
     )
 
 
+def test_username_available(client: TestClient):
+    response = client.get(f"{BASE_URL}/username-available/user-test")
+    assert response.status_code == 409
+    assert response.json() == {"username": "user-test", "available": False}
+
+    username: str = f"user-{token_hex(5)}"
+    response = client.get(f"{BASE_URL}/username-available/{username}")
+    assert response.status_code == 200
+    assert response.json() == {"username": username, "available": True}
+
+    response = client.get(f"{BASE_URL}/username-available/u")
+    assert response.status_code == 422
+
+
+def test_username_available_taken_elsewhere(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop, monkeypatch
+):
+    # loaded before the username was taken, through another worker
+    username_filter = UsernameFilter(
+        load=get_all_usernames, refresh_interval=60, error_rate=0.01
+    )
+    username_filter.replace([])
+    monkeypatch.setattr(usernames, "username_filter", username_filter)
+    user = event_loop.run_until_complete(
+        User.create(
+            username=f"user-{token_hex(5)}",
+            first_name=faker.first_name(),
+            last_name=faker.last_name(),
+            password="not-a-real-hash",
+            profile_image="https://example.com/image.jpg",
+        )
+    )
+
+    response = client.get(f"{BASE_URL}/username-available/{user.username}")
+    assert response.status_code == 409
+    assert response.json()["available"] is False
+
+
 def test_list_users(client: TestClient, event_loop: asyncio.AbstractEventLoop):
     response = client.get(BASE_URL)
 
@@ -104,6 +152,70 @@ def test_list_users(client: TestClient, event_loop: asyncio.AbstractEventLoop):
     )
 
 
+def test_list_users_paginated(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    seen_ids: List[str] = []
+    response = client.get(BASE_URL, params={"limit": 3})
+
+    while True:
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) <= 3
+        seen_ids.extend(item["id"] for item in data)
+
+        if "X-Next-Cursor" not in response.headers:
+            assert "Link" not in response.headers
+            break
+
+        assert response.headers["Link"].endswith('; rel="next"')
+        response = client.get(
+            BASE_URL,
+            params={"limit": 3, "cursor": response.headers["X-Next-Cursor"]},
+        )
+
+    assert len(seen_ids) == len(set(seen_ids))
+    assert len(seen_ids) == event_loop.run_until_complete(
+        User.exclude(deleted_at__isnull=False).count()
+    )
+
+
+def test_list_users_invalid_cursor(client: TestClient):
+    response = client.get(BASE_URL, params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == 'Invalid cursor "not-a-cursor".'
+
+    # well formed, but with a number for the id
+    cursor: str = urlsafe_b64encode(
+        json.dumps(["2021-01-01T00:00:00+00:00", 5]).encode()
+    ).decode()
+    for url in (BASE_URL, f"{BASE_URL}/export"):
+        response = client.get(url, params={"cursor": cursor})
+        assert response.status_code == 400
+
+
+def test_list_users_stream(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    response = client.get(BASE_URL, params={"stream": True})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    lines = [line for line in response.text.split("\n") if line]
+
+    for line in lines:
+        item = json.loads(line)
+        assert all(
+            field in item
+            for field in DisplayUser.parse_obj(item).dict(by_alias=True).keys()
+        )
+
+    assert len(lines) == event_loop.run_until_complete(
+        User.exclude(deleted_at__isnull=False).count()
+    )
+
+
 def test_get_user(client: TestClient):
     for user_id in user_ids:
         response = client.get(f"{BASE_URL}/{user_id}")
@@ -120,6 +232,93 @@ def test_get_user(client: TestClient):
         )
 
 
+def test_get_user_conditional(client: TestClient):
+    response = client.get(f"{BASE_URL}/{user_ids[1]}")
+    etag: str = response.headers["ETag"]
+    last_modified: str = response.headers["Last-Modified"]
+
+    for headers in (
+        {"If-None-Match": etag},
+        {"If-Modified-Since": last_modified},
+    ):
+        response = client.get(f"{BASE_URL}/{user_ids[1]}", headers=headers)
+
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+    response = client.get(
+        f"{BASE_URL}/{user_ids[1]}", headers={"If-None-Match": '"stale"'}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+
+
+def test_list_users_conditional(client: TestClient):
+    response = client.get(BASE_URL)
+    etag: str = response.headers["ETag"]
+
+    response = client.get(BASE_URL, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get(
+        BASE_URL, params={"limit": 1}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+
+
+def test_search_users(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    user = event_loop.run_until_complete(get_user_by_id(user_ids[1]))
+
+    response = client.get(
+        f"{BASE_URL}/search", params={"q": user.username.upper()}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["id"] == user_ids[1]
+
+    response = client.get(
+        f"{BASE_URL}/search", params={"q": user.last_name, "limit": 50}
+    )
+    assert response.status_code == 200
+    assert user_ids[1] in [item["id"] for item in response.json()]
+
+    response = client.get(
+        f"{BASE_URL}/search", params={"q": "user-", "limit": 2}
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+    response = client.get(f"{BASE_URL}/search", params={"q": "%_"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get(f"{BASE_URL}/search", params={"q": ""})
+    assert response.status_code == 422
+
+
+def test_autocomplete_usernames(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    user = event_loop.run_until_complete(get_user_by_id(user_ids[1]))
+
+    response = client.get(
+        f"{BASE_URL}/autocomplete", params={"q": user.username[:8]}
+    )
+    assert response.status_code == 200
+    assert user.username in response.json()
+
+    response = client.get(
+        f"{BASE_URL}/autocomplete", params={"q": "user-", "limit": 3}
+    )
+    assert response.status_code == 200
+    usernames = response.json()
+    assert len(usernames) == 3
+    assert usernames == sorted(usernames, key=str.lower)
+
+
 def test_delete_user(
     client: TestClient, event_loop: asyncio.AbstractEventLoop
 ):
@@ -154,6 +353,25 @@ def test_get_user_not_found(client: TestClient):
     )
 
 
+def test_get_users_by_ids(client: TestClient):
+    # the first user has been deleted, the last one never existed
+    requested_ids: List[str] = [*user_ids[:4], str(uuid4())]
+    response = client.get(
+        BASE_URL,
+        params={"ids": [",".join(requested_ids[:2]), *requested_ids[2:]]},
+    )
+
+    assert response.status_code == 200
+    assert [user["id"] for user in response.json()] == user_ids[1:4]
+
+
+def test_get_users_by_ids_invalid_id(client: TestClient):
+    response = client.get(BASE_URL, params={"ids": f"{user_ids[1]},nope"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == 'Invalid user id "nope".'
+
+
 def test_update_user(client: TestClient, event_loop: asyncio.AbstractEventLoop):
     first_name, last_name = faker.name().split(" ")
 
@@ -169,6 +387,107 @@ def test_update_user(client: TestClient, event_loop: asyncio.AbstractEventLoop):
     assert user_obj.last_name == last_name
 
 
+def test_update_user_if_match(client: TestClient):
+    etag: str = client.get(f"{BASE_URL}/{user_ids[2]}").headers["ETag"]
+
+    response = client.put(
+        f"{BASE_URL}/{user_ids[2]}",
+        json={"firstName": "Stale"},
+        headers={"If-Match": '"stale"'},
+    )
+    assert response.status_code == 412
+
+    response = client.put(
+        f"{BASE_URL}/{user_ids[2]}",
+        json={"firstName": "Fresh"},
+        headers={"If-Match": etag},
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # the etag the update answered with is the user's new one
+    response = client.get(
+        f"{BASE_URL}/{user_ids[2]}",
+        headers={"If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == 304
+
+    response = client.delete(
+        f"{BASE_URL}/{user_ids[2]}", headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+
+
+def test_update_user_unchanged(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    user = client.get(f"{BASE_URL}/{user_ids[2]}")
+    modified_at = event_loop.run_until_complete(
+        get_user_by_id(user_ids[2])
+    ).modified_at
+    since: int = event_loop.run_until_complete(get_last_user_change_seq())
+
+    # nothing changes, the user is not written again
+    response = client.put(f"{BASE_URL}/{user_ids[2]}", json={
+        "firstName": user.json()["firstName"],
+    })
+    assert response.status_code == 200
+    assert response.headers["ETag"] == user.headers["ETag"]
+    assert response.json()["modifiedAt"] == user.json()["modifiedAt"]
+
+    user_obj = event_loop.run_until_complete(get_user_by_id(user_ids[2]))
+    assert user_obj.modified_at == modified_at
+    assert event_loop.run_until_complete(get_last_user_change_seq()) == since
+
+
+def test_delete_user_in_a_single_statement(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop, monkeypatch
+):
+    # without a stored image, the release of which is a statement of its own
+    user = event_loop.run_until_complete(
+        User.create(
+            username=f"user-{token_hex(5)}",
+            first_name=faker.first_name(),
+            last_name=faker.last_name(),
+            password="not-a-real-hash",
+            profile_image="https://example.com/failed.jpg",
+            profile_image_status=ProfileImageStatus.FAILED,
+        )
+    )
+    round_trips: List[str] = []
+
+    for client_class in (AsyncpgDBClient, TransactionWrapper):
+        def acquire_connection(self, acquire=client_class.acquire_connection):
+            round_trips.append(type(self).__name__)
+            return acquire(self)
+
+        monkeypatch.setattr(
+            client_class, "acquire_connection", acquire_connection
+        )
+
+    response = client.delete(f"{BASE_URL}/{user.id}")
+    monkeypatch.undo()
+
+    assert response.status_code == 204
+    # the deletion and its change, without a select or a transaction
+    assert round_trips == ["AsyncpgDBClient"]
+    user_obj = event_loop.run_until_complete(get_user_by_id(str(user.id)))
+    assert isinstance(user_obj.deleted_at, datetime)
+
+
+def test_get_user_after_update(client: TestClient):
+    assert client.get(f"{BASE_URL}/{user_ids[-1]}").status_code == 200
+
+    response = client.put(f"{BASE_URL}/{user_ids[-1]}", json={
+        "firstName": "Cached",
+    })
+    assert response.status_code == 200
+
+    response = client.get(f"{BASE_URL}/{user_ids[-1]}")
+    assert response.status_code == 200
+    assert response.json()["firstName"] == "Cached"
+
+
 def test_update_deleted_user(client: TestClient):
     first_name, last_name = faker.name().split(" ")
     response = client.put(f"{BASE_URL}/{user_ids[0]}", json={
@@ -193,6 +512,121 @@ def test_update_user_with_existing_username(client: TestClient):
     )
 
 
+def test_user_changes(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    since: int = event_loop.run_until_complete(get_last_user_change_seq())
+
+    response = client.put(
+        f"{BASE_URL}/{user_ids[1]}", json={"firstName": "Changed"}
+    )
+    assert response.status_code == 200
+    response = client.delete(f"{BASE_URL}/{user_ids[2]}")
+    assert response.status_code == 204
+
+    response = client.get(f"{BASE_URL}/changes", params={"since": since})
+    assert response.status_code == 200
+    data = response.json()
+
+    changes = data["changes"]
+    assert [(change["event"], change["userId"]) for change in changes] == [
+        ("updated", user_ids[1]),
+        ("deleted", user_ids[2]),
+    ]
+    assert changes[0]["user"]["firstName"] == "Changed"
+    assert changes[1]["user"] is None
+    assert since < changes[0]["seq"] < changes[1]["seq"] == data["next"]
+
+    response = client.get(
+        f"{BASE_URL}/changes", params={"since": data["next"], "wait": 0.1}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"changes": [], "next": data["next"]}
+
+
+def test_export_users(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "USERS_EXPORT_SETTLE_DELAY", 0)
+
+    response = client.get(f"{BASE_URL}/export")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    exported = {line["id"]: line for line in lines if "id" in line}
+    assert set(user_ids) <= set(exported)
+    assert exported[user_ids[0]].keys() == {"id", "deletedAt"}
+    assert exported[user_ids[1]]["firstName"] == "Changed"
+    assert "checkpoint" in lines[-1]
+
+    response = client.get(
+        f"{BASE_URL}/export", params={"cursor": lines[-1]["checkpoint"]}
+    )
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        lines[-1]
+    ]
+
+    response = client.get(f"{BASE_URL}/export", params={"format": "csv"})
+    assert response.status_code == 400
+
+
+def test_export_users_snapshot(client: TestClient):
+    response = client.get(
+        f"{BASE_URL}/export", params={"snapshot": True, "format": "csv"}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/csv")
+    assert response.headers["X-Export-Checkpoint"]
+    header, *rows = response.text.splitlines()
+    assert header.startswith("id,username,first_name")
+    assert user_ids[0] not in response.text
+    assert any(row.startswith(user_ids[1]) for row in rows)
+
+    response = client.get(f"{BASE_URL}/export", params={"snapshot": True})
+    assert response.status_code == 200
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert all(
+        DisplayUser.parse_obj(user).dict(by_alias=True).keys() == user.keys()
+        for user in users
+    )
+
+
+def test_purge_deleted_users(
+    client: TestClient, event_loop: asyncio.AbstractEventLoop
+):
+    response = client.get("/api/admin/users/purge")
+    assert response.status_code == 200
+    assert response.json()["deleted"] >= 1
+
+    # deleted long enough ago to be purged
+    event_loop.run_until_complete(
+        User.filter(id=user_ids[0]).update(
+            deleted_at=datetime(2000, 1, 1, tzinfo=timezone.utc)
+        )
+    )
+    assert client.get("/api/admin/users/purge").json()["pending"] >= 1
+
+    assert event_loop.run_until_complete(user_purger.purge()) >= 1
+    assert client.get("/api/admin/users/purge").json()["pending"] == 0
+    assert not event_loop.run_until_complete(
+        User.filter(id=user_ids[0]).exists()
+    )
+    archived = event_loop.run_until_complete(ArchivedUser.get(id=user_ids[0]))
+    assert archived.deleted_at.year == 2000
+
+    response = client.get(f"{BASE_URL}/{user_ids[0]}")
+    assert response.status_code == 404
+    assert response.json()["detail"] == (
+        f"User with id {user_ids[0]} was not found"
+    )
+
+    # the username is free again
+    response = client.get(
+        f"{BASE_URL}/username-available/{archived.username}"
+    )
+    assert response.json()["available"]
+
+
 def test_tear_down(event_loop: asyncio.AbstractEventLoop):
     for item in settings.UPLOAD_FOLDER.iterdir():
         if not item.is_file():
@@ -204,6 +638,9 @@ def test_tear_down(event_loop: asyncio.AbstractEventLoop):
     event_loop.run_until_complete(
         User.filter(username__startswith="user-").all().delete()
     )
+    event_loop.run_until_complete(
+        ArchivedUser.filter(username__startswith="user-").all().delete()
+    )
 
     assert (
         event_loop.run_until_complete(
@@ -0,0 +1,84 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Thread
+from time import sleep
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+
+def build_image(image_format: str, size: Tuple[int, int] = (64, 64)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, color=(200, 120, 40)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class StubImageServer:
+    """
+    Local http server standing in for the remote hosts profile images are
+    downloaded from. Every path it serves is listed in ``routes``.
+    """
+
+    def __init__(self, slow_response_delay: float = 2.0):
+        self.slow_response_delay = slow_response_delay
+        self.requests: Counter = Counter()
+        self.routes: Dict[str, Tuple[int, str, bytes]] = {
+            "/image.jpg": (200, "image/jpeg", build_image("JPEG")),
+            "/image.png": (200, "image/png", build_image("PNG")),
+            "/image.webp": (200, "image/webp", build_image("WEBP")),
+            # the same image as /image.png, but from another url
+            "/avatar.png": (200, "image/png", build_image("PNG")),
+            "/large.jpg": (
+                200,
+                "image/jpeg",
+                build_image("JPEG", size=(2048, 2048)),
+            ),
+            "/broken.jpg": (200, "image/jpeg", b"definitely not a jpeg"),
+            "/document.txt": (200, "text/plain", b"hello"),
+            "/missing.jpg": (404, "text/plain", b"not found"),
+            "/slow.jpg": (200, "image/jpeg", build_image("JPEG")),
+        }
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def __enter__(self) -> "StubImageServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests[self.path] += 1
+                status_code, content_type, body = stub.routes.get(
+                    self.path, (404, "text/plain", b"not found")
+                )
+
+                if self.path == "/slow.jpg":
+                    sleep(stub.slow_response_delay)
+
+                self.send_response(status_code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,163 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from typing import Dict, List
+from uuid import uuid4
+
+from app.services.changes import (
+    ChangeRelay,
+    render_change,
+    render_change_events,
+    render_changes_page,
+)
+from app.services.compression import response_compression
+
+
+NOW: datetime = datetime(2026, 10, 18, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def build_row(seq: int, event: str = "updated") -> Dict:
+    user_id = uuid4()
+
+    return {
+        "seq": seq,
+        "event": event,
+        "user_id": user_id,
+        "changed_at": NOW,
+        "id": user_id,
+        "username": f"user-{seq}",
+        "first_name": "First",
+        "last_name": "Last",
+        "profile_image": "image.png",
+        "profile_image_status": "ready",
+        "created_at": NOW,
+        "modified_at": NOW,
+    }
+
+
+def build_relay(rows: List[Dict], buffer_size: int = 10) -> ChangeRelay:
+    loads: List[int] = []
+
+    async def load(after: int, limit: int) -> List[Dict]:
+        loads.append(after)
+        return [row for row in rows if row["seq"] > after][:limit]
+
+    relay = ChangeRelay(
+        load=load,
+        dsn=None,
+        batch_size=2,
+        buffer_size=buffer_size,
+        poll_interval=0.01,
+    )
+    relay.loads = loads
+    return relay
+
+
+def test_render_change():
+    row: Dict = build_row(7)
+    change = render_change(row)
+
+    assert change.seq == 7
+    assert json.loads(change.json) == {
+        "seq": 7,
+        "event": "updated",
+        "userId": str(row["user_id"]),
+        "changedAt": "2026-10-18T12:00:00+00:00",
+        "user": {
+            "id": str(row["id"]),
+            "username": "user-7",
+            "firstName": "First",
+            "lastName": "Last",
+            "profileImage": "image.png",
+            "profileImageStatus": "ready",
+            "createdAt": "2026-10-18T12:00:00+00:00",
+            "modifiedAt": "2026-10-18T12:00:00+00:00",
+        },
+    }
+
+    assert (
+        json.loads(render_change(build_row(8, "deleted")).json)["user"] is None
+    )
+    assert json.loads(render_change({**row, "id": None}).json)["user"] is None
+
+
+def test_render_changes():
+    changes = [render_change(build_row(seq)) for seq in (3, 5)]
+
+    page: Dict = json.loads(render_changes_page(changes, since=1))
+    assert [change["seq"] for change in page["changes"]] == [3, 5]
+    assert page["next"] == 5
+    assert json.loads(render_changes_page([], since=5)) == {
+        "changes": [],
+        "next": 5,
+    }
+
+    events: str = render_change_events(changes)
+    assert events.startswith("id: 3\ndata: {")
+    assert events.count("\n\n") == 2
+
+
+def test_relay_publishes_pending_changes_in_batches(run):
+    relay = build_relay([build_row(seq) for seq in (2, 3, 5, 6, 9)])
+    relay.reset(last_seq=2)
+
+    run(relay.publish_pending())
+
+    # a batch short of the batch size ends the catch up
+    assert relay.loads == [2, 5, 9]
+    assert relay.last_seq == 9
+    assert [change.seq for change in relay.get_buffered(2, 10)] == [3, 5, 6, 9]
+    assert [change.seq for change in relay.get_buffered(4, 2)] == [5, 6]
+    assert relay.get_buffered(9, 10) == []
+    # changes from before the relay started are not in memory
+    assert relay.get_buffered(1, 10) is None
+
+
+def test_relay_buffer_keeps_the_latest_changes(run):
+    relay = build_relay([build_row(seq) for seq in range(1, 8)], buffer_size=3)
+    relay.reset(last_seq=0)
+
+    run(relay.publish_pending())
+
+    assert relay.get_buffered(3, 10) is None
+    assert [change.seq for change in relay.get_buffered(4, 10)] == [5, 6, 7]
+
+    # older changes are read from the database instead
+    changes = run(relay.read(1, limit=2))
+    assert [change.seq for change in changes] == [2, 3]
+    assert relay.loads[-1] == 1
+
+
+def test_relay_read_waits_for_changes(run):
+    rows: List[Dict] = [build_row(1)]
+    relay = build_relay(rows)
+
+    async def scenario():
+        # there is no database to tail here, changes are published by hand
+        relay.start()
+        await relay.stop()
+        relay.reset(last_seq=1)
+        reader = asyncio.ensure_future(relay.read(1, limit=10, timeout=5))
+        await asyncio.sleep(0.01)
+        assert not reader.done()
+
+        rows.append(build_row(2))
+        await relay.publish_pending()
+        return await reader
+
+    changes = run(scenario())
+
+    assert [change.seq for change in changes] == [2]
+
+
+def test_relay_read_times_out(run):
+    relay = build_relay([])
+    relay.reset(last_seq=0)
+
+    assert run(relay.read(0, limit=10, timeout=0.02)) == []
+    assert not run(relay.wait(0, timeout=0.01))
+
+
+def test_event_streams_are_not_compressed():
+    assert response_compression.is_compressible("text/plain")
+    assert not response_compression.is_compressible("text/event-stream")
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+from uuid import uuid4
+
+import pytest
+
+from app.utils import (
+    format_http_date,
+    get_user_etag,
+    get_users_etag,
+    is_not_modified,
+    matches_entity_tag,
+)
+
+
+USER_ID = uuid4()
+MODIFIED_AT: datetime = datetime(
+    2021, 7, 21, 10, 30, 15, 123456, tzinfo=timezone.utc
+)
+ETAG: str = get_user_etag(USER_ID, MODIFIED_AT)
+
+
+def test_user_etag_changes_with_modified_at_only():
+    assert get_user_etag(str(USER_ID).upper(), MODIFIED_AT) == ETAG
+    assert get_user_etag(USER_ID.hex, MODIFIED_AT) == ETAG
+    assert (
+        get_user_etag(
+            USER_ID, MODIFIED_AT.astimezone(timezone(timedelta(hours=2)))
+        )
+        == ETAG
+    )
+    assert (
+        get_user_etag(USER_ID, MODIFIED_AT + timedelta(microseconds=1)) != ETAG
+    )
+    assert get_user_etag(uuid4(), MODIFIED_AT) != ETAG
+
+
+def test_users_etag_changes_when_the_list_does():
+    rows = [
+        {"id": uuid4(), "modified_at": MODIFIED_AT},
+        {"id": uuid4(), "modified_at": MODIFIED_AT},
+    ]
+    etag: str = get_users_etag(rows)
+
+    assert get_users_etag([dict(row) for row in rows]) == etag
+    assert get_users_etag(rows[:1]) != etag
+    assert (
+        get_users_etag(
+            [rows[0], {**rows[1], "modified_at": MODIFIED_AT + timedelta(1)}]
+        )
+        != etag
+    )
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, False),
+        ({"if-none-match": ETAG}, True),
+        ({"if-none-match": f'"other", W/{ETAG}'}, True),
+        ({"if-none-match": "*"}, True),
+        ({"if-none-match": '"other"'}, False),
+        # If-None-Match takes precedence over If-Modified-Since
+        (
+            {
+                "if-none-match": '"other"',
+                "if-modified-since": format_http_date(MODIFIED_AT),
+            },
+            False,
+        ),
+        ({"if-modified-since": format_http_date(MODIFIED_AT)}, True),
+        (
+            {
+                "if-modified-since": format_http_date(
+                    MODIFIED_AT - timedelta(seconds=1)
+                )
+            },
+            False,
+        ),
+        ({"if-modified-since": "not a date"}, False),
+    ],
+)
+def test_is_not_modified(headers: Dict[str, str], expected: bool):
+    assert is_not_modified(headers, ETAG, MODIFIED_AT) is expected
+
+
+def test_if_match_uses_strong_comparison():
+    assert matches_entity_tag(ETAG, ETAG)
+    assert matches_entity_tag(f'"other", {ETAG}', ETAG)
+    assert matches_entity_tag("*", ETAG)
+    assert not matches_entity_tag(f"W/{ETAG}", ETAG)
+    assert not matches_entity_tag('"other"', ETAG)
+
+
+def test_http_dates():
+    assert format_http_date(MODIFIED_AT) == "Wed, 21 Jul 2021 10:30:15 GMT"
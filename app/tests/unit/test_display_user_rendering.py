@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+from json import dumps
+from typing import Dict, List
+from uuid import uuid4
+
+import pytest
+from asyncpg.pgproto.pgproto import UUID as AsyncpgUUID
+from fastapi.encoders import jsonable_encoder
+
+from app.db.models import ProfileImageStatus
+from app.schemas import DisplayUser
+from app.utils import (
+    get_display_user_dict,
+    render_display_user,
+    render_display_users,
+)
+
+
+def build_row(**overrides) -> Dict:
+    return {
+        "id": uuid4(),
+        "username": "user-1",
+        "first_name": "Ana",
+        "last_name": "Silva",
+        "profile_image": "2021/07/21/image.jpg",
+        "profile_image_status": ProfileImageStatus.READY,
+        "created_at": datetime(
+            2021, 7, 21, 10, 30, 15, 123456, tzinfo=timezone.utc
+        ),
+        "modified_at": datetime(
+            2021, 7, 22, 8, 0, tzinfo=timezone(timedelta(hours=1))
+        ),
+        **overrides,
+    }
+
+
+def render_through_schema(rows: List[Dict]) -> bytes:
+    # what FastAPI does for a ``List[DisplayUser]`` response model
+    return dumps(
+        jsonable_encoder(
+            [DisplayUser.parse_obj(row) for row in rows], by_alias=True
+        ),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {},
+        {"first_name": "João", "last_name": "Ångström 漢字 😀"},
+        {"last_name": 'quo"te \\ back/slash </script>'},
+        {"first_name": "tab\there", "last_name": "line sep\x7f"},
+        {
+            "profile_image": "https://example.com/a.jpg?b=c&d=e",
+            "profile_image_status": ProfileImageStatus.PENDING,
+        },
+        # as returned by hand written queries
+        {"id": AsyncpgUUID(str(uuid4())), "profile_image_status": "ready"},
+    ],
+)
+def test_fast_path_matches_schema_output(overrides: Dict):
+    rows: List[Dict] = [build_row(**overrides), build_row()]
+
+    assert render_display_users(rows) == render_through_schema(rows)
+    assert render_display_user(rows[0]) == (
+        render_through_schema(rows[:1])[1:-1]
+    )
+    assert dumps(get_display_user_dict(rows[0])) == DisplayUser.parse_obj(
+        rows[0]
+    ).json(by_alias=True)
+
+
+def test_fast_path_renders_empty_list():
+    assert render_display_users([]) == b"[]"
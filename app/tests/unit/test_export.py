@@ -0,0 +1,159 @@
+import asyncio
+import json
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+from uuid import uuid4
+
+import pytest
+
+from app.config import settings
+from app.services import export
+from app.utils import decode_cursor, encode_cursor
+
+
+NOW: datetime = datetime(2026, 10, 18, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def build_row(index: int, deleted: bool = False) -> Dict:
+    return {
+        "id": uuid4(),
+        "username": f"user-{index}",
+        "first_name": "First",
+        "last_name": "Last",
+        "profile_image": "image.png",
+        "profile_image_status": "ready",
+        "created_at": NOW,
+        "modified_at": NOW + timedelta(seconds=index),
+        "deleted_at": NOW if deleted else None,
+    }
+
+
+async def collect(iterator) -> List:
+    return [item async for item in iterator]
+
+
+def test_render_export_line():
+    row: Dict = build_row(1)
+    assert json.loads(export.render_export_line(row))["username"] == "user-1"
+
+    tombstone: Dict = build_row(2, deleted=True)
+    assert json.loads(export.render_export_line(tombstone)) == {
+        "id": str(tombstone["id"]),
+        "deletedAt": "2026-10-18T12:00:00+00:00",
+    }
+
+
+def test_export_start():
+    assert export.get_export_start(None)[0].year == 1
+    assert export.get_export_start(datetime(2026, 10, 18)) == (
+        datetime(2026, 10, 18, tzinfo=timezone.utc),
+        export.NIL_USER_ID,
+    )
+
+    modified_at, user_id = decode_cursor(export.get_snapshot_checkpoint())
+    assert modified_at < datetime.now(tz=timezone.utc)
+    assert user_id == export.NIL_USER_ID
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        ["2021-01-01T00:00:00+00:00", 5],
+        [20210101, "9b1deb4d-3b7d-4bad-9bdd-2b0d7b3dcb6d"],
+        ["2021-01-01T00:00:00", "9b1deb4d-3b7d-4bad-9bdd-2b0d7b3dcb6d"],
+        ["2021-01-01T00:00:00+00:00"],
+    ],
+)
+def test_decode_invalid_cursor(payload: List):
+    cursor: str = urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_decode_cursor():
+    user_id = uuid4()
+    assert decode_cursor(encode_cursor(NOW, user_id)) == (NOW, user_id)
+
+
+def test_stream_modified_users(monkeypatch: pytest.MonkeyPatch, run):
+    rows: List[Dict] = [build_row(index, index == 2) for index in range(5)]
+    monkeypatch.setattr(settings, "USERS_EXPORT_BATCH_SIZE", 2)
+
+    async def get_users_modified_after(
+        modified_at, user_id, settle_delay, limit
+    ):
+        return [
+            row
+            for row in rows
+            if (row["modified_at"], str(row["id"]))
+            > (modified_at, str(user_id))
+        ][:limit]
+
+    monkeypatch.setattr(
+        export, "get_users_modified_after", get_users_modified_after
+    )
+    start = (NOW - timedelta(seconds=1), export.NIL_USER_ID)
+    lines: List[Dict] = [
+        json.loads(line)
+        for chunk in run(collect(export.stream_modified_users(start)))
+        for line in chunk.splitlines()
+    ]
+
+    users: List[Dict] = [line for line in lines if "checkpoint" not in line]
+    assert [user["id"] for user in users] == [str(row["id"]) for row in rows]
+    assert "deletedAt" in users[2]
+
+    # every batch ends with a checkpoint, the last one after the last user
+    checkpoints: List[str] = [
+        line["checkpoint"] for line in lines if "checkpoint" in line
+    ]
+    assert len(checkpoints) == 3
+    assert decode_cursor(checkpoints[-1]) == (
+        rows[-1]["modified_at"],
+        rows[-1]["id"],
+    )
+
+
+def test_stream_snapshot(monkeypatch: pytest.MonkeyPatch, run):
+    monkeypatch.setattr(settings, "USERS_EXPORT_BUFFERED_CHUNKS", 1)
+    copied: List[bytes] = []
+
+    async def copy_active_users(output, format):
+        for index in range(5):
+            chunk: bytes = f"{format}-{index}\n".encode()
+            await output(chunk)
+            copied.append(chunk)
+
+    monkeypatch.setattr(export, "copy_active_users", copy_active_users)
+
+    async def read_first():
+        stream = export.stream_snapshot("csv")
+        first: bytes = await stream.__anext__()
+        await asyncio.sleep(0.01)
+        # the copy waits for the client instead of buffering everything
+        waiting: int = len(copied)
+        await stream.aclose()
+        return first, waiting
+
+    first, waiting = run(read_first())
+    assert first == b"csv-0\n"
+    assert waiting < 5
+
+    assert run(collect(export.stream_snapshot("ndjson"))) == [
+        f"ndjson-{index}\n".encode() for index in range(5)
+    ]
+
+
+def test_stream_snapshot_raises_copy_errors(
+    monkeypatch: pytest.MonkeyPatch, run
+):
+    async def copy_active_users(output, format):
+        await output(b"partial")
+        raise ConnectionError("lost")
+
+    monkeypatch.setattr(export, "copy_active_users", copy_active_users)
+
+    with pytest.raises(ConnectionError):
+        run(collect(export.stream_snapshot("csv")))
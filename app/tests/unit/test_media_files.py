@@ -0,0 +1,249 @@
+from os import utime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.types import Message
+
+from app.services.media import MediaFileCache, MediaFiles, parse_byte_range
+
+
+IMAGE_HASH: str = "ab" * 32
+IMAGE: str = f"ab/{IMAGE_HASH}.jpg"
+WEBP: str = f"ab/{IMAGE_HASH}.webp"
+THUMBNAIL: str = f"ab/{IMAGE_HASH}-64.webp"
+LEGACY_IMAGE: str = "2021-07-19/8b0a5e96-8a4e-4e0c-9a53-2f7e5d9b1c3a.png"
+
+FILES: Dict[str, bytes] = {
+    IMAGE: bytes(range(256)) * 4,
+    WEBP: b"webp" * 100,
+    THUMBNAIL: b"thumbnail",
+    LEGACY_IMAGE: b"legacy" * 100,
+}
+
+
+@pytest.fixture
+def media_files(tmp_path: Path) -> MediaFiles:
+    for path, content in FILES.items():
+        tmp_path.joinpath(path).parent.mkdir(exist_ok=True)
+        tmp_path.joinpath(path).write_bytes(content)
+
+    return MediaFiles(
+        directory=tmp_path,
+        cache=MediaFileCache(max_bytes=1000, max_file_size=500),
+        chunk_size=100,
+    )
+
+
+@pytest.fixture
+def client(media_files: MediaFiles) -> TestClient:
+    app = Starlette()
+    app.mount("/media", media_files)
+    return TestClient(app)
+
+
+def call(
+    run: Callable[[Awaitable], Any],
+    media_files: MediaFiles,
+    method: str,
+    path: str,
+    **scope,
+) -> List[Message]:
+    messages: List[Message] = []
+
+    async def receive() -> Message:
+        return {"type": "http.request"}
+
+    async def send(message: Message):
+        messages.append(message)
+
+    run(
+        media_files(
+            {
+                "type": "http",
+                "method": method,
+                "path": f"/{path}",
+                "headers": [],
+                **scope,
+            },
+            receive,
+            send,
+        )
+    )
+    return messages
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("bytes=0-99", (0, 100)),
+        ("bytes=100-", (100, 1024)),
+        ("bytes=1000-2000", (1000, 1024)),
+        ("bytes=-24", (1000, 1024)),
+        ("bytes=-2000", (0, 1024)),
+        ("bytes=10-5", None),
+        ("bytes=0-1, 5-6", None),
+        ("items=0-1", None),
+        ("bytes=-", None),
+    ],
+)
+def test_parse_byte_range(value: str, expected: Optional[Tuple[int, int]]):
+    assert parse_byte_range(value, 1024) == expected
+
+
+@pytest.mark.parametrize("value", ["bytes=1024-", "bytes=-0"])
+def test_parse_unsatisfiable_byte_range(value: str):
+    with pytest.raises(ValueError):
+        parse_byte_range(value, 1024)
+
+
+def test_get_image(client: TestClient):
+    response = client.get(f"/media/{IMAGE}")
+
+    assert response.status_code == 200
+    assert response.content == FILES[IMAGE]
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["content-length"] == "1024"
+    assert response.headers["cache-control"] == (
+        "public, max-age=31536000, immutable"
+    )
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["vary"] == "Accept"
+    assert response.headers["etag"].startswith(f'"{IMAGE_HASH}-')
+    assert "last-modified" in response.headers
+
+
+def test_head_image(media_files: MediaFiles, run):
+    start, body = call(run, media_files, "HEAD", IMAGE)
+
+    assert start["status"] == 200
+    assert (b"content-length", b"1024") in start["headers"]
+    assert body == {"type": "http.response.body", "body": b""}
+
+
+def test_webp_is_sent_to_clients_accepting_it(client: TestClient):
+    response = client.get(
+        f"/media/{IMAGE}", headers={"Accept": "image/webp,image/*,*/*;q=0.8"}
+    )
+
+    assert response.content == FILES[WEBP]
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["vary"] == "Accept"
+
+    refused = client.get(
+        f"/media/{IMAGE}", headers={"Accept": "image/webp;q=0, */*"}
+    )
+    assert refused.content == FILES[IMAGE]
+
+
+def test_legacy_images_are_revalidated(client: TestClient):
+    response = client.get(f"/media/{LEGACY_IMAGE}")
+
+    assert response.content == FILES[LEGACY_IMAGE]
+    assert response.headers["cache-control"] == "no-cache"
+    assert "vary" not in response.headers
+
+
+def test_range_requests(client: TestClient):
+    response = client.get(f"/media/{IMAGE}", headers={"Range": "bytes=10-19"})
+
+    assert response.status_code == 206
+    assert response.content == FILES[IMAGE][10:20]
+    assert response.headers["content-range"] == "bytes 10-19/1024"
+    assert response.headers["content-length"] == "10"
+
+    suffix = client.get(f"/media/{IMAGE}", headers={"Range": "bytes=-300"})
+    assert suffix.content == FILES[IMAGE][-300:]
+
+    unsatisfiable = client.get(
+        f"/media/{IMAGE}", headers={"Range": "bytes=5000-"}
+    )
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == "bytes */1024"
+
+    stale = client.get(
+        f"/media/{IMAGE}",
+        headers={"Range": "bytes=10-19", "If-Range": '"other"'},
+    )
+    assert stale.status_code == 200
+    assert stale.content == FILES[IMAGE]
+
+
+def test_conditional_requests(client: TestClient):
+    etag: str = client.get(f"/media/{THUMBNAIL}").headers["etag"]
+    response = client.get(
+        f"/media/{THUMBNAIL}", headers={"If-None-Match": etag}
+    )
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_small_immutable_files_are_cached(
+    client: TestClient, media_files: MediaFiles, tmp_path: Path
+):
+    for path in (THUMBNAIL, IMAGE, LEGACY_IMAGE):
+        client.get(f"/media/{path}")
+        tmp_path.joinpath(path).unlink()
+
+    # too big, or not immutable
+    assert client.get(f"/media/{IMAGE}").status_code == 404
+    assert client.get(f"/media/{LEGACY_IMAGE}").status_code == 404
+
+    response = client.get(
+        f"/media/{THUMBNAIL}", headers={"Range": "bytes=0-4"}
+    )
+    assert response.status_code == 206
+    assert response.content == b"thumb"
+    assert len(media_files.cache) == 1
+
+
+def test_changed_legacy_images_are_sent_again(
+    client: TestClient, tmp_path: Path
+):
+    first = client.get(f"/media/{LEGACY_IMAGE}")
+    file: Path = tmp_path.joinpath(LEGACY_IMAGE)
+    file.write_bytes(b"changed")
+    utime(file, ns=(0, file.stat().st_mtime_ns + 1_000_000_000))
+
+    response = client.get(
+        f"/media/{LEGACY_IMAGE}",
+        headers={"If-None-Match": first.headers["etag"]},
+    )
+    assert response.status_code == 200
+    assert response.content == b"changed"
+    assert response.headers["etag"] != first.headers["etag"]
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["ab/../../secret.jpg", f"ab/{IMAGE_HASH}.gif", "missing.jpg", "ab/"],
+)
+def test_unknown_paths(client: TestClient, path: str):
+    assert client.get(f"/media/{path}").status_code == 404
+    assert client.get(f"/media/ab/{'cd' * 32}.jpg").status_code == 404
+
+
+def test_only_get_and_head(client: TestClient):
+    response = client.post(f"/media/{IMAGE}")
+
+    assert response.status_code == 405
+    assert response.headers["allow"] == "GET, HEAD"
+
+
+def test_zero_copy_send(media_files: MediaFiles, run):
+    start, body = call(
+        run,
+        media_files,
+        "GET",
+        IMAGE,
+        headers=[(b"range", b"bytes=100-")],
+        extensions={"http.response.zerocopysend": {}},
+    )
+
+    assert start["status"] == 206
+    assert body["type"] == "http.response.zerocopysend"
+    assert (body["offset"], body["count"]) == (100, 924)
@@ -0,0 +1,144 @@
+from json import dumps
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from app.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MultiprocessStore,
+    collect,
+    merge,
+    render,
+)
+from app.middleware import MetricsMiddleware
+from app.middleware.metrics import http_request_duration_seconds
+
+
+def build_registry():
+    requests = Counter(
+        "requests_total", "Requests.", labelnames=("method",), register=False
+    )
+    in_progress = Gauge("in_progress", "In progress.", register=False)
+    latency = Histogram(
+        "latency_seconds", "Latency.", buckets=(0.1, 1.0), register=False
+    )
+    return {metric.name: metric for metric in (requests, in_progress, latency)}
+
+
+def test_render_exposition_format():
+    registry = build_registry()
+    registry["requests_total"].labels("GET").inc(2)
+    registry["in_progress"].set(3)
+    for value in (0.05, 0.5, 5):
+        registry["latency_seconds"].observe(value)
+
+    assert render(collect(registry)) == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{method="GET"} 2.0\n'
+        "# HELP in_progress In progress.\n"
+        "# TYPE in_progress gauge\n"
+        "in_progress 3.0\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="0.1"} 1.0\n'
+        'latency_seconds_bucket{le="1.0"} 2.0\n'
+        'latency_seconds_bucket{le="+Inf"} 3.0\n'
+        "latency_seconds_sum 5.55\n"
+        "latency_seconds_count 3.0\n"
+    )
+
+
+def test_merge_adds_up_workers():
+    first, second = build_registry(), build_registry()
+    first["requests_total"].labels("GET").inc()
+    second["requests_total"].labels("GET").inc(2)
+    second["requests_total"].labels("POST").inc()
+    first["latency_seconds"].observe(0.5)
+    second["latency_seconds"].observe(5)
+
+    merged = merge([collect(first), collect(second)])
+
+    assert merged["requests_total"]["samples"] == [
+        [["GET"], 3],
+        [["POST"], 1],
+    ]
+    assert merged["latency_seconds"]["samples"] == [
+        [[], {"bucket_counts": [0, 1, 1], "count": 2, "sum": 5.5}]
+    ]
+
+
+def test_multiprocess_store_drops_gauges_of_dead_workers(tmp_path: Path):
+    registry = build_registry()
+    registry["requests_total"].labels("GET").inc()
+    registry["in_progress"].set(1)
+
+    # no process can have a pid this high
+    tmp_path.joinpath("999999999.json").write_text(
+        dumps({"pid": 999999999, "metrics": collect(registry)})
+    )
+    store = MultiprocessStore(
+        directory=tmp_path,
+        flush_interval=60,
+        collect_local=lambda: collect(registry),
+    )
+
+    merged = store.collect()
+
+    assert merged["requests_total"]["samples"] == [[["GET"], 2]]
+    assert merged["in_progress"]["samples"] == [[[], 1]]
+
+
+def test_multiprocess_store_clear(tmp_path: Path):
+    store = MultiprocessStore(
+        directory=tmp_path,
+        flush_interval=60,
+        collect_local=lambda: collect(build_registry()),
+    )
+    store.flush()
+    tmp_path.joinpath("1.json").write_text("{}")
+
+    store.clear()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_middleware_labels_requests_by_route():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+
+    with TestClient(app) as client:
+        assert client.get("/items/1").status_code == 200
+        assert client.get("/items/2").status_code == 200
+        assert client.get("/missing").status_code == 404
+
+    matched = http_request_duration_seconds.labels(
+        "GET", "/items/{item_id}", "200"
+    )
+    unmatched = http_request_duration_seconds.labels(
+        "GET", "<unmatched>", "404"
+    )
+    assert matched.count == 2
+    assert unmatched.count >= 1
+
+
+def test_middleware_labels_mounted_apps_by_mount_path():
+    async def files(scope, receive, send):
+        await PlainTextResponse("file")(scope, receive, send)
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.mount("/files", files)
+
+    with TestClient(app) as client:
+        assert client.get("/files/a.txt").status_code == 200
+
+    assert http_request_duration_seconds.labels("GET", "/files", "200").count
@@ -0,0 +1,54 @@
+import asyncio
+
+from app.services import ServiceOverloadedError
+from app.services.hashing import PasswordHasher, get_password_context
+
+
+def build_hasher(**kwargs) -> PasswordHasher:
+    options = {
+        "pool_type": "thread",
+        "pool_size": 1,
+        "max_queue_depth": 4,
+        "rounds": 4,
+        "retry_after": 1,
+    }
+    options.update(kwargs)
+    return PasswordHasher(**options)
+
+
+def test_hash_runs_off_the_event_loop():
+    hasher = build_hasher()
+
+    hashed_password = asyncio.run(hasher.hash("123123"))
+
+    assert get_password_context(4).verify("123123", hashed_password)
+    assert hasher.pending == 0
+    hasher.shutdown()
+
+
+def test_hash_rejects_requests_when_queue_is_full():
+    hasher = build_hasher(max_queue_depth=2)
+
+    async def hash_many():
+        return await asyncio.gather(
+            *(hasher.hash(f"password-{i}") for i in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(hash_many())
+
+    assert sum(isinstance(r, str) for r in results) == 2
+    errors = [r for r in results if isinstance(r, ServiceOverloadedError)]
+    assert len(errors) == 1
+    assert errors[0].retry_after == 1
+    hasher.shutdown()
+
+
+def test_warm_up_starts_the_pool():
+    hasher = build_hasher(pool_size=2)
+
+    asyncio.run(hasher.warm_up())
+
+    assert hasher._executor is not None
+    assert hasher.pending == 0
+    hasher.shutdown()
@@ -0,0 +1,161 @@
+import asyncio
+from contextlib import asynccontextmanager
+from os import utime
+from pathlib import Path
+from time import time
+from typing import Dict, List, Sequence
+
+import pytest
+
+from app.services import cleanup
+from app.services.cleanup import ProfileImageCollector
+from app.services.images import get_image_files, get_image_path
+
+
+HASHES: List[str] = [f"{index:02x}" * 32 for index in range(5)]
+
+
+def build_collector(tmp_path: Path, **kwargs) -> ProfileImageCollector:
+    options = {
+        "images_folder": tmp_path,
+        "thumbnail_sizes": (32,),
+        "interval": 1,
+        "batch_size": 2,
+        "rate": 1e6,
+        "reconcile_interval": 1,
+        "grace_period": 60,
+    }
+    options.update(kwargs)
+    return ProfileImageCollector(**options)
+
+
+def write_file(folder: Path, path: str, age: float = 3600) -> Path:
+    file: Path = folder.joinpath(path)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_bytes(b"image")
+    modified_at: float = time() - age
+    utime(file, (modified_at, modified_at))
+    return file
+
+
+def write_image(folder: Path, image_hash: str, age: float = 3600) -> str:
+    profile_image: str = get_image_path(image_hash, ".png")
+    for path in get_image_files(profile_image, (32,)):
+        write_file(folder, path, age)
+
+    return profile_image
+
+
+@pytest.fixture
+def database(monkeypatch: pytest.MonkeyPatch) -> Dict:
+    state: Dict = {"images": set(), "active": set(), "locked": False}
+
+    @asynccontextmanager
+    async def in_transaction(connection_name: str):
+        yield None
+
+    @asynccontextmanager
+    async def try_advisory_lock(key: int):
+        yield not state["locked"]
+
+    async def claim_unknown_profile_images(
+        image_hashes: Sequence[str], connection
+    ) -> List[str]:
+        return [
+            image_hash
+            for image_hash in image_hashes
+            if image_hash not in state["images"]
+        ]
+
+    async def delete_profile_images(image_hashes: Sequence[str], connection):
+        state["deleted"] = list(image_hashes)
+
+    async def find_active_profile_images(profile_images: Sequence[str]):
+        return set(profile_images) & state["active"]
+
+    for function in (
+        in_transaction,
+        try_advisory_lock,
+        claim_unknown_profile_images,
+        delete_profile_images,
+        find_active_profile_images,
+    ):
+        monkeypatch.setattr(cleanup, function.__name__, function)
+
+    return state
+
+
+def test_collect_released(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, database: Dict
+):
+    released: List[Dict] = [
+        {"hash": image_hash, "extension": ".png", "size": 10}
+        for image_hash in HASHES[:3]
+    ]
+    for image in released:
+        write_image(tmp_path, image["hash"])
+    kept: str = write_image(tmp_path, HASHES[3])
+    limits: List[int] = []
+
+    async def delete_released_profile_images(limit: int, connection):
+        limits.append(limit)
+        batch: List[Dict] = released[:limit]
+        del released[:limit]
+        return batch
+
+    monkeypatch.setattr(
+        cleanup,
+        "delete_released_profile_images",
+        delete_released_profile_images,
+    )
+
+    reclaimed: int = asyncio.run(build_collector(tmp_path).collect_released())
+
+    assert reclaimed == 30
+    # a batch short of the batch size ends the collection
+    assert limits == [2, 2]
+    assert sorted(
+        path.relative_to(tmp_path).as_posix()
+        for path in tmp_path.glob("**/*")
+        if path.is_file()
+    ) == sorted(get_image_files(kept, (32,)))
+
+
+def test_reconcile(tmp_path: Path, database: Dict):
+    database["images"] = {HASHES[0]}
+    database["active"] = {"2021-07-21/active.jpg"}
+    referenced: str = write_image(tmp_path, HASHES[0])
+    write_image(tmp_path, HASHES[1])
+    # might be an image still being stored
+    recent: str = write_image(tmp_path, HASHES[2], age=1)
+    write_file(tmp_path, f"{HASHES[0][:2]}/{HASHES[0]}.png.tmp")
+    write_file(tmp_path, "2021-07-21/active.jpg")
+    write_file(tmp_path, "2021-07-21/deleted.jpg")
+    write_file(tmp_path, "2021-07-22/deleted.jpg")
+
+    reclaimed: int = asyncio.run(build_collector(tmp_path).reconcile())
+
+    # the 3 files of the unknown image, a temporary file and 2 images
+    #  stored per user
+    assert reclaimed == 6 * len(b"image")
+    assert database["deleted"] == [HASHES[1]]
+    assert sorted(
+        path.relative_to(tmp_path).as_posix()
+        for path in tmp_path.glob("**/*")
+        if path.is_file()
+    ) == sorted(
+        [
+            *get_image_files(referenced, (32,)),
+            *get_image_files(recent, (32,)),
+            "2021-07-21/active.jpg",
+        ]
+    )
+    assert not tmp_path.joinpath("2021-07-22").exists()
+
+
+def test_reconcile_runs_in_a_single_worker(tmp_path: Path, database: Dict):
+    database["locked"] = True
+    write_file(tmp_path, "2021-07-21/deleted.jpg")
+
+    assert asyncio.run(build_collector(tmp_path).reconcile()) == 0
+    assert tmp_path.joinpath("2021-07-21", "deleted.jpg").is_file()
@@ -0,0 +1,158 @@
+import asyncio
+from pathlib import Path
+from typing import List
+
+import pytest
+from PIL import Image
+
+from app.services import ProfileImageError
+from app.services.images import (
+    ProfileImageIngestor,
+    StoredImage,
+    get_image_file_hash,
+    get_image_files,
+    get_image_hash,
+    get_image_path,
+    get_thumbnail_path,
+    get_webp_path,
+)
+from app.tests.stub_server import StubImageServer
+
+
+def build_ingestor(upload_folder: Path, **kwargs) -> ProfileImageIngestor:
+    options = {
+        "upload_folder": upload_folder,
+        "max_bytes": 64 * 1024,
+        "timeout": 0.5,
+        "pool_size": 1,
+        "workers": 1,
+        "queue_size": 2,
+        "retry_after": 1,
+        "requeue_interval": 1,
+    }
+    options.update(kwargs)
+    return ProfileImageIngestor(**options)
+
+
+def ingest(ingestor: ProfileImageIngestor, *urls: str) -> List[StoredImage]:
+    async def run():
+        try:
+            return [await ingestor.store_image_from_url(url) for url in urls]
+        finally:
+            await ingestor.aclose()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "path,extension,image_format",
+    [
+        ("/image.jpg", ".jpg", "JPEG"),
+        ("/image.png", ".png", "PNG"),
+        ("/image.webp", ".png", "PNG"),
+    ],
+)
+def test_download_image_from_url(
+    tmp_path: Path,
+    stub_server: StubImageServer,
+    path: str,
+    extension: str,
+    image_format: str,
+):
+    (image,) = ingest(
+        build_ingestor(tmp_path, thumbnail_sizes=(32, 128)),
+        stub_server.url(path),
+    )
+
+    assert image.extension == extension
+    profile_image: str = get_image_path(image.hash, image.extension)
+    assert get_image_hash(profile_image) == image.hash
+    assert profile_image == f"{image.hash[:2]}/{image.hash}{extension}"
+    image_path = tmp_path.joinpath("profile_images", profile_image)
+    assert image_path.is_file()
+    assert Image.open(image_path).format == image_format
+    webp = Image.open(
+        tmp_path.joinpath("profile_images", get_webp_path(profile_image))
+    )
+    assert (webp.format, webp.size) == ("WEBP", (64, 64))
+
+    # thumbnails are never upscaled past the 64 pixels of the image
+    for size, side in ((32, 32), (128, 64)):
+        thumbnail = Image.open(
+            tmp_path.joinpath(
+                "profile_images", get_thumbnail_path(profile_image, size)
+            )
+        )
+        assert thumbnail.format == "WEBP"
+        assert thumbnail.size == (side, side)
+
+    assert image.size == sum(
+        path.stat().st_size for path in tmp_path.glob("**/*") if path.is_file()
+    )
+    assert not list(tmp_path.glob("**/*.tmp"))
+
+
+def test_same_images_are_stored_once(
+    tmp_path: Path, stub_server: StubImageServer
+):
+    png, copy, jpeg = ingest(
+        build_ingestor(tmp_path, thumbnail_sizes=(32,)),
+        stub_server.url("/image.png"),
+        stub_server.url("/avatar.png"),
+        stub_server.url("/image.jpg"),
+    )
+
+    assert png == copy
+    assert jpeg.hash != png.hash
+    assert len(list(tmp_path.glob("**/*.png"))) == 1
+    # a full size copy and a thumbnail for each
+    assert len(list(tmp_path.glob("**/*.webp"))) == 4
+
+
+def test_release_legacy_image(tmp_path: Path):
+    date_folder: Path = tmp_path.joinpath("profile_images", "2021-07-21")
+    date_folder.mkdir(parents=True)
+    date_folder.joinpath("a.jpg").write_bytes(b"image")
+
+    asyncio.run(build_ingestor(tmp_path).release("2021-07-21/a.jpg"))
+
+    # left to the collector, which removes it once no active user has it
+    assert date_folder.joinpath("a.jpg").is_file()
+    assert get_image_hash("2021-07-21/a.jpg") is None
+    assert get_image_file_hash("2021-07-21/a.jpg") is None
+
+
+def test_image_files(tmp_path: Path, stub_server: StubImageServer):
+    (image,) = ingest(
+        build_ingestor(tmp_path, thumbnail_sizes=(32, 128)),
+        stub_server.url("/image.png"),
+    )
+    profile_image: str = get_image_path(image.hash, image.extension)
+
+    files = get_image_files(profile_image, (32, 128))
+    assert sorted(files) == sorted(
+        path.relative_to(tmp_path.joinpath("profile_images")).as_posix()
+        for path in tmp_path.glob("**/*")
+        if path.is_file()
+    )
+    assert {get_image_file_hash(path) for path in files} == {image.hash}
+
+
+@pytest.mark.parametrize(
+    "path,error",
+    [
+        ("/large.jpg", "is bigger than the allowed 65536 bytes."),
+        ("/document.txt", "But we detected text/plain."),
+        ("/missing.jpg", "STATUS CODE: 404"),
+        ("/broken.jpg", "is not a valid image."),
+        ("/slow.jpg", "Timed out after 0.5 seconds"),
+    ],
+)
+def test_download_image_from_url_errors(
+    tmp_path: Path, stub_server: StubImageServer, path: str, error: str
+):
+    with pytest.raises(ProfileImageError) as exc_info:
+        ingest(build_ingestor(tmp_path), stub_server.url(path))
+
+    assert error in exc_info.value.msg
+    assert not list(tmp_path.glob("**/*.jpg"))
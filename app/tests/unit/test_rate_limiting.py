@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.middleware import RateLimitMiddleware
+from app.services.ratelimit import (
+    AdmissionControl,
+    MemoryRateLimitBackend,
+    RateLimit,
+    RateLimitBackend,
+    RateLimiter,
+    RedisRateLimitBackend,
+    rate_limit_backend_errors,
+)
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [MemoryRateLimitBackend(max_size=10), RedisRateLimitBackend(FakeRedis())],
+)
+def test_token_bucket(backend, run):
+    # slow enough for the burst not to be refilled on a loaded machine
+    limit = RateLimit(rate=5, burst=2)
+
+    async def acquire():
+        return await backend.acquire("client", limit)
+
+    async def scenario():
+        burst = [await acquire() for _ in range(3)]
+        await asyncio.sleep(0.25)
+        return burst, await acquire()
+
+    burst, refilled = run(scenario())
+
+    assert burst[:2] == [0, 0]
+    assert 0 < burst[2] <= 1 / limit.rate
+    assert refilled == 0
+
+
+def test_memory_backend_drops_least_recently_used_buckets(run):
+    backend = MemoryRateLimitBackend(max_size=2)
+    limit = RateLimit(rate=1, burst=1)
+
+    async def scenario():
+        for client in ("a", "b", "a", "c"):
+            await backend.acquire(client, limit)
+
+        # "a" is still empty, "b" starts over with a full bucket
+        return await backend.acquire("a", limit), await backend.acquire(
+            "b", limit
+        )
+
+    a, b = run(scenario())
+
+    assert len(backend) == 2
+    assert b == 0
+    assert a > 0
+
+
+def test_rate_limiter_lets_requests_through_when_its_backend_fails(run):
+    class FailingBackend(RateLimitBackend):
+        async def acquire(self, key: str, limit: RateLimit) -> float:
+            raise ConnectionError("down")
+
+    limiter = RateLimiter(
+        backend=FailingBackend(), limits={"read": RateLimit(1, 1)}
+    )
+    errors = rate_limit_backend_errors.value
+
+    assert run(limiter.acquire("client", "read")) == 0
+    assert rate_limit_backend_errors.value == errors + 1
+
+
+def build_client(limiter: RateLimiter, admission: AdmissionControl):
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitMiddleware, limiter=limiter, admission=admission
+    )
+
+    @app.get("/items")
+    async def list_items():
+        return []
+
+    @app.post("/items")
+    async def create_item():
+        return {}
+
+    return TestClient(app)
+
+
+def test_middleware_rejects_clients_over_their_limit():
+    limiter = RateLimiter(
+        backend=MemoryRateLimitBackend(max_size=10),
+        limits={"read": RateLimit(0.5, 2), "write": RateLimit(0.5, 1)},
+    )
+    client = build_client(limiter, AdmissionControl(10, retry_after=1))
+
+    assert client.get("/items").status_code == 200
+    assert client.get("/items").status_code == 200
+    response = client.get("/items")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert response.json()["detail"]
+
+    # each route class has its own bucket
+    assert client.post("/items").status_code == 200
+    assert client.post("/items").status_code == 429
+
+
+def test_middleware_caps_concurrent_writes():
+    limiter = RateLimiter(backend=None, limits={})
+    admission = AdmissionControl(max_concurrency=1, retry_after=3)
+    client = build_client(limiter, admission)
+
+    assert client.post("/items").status_code == 200
+    assert admission.in_flight == 0
+
+    admission.in_flight = 1
+    response = client.post("/items")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    # reads are not capped
+    assert client.get("/items").status_code == 200
@@ -0,0 +1,167 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from app.db.routing import ReplicaRouter
+
+
+class FakeConnection:
+    def __init__(self, name: str, calls: List[str], reachable: bool = True):
+        self.name = name
+        self.calls = calls
+        self.reachable = reachable
+
+    async def create_connection(self, with_db: bool):
+        if not self.reachable:
+            raise ConnectionRefusedError(f"{self.name} is down")
+
+    async def execute_query(self, query: str):
+        self.calls.append(self.name)
+
+        if not self.reachable:
+            raise ConnectionRefusedError(f"{self.name} is down")
+
+    async def close(self):
+        pass
+
+
+def build_router(
+    connections: Dict[str, FakeConnection], read_after_write_window=60.0
+) -> ReplicaRouter:
+    router = ReplicaRouter(
+        primary="default",
+        replicas={
+            name: connection
+            for name, connection in connections.items()
+            if name != "default"
+        },
+        read_after_write_window=read_after_write_window,
+        health_check_interval=60.0,
+        health_check_timeout=1.0,
+        get_connection=connections.__getitem__,
+    )
+    # replicas only join the rotation once they passed a health check
+    router.healthy.update(router.replicas)
+    return router
+
+
+def build_connections(calls: List[str], **reachable: bool):
+    return {
+        name: FakeConnection(name, calls, reachable=reachable.get(name, True))
+        for name in ("default", "replica_0", "replica_1")
+    }
+
+
+async def run_query(connection: FakeConnection) -> str:
+    await connection.execute_query("SELECT 1")
+    return connection.name
+
+
+def test_reads_are_spread_over_replicas():
+    calls: List[str] = []
+    router = build_router(build_connections(calls))
+
+    for _ in range(4):
+        asyncio.run(router.read(run_query))
+
+    assert calls == ["replica_0", "replica_1", "replica_0", "replica_1"]
+
+
+def test_reads_go_to_primary_without_replicas():
+    calls: List[str] = []
+    router = build_router({"default": FakeConnection("default", calls)})
+
+    assert asyncio.run(router.read(run_query)) == "default"
+
+
+def test_failed_replica_falls_back_to_primary():
+    calls: List[str] = []
+    router = build_router(build_connections(calls, replica_0=False))
+
+    assert asyncio.run(router.read(run_query)) == "default"
+    assert calls == ["replica_0", "default"]
+    assert router.healthy == {"replica_1"}
+
+    # the failed replica stays out of rotation
+    assert asyncio.run(router.read(run_query)) == "replica_1"
+    assert asyncio.run(router.read(run_query)) == "replica_1"
+
+
+def test_query_errors_are_not_retried():
+    calls: List[str] = []
+    router = build_router(build_connections(calls))
+
+    async def failing_query(connection: FakeConnection):
+        raise ValueError("bad query")
+
+    with pytest.raises(ValueError):
+        asyncio.run(router.read(failing_query))
+
+    assert router.healthy == {"replica_0", "replica_1"}
+
+
+def test_replicas_join_rotation_after_health_check():
+    calls: List[str] = []
+    connections = build_connections(calls)
+    router = build_router(connections)
+    router.healthy.clear()
+
+    assert asyncio.run(router.read(run_query)) == "default"
+
+    asyncio.run(router.check_health())
+    assert router.healthy == {"replica_0", "replica_1"}
+    assert asyncio.run(router.read(run_query)) == "replica_0"
+
+
+def test_health_check_restores_replicas():
+    calls: List[str] = []
+    connections = build_connections(calls, replica_1=False)
+    router = build_router(connections)
+
+    asyncio.run(router.check_health())
+    assert router.healthy == {"replica_0"}
+
+    connections["replica_1"].reachable = True
+    asyncio.run(router.check_health())
+    assert router.healthy == {"replica_0", "replica_1"}
+
+
+def test_reads_after_writes_go_to_primary():
+    calls: List[str] = []
+    router = build_router(build_connections(calls))
+    user_id: str = "8b0a5e96-8a4e-4e0c-9a53-2f7e5d9b1c3a"
+
+    router.mark_written(user_id)
+
+    assert asyncio.run(router.read(run_query, key=user_id.upper())) == (
+        "default"
+    )
+    assert asyncio.run(router.read(run_query, key="someone-else")) == (
+        "replica_0"
+    )
+
+
+def test_batch_reads_with_a_written_key_go_to_primary():
+    calls: List[str] = []
+    router = build_router(build_connections(calls))
+
+    router.mark_written("user")
+
+    assert asyncio.run(router.read(run_query, keys=["other", "user"])) == (
+        "default"
+    )
+    assert asyncio.run(router.read(run_query, keys=["other"])) == ("replica_0")
+
+
+def test_read_after_write_window_expires():
+    calls: List[str] = []
+    router = build_router(
+        build_connections(calls), read_after_write_window=0.01
+    )
+
+    router.mark_written("user")
+    asyncio.run(asyncio.sleep(0.02))
+
+    assert asyncio.run(router.read(run_query, key="user")) == "replica_0"
+    assert not router._written
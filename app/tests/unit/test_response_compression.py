@@ -0,0 +1,231 @@
+import asyncio
+import gzip
+from typing import Iterator, List, Optional
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Message, Receive, Scope, Send
+
+from app.middleware import CompressionMiddleware
+from app.services.compression import ResponseCompression
+
+
+BODY: bytes = b'{"username": "john"}' * 200
+ETAG: str = '"abc"'
+
+
+@pytest.fixture
+def compression() -> ResponseCompression:
+    return ResponseCompression(
+        levels={"gzip": 6},
+        minimum_size=100,
+        offload_size=1000,
+        content_types=("application/json", "text/"),
+    )
+
+
+@pytest.fixture
+def client(compression: ResponseCompression) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, compression=compression)
+
+    @app.get("/json")
+    def json():
+        return Response(BODY, media_type="application/json")
+
+    @app.get("/small")
+    def small():
+        return Response(b"{}", media_type="application/json")
+
+    @app.get("/image")
+    def image():
+        return Response(BODY, media_type="image/png")
+
+    @app.get("/stream")
+    def stream():
+        def lines() -> Iterator[bytes]:
+            for _ in range(100):
+                yield BODY[:100]
+
+        return StreamingResponse(lines(), media_type="text/plain")
+
+    @app.get("/etag")
+    def etag():
+        return PlainTextResponse(BODY.decode(), headers={"ETag": ETAG})
+
+    @app.get("/not-modified")
+    def not_modified():
+        return Response(status_code=304, headers={"ETag": ETAG})
+
+    @app.get("/headers")
+    def headers(request: Request):
+        return {
+            name: request.headers[name]
+            for name in ("if-none-match", "if-match")
+        }
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, None),
+        ("", None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("deflate, gzip;q=0.5", "gzip"),
+        ("GZIP", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("*;q=0.1, gzip;q=0", None),
+        ("br", None),
+    ],
+)
+def test_choose_encoding(
+    compression: ResponseCompression,
+    accept_encoding: Optional[str],
+    expected: Optional[str],
+):
+    assert compression.choose_encoding(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("encoding", ["br", "zstd"])
+def test_choose_encoding_prefers_the_best_available(encoding: str):
+    pytest.importorskip({"br": "brotli", "zstd": "zstandard"}[encoding])
+    compression = ResponseCompression(
+        levels={"gzip": 6, encoding: 3},
+        minimum_size=100,
+        offload_size=1000,
+        content_types=("application/json",),
+    )
+
+    assert compression.choose_encoding(f"gzip, {encoding}") == encoding
+    assert compression.choose_encoding(f"gzip, {encoding};q=0.5") == "gzip"
+
+
+@pytest.mark.parametrize("copies", [1, 10])
+def test_compress(compression: ResponseCompression, copies: int):
+    # the larger body is compressed on a thread
+    body: bytes = BODY * copies
+    compressed: bytes = asyncio.run(compression.compress(body, "gzip"))
+
+    assert len(compressed) < len(body)
+    assert gzip.decompress(compressed) == body
+
+
+def test_encode_and_decode_etags(compression: ResponseCompression):
+    encoded: str = compression.encode_etag(ETAG, "gzip")
+
+    assert encoded == '"abc-gzip"'
+    assert compression.decode_etags(f'{encoded}, W/"def-gzip"') == (
+        '"abc", W/"def"'
+    )
+    assert compression.decode_etags('"abc-br"') == '"abc-br"'
+
+
+def test_compresses_json(client: TestClient):
+    response = client.get("/json", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(BODY)
+    # the test client transparently decodes the body
+    assert response.content == BODY
+
+
+def test_leaves_small_or_unaccepted_or_binary_bodies_alone(
+    client: TestClient,
+):
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/json", headers={"Accept-Encoding": "identity"})
+    image = client.get("/image", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in small.headers
+    assert small.headers["vary"] == "Accept-Encoding"
+    assert "content-encoding" not in identity.headers
+    assert identity.content == BODY
+    assert "content-encoding" not in image.headers
+    assert "vary" not in image.headers
+
+
+def test_compresses_streams(client: TestClient):
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.content == BODY[:100] * 100
+
+
+def test_encodes_etags_of_compressed_bodies(client: TestClient):
+    compressed = client.get("/etag", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/etag", headers={"Accept-Encoding": "identity"})
+
+    assert compressed.headers["etag"] == '"abc-gzip"'
+    assert identity.headers["etag"] == ETAG
+
+
+def test_not_modified_keeps_the_encoded_etag(client: TestClient):
+    response = client.get(
+        "/not-modified",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": '"abc-gzip"'},
+    )
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"abc-gzip"'
+
+
+def test_decodes_conditional_headers(client: TestClient):
+    response = client.get(
+        "/headers",
+        headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": '"abc-gzip", "def"',
+            "If-Match": '"abc-gzip"',
+        },
+    )
+
+    assert response.json() == {
+        "if-none-match": '"abc", "def"',
+        "if-match": ETAG,
+    }
+
+
+def test_passes_other_messages_through(compression: ResponseCompression, run):
+    messages: List[Message] = []
+    file_message: Message = {"type": "http.response.zerocopysend"}
+
+    async def app(scope: Scope, receive: Receive, send: Send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send(file_message)
+
+    async def send(message: Message):
+        messages.append(message)
+
+    run(
+        CompressionMiddleware(app, compression=compression)(
+            {
+                "type": "http",
+                "method": "GET",
+                "path": "/",
+                "headers": [(b"accept-encoding", b"gzip")],
+            },
+            None,
+            send,
+        )
+    )
+
+    assert [message["type"] for message in messages] == [
+        "http.response.start",
+        "http.response.zerocopysend",
+    ]
@@ -0,0 +1,20 @@
+from app.server import ServerWorker, get_options, get_worker_count
+
+
+def test_worker_count_follows_cpus():
+    assert get_worker_count(4, 1.0, pool_max_size=5, max_connections=90) == 4
+    assert get_worker_count(4, 1.5, pool_max_size=5, max_connections=90) == 6
+
+
+def test_worker_count_fits_database_connections():
+    assert get_worker_count(32, 1.0, pool_max_size=5, max_connections=90) == 18
+    assert get_worker_count(8, 1.0, pool_max_size=20, max_connections=10) == 1
+
+
+def test_options():
+    options = get_options(workers=3)
+
+    assert options["workers"] == 3
+    assert options["preload_app"] is True
+    assert options["worker_class"] == "app.server.ServerWorker"
+    assert ServerWorker.CONFIG_KWARGS["lifespan"] == "on"
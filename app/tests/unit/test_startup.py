@@ -0,0 +1,37 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from app.db.schema import get_latest_migration
+
+
+def test_heavy_modules_are_imported_lazily():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, app.main; "
+            "print(*sorted({m.split('.')[0] for m in sys.modules}))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    imported = set(result.stdout.split())
+
+    assert "fastapi" in imported
+    assert not imported & {"PIL", "httpx", "passlib", "bcrypt"}
+
+
+def test_latest_migration(tmp_path: Path):
+    assert get_latest_migration(tmp_path) is None
+
+    for name in (
+        "0_20210101_init.sql",
+        "10_20210301_b.sql",
+        "2_20210201_a.sql",
+    ):
+        tmp_path.joinpath(name).touch()
+
+    assert get_latest_migration(tmp_path) == "10_20210301_b.sql"
+    assert get_latest_migration() is not None
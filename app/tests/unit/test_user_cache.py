@@ -0,0 +1,188 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import List
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from app.services.cache import (
+    CachedPayload,
+    CachedResponse,
+    LRUCacheBackend,
+    PayloadCache,
+    RedisCacheBackend,
+    UserCache,
+    user_cache_evictions,
+    user_cache_hits,
+    user_cache_misses,
+)
+
+
+USER_ID: str = "8b0a5e96-8a4e-4e0c-9a53-2f7e5d9b1c3a"
+
+
+def build_loader(calls: List[str], status_code: int = 200, delay: float = 0):
+    async def loader() -> CachedResponse:
+        calls.append(USER_ID)
+        await asyncio.sleep(delay)
+        return CachedResponse(status_code=status_code, body=b'{"id":1}')
+
+    return loader
+
+
+def test_cached_responses_round_trip():
+    modified_at = datetime(
+        2021, 7, 21, 10, 30, 15, 123456, tzinfo=timezone.utc
+    )
+
+    for response in (
+        CachedResponse(200, b'{"a":"b:c"}', modified_at=modified_at),
+        CachedResponse(404, b"User with id 1 was not found"),
+    ):
+        assert CachedResponse.decode(response.encode()) == response
+
+
+def test_lru_backend_evicts_least_recently_used():
+    backend = LRUCacheBackend(max_size=2)
+    evictions = user_cache_evictions.value
+
+    async def run():
+        await backend.set("a", b"1", ttl=60)
+        await backend.set("b", b"2", ttl=60)
+        assert await backend.get("a") == b"1"
+        await backend.set("c", b"3", ttl=60)
+
+        assert await backend.get("b") is None
+        assert await backend.get("a") == b"1"
+        assert await backend.get("c") == b"3"
+
+    asyncio.run(run())
+    assert len(backend) == 2
+    assert user_cache_evictions.value == evictions + 1
+
+
+def test_lru_backend_expires_entries():
+    backend = LRUCacheBackend(max_size=2)
+
+    async def run():
+        await backend.set("a", b"1", ttl=0.01)
+        await asyncio.sleep(0.02)
+        return await backend.get("a")
+
+    assert asyncio.run(run()) is None
+    assert len(backend) == 0
+
+
+@pytest.mark.parametrize(
+    "backend", [LRUCacheBackend(max_size=10), RedisCacheBackend(FakeRedis())]
+)
+def test_read_through_and_invalidation(backend):
+    cache = UserCache(backend=backend, ttl=60, negative_ttl=60)
+    calls: List[str] = []
+    hits, misses = user_cache_hits.value, user_cache_misses.value
+
+    async def run():
+        first = await cache.get_or_load(USER_ID, build_loader(calls))
+        second = await cache.get_or_load(USER_ID.upper(), build_loader(calls))
+        await cache.invalidate(USER_ID)
+        third = await cache.get_or_load(USER_ID, build_loader(calls))
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+
+    assert first == second == third == CachedResponse(200, b'{"id":1}')
+    assert len(calls) == 2
+    assert user_cache_hits.value == hits + 1
+    assert user_cache_misses.value == misses + 2
+
+
+def test_not_found_responses_are_cached_for_negative_ttl():
+    cache = UserCache(
+        backend=LRUCacheBackend(max_size=10), ttl=60, negative_ttl=0.01
+    )
+    calls: List[str] = []
+
+    async def run():
+        loader = build_loader(calls, status_code=404)
+        await cache.get_or_load(USER_ID, loader)
+        await cache.get_or_load(USER_ID, loader)
+        assert len(calls) == 1
+        await asyncio.sleep(0.02)
+        return await cache.get_or_load(USER_ID, loader)
+
+    assert asyncio.run(run()).status_code == 404
+    assert len(calls) == 2
+
+
+def test_concurrent_misses_load_once():
+    cache = UserCache(
+        backend=LRUCacheBackend(max_size=10), ttl=60, negative_ttl=60
+    )
+    calls: List[str] = []
+
+    async def run():
+        return await asyncio.gather(
+            *(
+                cache.get_or_load(USER_ID, build_loader(calls, delay=0.01))
+                for _ in range(10)
+            )
+        )
+
+    responses = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(response.status_code == 200 for response in responses)
+
+
+def test_failed_loads_are_shared_and_not_cached():
+    cache = UserCache(
+        backend=LRUCacheBackend(max_size=10), ttl=60, negative_ttl=60
+    )
+    calls: List[str] = []
+
+    async def failing_loader() -> CachedResponse:
+        calls.append(USER_ID)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database is down")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get_or_load(USER_ID, failing_loader) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert asyncio.run(cache.backend.get(cache.get_key(USER_ID))) is None
+
+
+def test_payload_cache_drops_entries_rendered_before_a_write():
+    cache = PayloadCache(max_size=2, ttl=60)
+    payload = CachedPayload(b"[]", {"ETag": '"a"'}, modified_at=None)
+
+    version: int = cache.version
+    cache.set(("a",), payload, version=version)
+    assert cache.get(("a",)) == payload
+
+    # rendered from data read before the write
+    version = cache.version
+    cache.bump_version()
+    cache.set(("b",), payload, version=version)
+    assert cache.get(("a",)) is None
+    assert cache.get(("b",)) is None
+
+    for key in ("a", "b", "c"):
+        cache.set((key,), payload, version=cache.version)
+    assert len(cache) == 2
+    assert cache.get(("a",)) is None
+
+
+def test_payload_cache_expires_entries():
+    cache = PayloadCache(max_size=2, ttl=0)
+    cache.set(("a",), CachedPayload(b"[]", {}, None), version=cache.version)
+
+    assert cache.get(("a",)) is None
+    assert len(cache) == 0
+    assert not PayloadCache(max_size=0, ttl=60).enabled
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Dict, List
+from uuid import UUID, uuid4
+
+import pytest
+
+from app.services.loader import UserLoader, user_loader_batch_size
+
+
+USER_IDS: List[UUID] = [uuid4() for _ in range(3)]
+
+
+def build_loader(
+    batches: List[List[UUID]],
+    batch_window: float = 0,
+    max_batch_size: int = 100,
+) -> UserLoader:
+    async def load_many(user_ids: List[UUID]) -> List[Dict]:
+        batches.append(user_ids)
+        await asyncio.sleep(0)
+        # the first user does not exist
+        return [
+            {"id": user_id} for user_id in user_ids if user_id != USER_IDS[0]
+        ]
+
+    return UserLoader(
+        load_many=load_many,
+        batch_window=batch_window,
+        max_batch_size=max_batch_size,
+    )
+
+
+@pytest.mark.parametrize("batch_window", [0, 0.01])
+def test_concurrent_lookups_share_one_query(batch_window: float):
+    batches: List[List[UUID]] = []
+    loader = build_loader(batches, batch_window=batch_window)
+    count: int = user_loader_batch_size.count
+
+    async def run():
+        return await asyncio.gather(
+            loader.load(USER_IDS[0]),
+            loader.load(USER_IDS[1]),
+            loader.load(USER_IDS[2]),
+            loader.load(USER_IDS[1]),
+        )
+
+    missing, found, *found_again = asyncio.run(run())
+
+    assert batches == [USER_IDS]
+    assert missing is None
+    assert found == {"id": USER_IDS[1]}
+    assert found_again == [{"id": USER_IDS[2]}, {"id": USER_IDS[1]}]
+    assert user_loader_batch_size.count == count + 1
+
+
+def test_full_batches_are_dispatched_straight_away():
+    batches: List[List[UUID]] = []
+    loader = build_loader(batches, batch_window=60, max_batch_size=2)
+
+    async def run():
+        return await asyncio.wait_for(loader.load_all(USER_IDS[:2]), 1)
+
+    assert asyncio.run(run()) == [None, {"id": USER_IDS[1]}]
+    assert batches == [USER_IDS[:2]]
+
+
+def test_failed_query_fails_every_lookup_of_the_batch():
+    async def load_many(user_ids: List[UUID]) -> List[Dict]:
+        raise ConnectionRefusedError("down")
+
+    loader = UserLoader(load_many=load_many, batch_window=0, max_batch_size=10)
+
+    async def run():
+        return await asyncio.gather(
+            loader.load(USER_IDS[0]),
+            loader.load(USER_IDS[1]),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(e, ConnectionRefusedError) for e in results)
+
+
+def test_cancelled_lookup_does_not_cancel_the_others():
+    batches: List[List[UUID]] = []
+    loader = build_loader(batches, batch_window=0.01)
+
+    async def run():
+        cancelled = asyncio.create_task(loader.load(USER_IDS[1]))
+        other = asyncio.create_task(loader.load(USER_IDS[1]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await other
+
+    assert asyncio.run(run()) == {"id": USER_IDS[1]}
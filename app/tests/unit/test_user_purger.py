@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+from uuid import uuid4
+
+import pytest
+
+from app.services import purge
+from app.services.purge import UserPurger
+
+
+NOW: datetime = datetime(2026, 10, 18, 12, 0, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def deleted_users(monkeypatch: pytest.MonkeyPatch) -> List[Dict]:
+    users: List[Dict] = [
+        {
+            "id": uuid4(),
+            "username": f"deleted-{days}-days-ago",
+            "deleted_at": NOW - timedelta(days=days),
+        }
+        for days in (40, 35, 31, 29, 1)
+    ]
+
+    async def archive_deleted_users(deleted_before: datetime, limit: int):
+        purged: List[Dict] = [
+            user for user in users if user["deleted_at"] < deleted_before
+        ][:limit]
+        for user in purged:
+            users.remove(user)
+
+        return purged
+
+    async def get_deleted_users_summary(deleted_before: datetime) -> Dict:
+        return {
+            "deleted": len(users),
+            "pending": sum(
+                user["deleted_at"] < deleted_before for user in users
+            ),
+            "oldest_deleted_at": min(user["deleted_at"] for user in users),
+        }
+
+    monkeypatch.setattr(purge, "get_utc_now", lambda: NOW)
+    monkeypatch.setattr(purge, "archive_deleted_users", archive_deleted_users)
+    monkeypatch.setattr(
+        purge, "get_deleted_users_summary", get_deleted_users_summary
+    )
+    return users
+
+
+def test_purge(monkeypatch: pytest.MonkeyPatch, deleted_users: List[Dict]):
+    purger = UserPurger(retention_days=30, interval=1, batch_size=2)
+    expired: List[str] = [str(user["id"]) for user in deleted_users[:3]]
+    invalidated: List[str] = []
+
+    async def invalidate(user_id: str):
+        invalidated.append(user_id)
+
+    monkeypatch.setattr(purge.user_cache, "invalidate", invalidate)
+
+    assert asyncio.run(purger.get_backlog()) == {
+        "retention_days": 30,
+        "deleted_before": NOW - timedelta(days=30),
+        "deleted": 5,
+        "pending": 3,
+        "oldest_deleted_at": NOW - timedelta(days=40),
+    }
+
+    # in two batches, the second one short of the batch size
+    assert asyncio.run(purger.purge()) == 3
+    assert invalidated == expired
+    assert [user["username"] for user in deleted_users] == [
+        "deleted-29-days-ago",
+        "deleted-1-days-ago",
+    ]
+    assert asyncio.run(purger.get_backlog())["pending"] == 0
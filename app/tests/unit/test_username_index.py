@@ -0,0 +1,107 @@
+from typing import List
+
+from app.db.queries import escape_like
+from app.services.usernames import BloomFilter, UsernameFilter, UsernameIndex
+
+
+USERNAMES: List[str] = ["bob", "Alice", "alicia", "al_", "Bobby", "carol"]
+
+
+def build_index(usernames: List[str] = USERNAMES) -> UsernameIndex:
+    async def load() -> List[str]:
+        return list(usernames)
+
+    return UsernameIndex(load=load, refresh_interval=60)
+
+
+def test_search_by_prefix():
+    index = build_index()
+    index.replace(USERNAMES)
+
+    assert index.ready
+    assert len(index) == len(USERNAMES)
+    assert index.search("ali", limit=10) == ["Alice", "alicia"]
+    assert index.search("BOB", limit=10) == ["bob", "Bobby"]
+    assert index.search("al", limit=2) == ["al_", "Alice"]
+    assert index.search("dave", limit=10) == []
+    assert index.search("c", limit=10) == ["carol"]
+
+
+def test_writes_before_ready_are_ignored():
+    index = build_index()
+
+    index.add("dave")
+    index.remove("bob")
+
+    assert not index.ready
+    assert len(index) == 0
+
+
+def test_add_remove_rename():
+    index = build_index()
+    index.replace(USERNAMES)
+
+    index.add("Bobcat")
+    index.add("bob")
+    assert index.search("bob", limit=10) == ["bob", "Bobby", "Bobcat"]
+
+    index.remove("bobby")
+    assert index.search("bob", limit=10) == ["bob", "Bobby", "Bobcat"]
+
+    index.remove("Bobby")
+    assert index.search("bob", limit=10) == ["bob", "Bobcat"]
+
+    index.rename("Bobcat", "dave")
+    assert index.search("bob", limit=10) == ["bob"]
+    assert index.search("d", limit=10) == ["dave"]
+
+
+def test_refresh_replaces_the_index(run):
+    usernames: List[str] = ["erin"]
+    index = build_index(usernames)
+    index.replace(USERNAMES)
+
+    run(index.refresh())
+
+    assert index.search("", limit=10) == ["erin"]
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    added: List[str] = [f"user-{index}" for index in range(1000)]
+
+    for username in added:
+        bloom_filter.add(username)
+
+    assert all(username in bloom_filter for username in added)
+
+    false_positives: int = sum(
+        f"other-{index}" in bloom_filter for index in range(10000)
+    )
+    assert false_positives < 300
+
+
+def test_username_filter(run):
+    username_filter = UsernameFilter(
+        load=build_index().load, refresh_interval=60, error_rate=0.01
+    )
+
+    # nothing can be ruled out before the first load
+    assert "dave" in username_filter
+    username_filter.add("dave")
+    assert not username_filter.ready
+
+    run(username_filter.refresh())
+
+    assert username_filter.ready
+    assert all(username in username_filter for username in USERNAMES)
+    assert "dave" not in username_filter
+
+    username_filter.add("dave")
+    assert "dave" in username_filter
+
+
+def test_escape_like():
+    assert escape_like("al_%") == "al\\_\\%"
+    assert escape_like("a\\b") == "a\\\\b"
+    assert escape_like("alice") == "alice"
@@ -1,135 +1,247 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
 from datetime import datetime, timezone
-from io import BytesIO
-from mimetypes import guess_extension
-from pathlib import Path
-from typing import Dict, Optional, Union
-from uuid import uuid4
-
-from passlib.context import CryptContext
-from PIL import Image
-from requests import get as http_get
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import blake2b
+from json import dumps, loads
+from operator import attrgetter
+from re import compile
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+)
+from uuid import UUID
+
+import ujson
+from asyncpg.pgproto.pgproto import UUID as AsyncpgUUID
 
 from app.config import settings
-from app.db.models import User
-from app.schemas import CreateUser, UpdateUser
-
-
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.db.models import ProfileImageStatus
+from app.schemas import CreateUser, DisplayUser, UpdateUser
+from app.services.cache import EPOCH, MICROSECOND
+from app.services.hashing import (
+    get_password_context,
+    hashing_duration_seconds,
+    password_hasher,
+)
+from app.services.images import profile_image_ingestor
+
+
+# the columns to fetch, with ``.values()``, to render users without building
+#  model instances
+DISPLAY_USER_FIELDS: Tuple[str, ...] = tuple(DisplayUser.__fields__)
+DISPLAY_USER_ALIASES: Tuple[Tuple[str, str], ...] = tuple(
+    (name, field.alias) for name, field in DisplayUser.__fields__.items()
+)
+DISPLAY_USER_ENCODERS: Dict[type, Callable[[Any], Any]] = {
+    UUID: str,
+    # the type of the uuids in the rows of hand written queries
+    AsyncpgUUID: str,
+    datetime: DisplayUser.Config.json_encoders[datetime],
+    ProfileImageStatus: attrgetter("value"),
+}
+
+ENTITY_TAG: Pattern = compile(r'\*|(?:W/)?"[^"]*"')
 
 
 def get_utc_now() -> datetime:
     return datetime.now(tz=timezone.utc)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return password_context.verify(plain_password, hashed_password)
+def encode_cursor(created_at: datetime, user_id: Union[UUID, str]) -> str:
+    """
+    Builds the opaque keyset cursor pointing right after the given row of
+    the ``(created_at, id)`` ordering.
+    """
+    payload: str = dumps([created_at.isoformat(), str(user_id)])
+    return urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
 
 
-def get_password_hash(password: str) -> str:
-    return password_context.hash(password)
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        created_at, user_id = loads(
+            urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        )
+        # anything else would fail to parse with an AttributeError
+        if not isinstance(created_at, str) or not isinstance(user_id, str):
+            raise TypeError
+
+        decoded: datetime = datetime.fromisoformat(created_at)
+        # only ever compared with the timestamps of the database, which
+        #  have an offset
+        if decoded.tzinfo is None:
+            raise ValueError
+
+        return decoded, UUID(user_id)
+    except (BinasciiError, TypeError, ValueError):
+        raise ValueError(f'Invalid cursor "{cursor}".')
+
+
+def get_display_user_dict(row: Dict) -> Dict:
+    """
+    Turns a row fetched with ``.values(*DISPLAY_USER_FIELDS)`` into the same
+    dict ``jsonable_encoder`` builds for a ``DisplayUser``, camelCase keys
+    included, without going through the model or the schema.
+    """
+    display_user: Dict = {}
+
+    for name, alias in DISPLAY_USER_ALIASES:
+        value: Any = row[name]
+        encoder: Optional[Callable] = DISPLAY_USER_ENCODERS.get(type(value))
+        display_user[alias] = value if encoder is None else encoder(value)
+
+    return display_user
+
+
+def render_display_users(rows: Iterable[Dict]) -> bytes:
+    """
+    Renders users to the exact bytes FastAPI would send for a
+    ``List[DisplayUser]`` response model.
+    """
+    return ujson.dumps(
+        [get_display_user_dict(row) for row in rows],
+        ensure_ascii=False,
+        escape_forward_slashes=False,
+    ).encode("utf-8")
+
+
+def render_display_user(row: Dict) -> bytes:
+    return ujson.dumps(
+        get_display_user_dict(row),
+        ensure_ascii=False,
+        escape_forward_slashes=False,
+    ).encode("utf-8")
+
+
+def to_microseconds(value: datetime) -> int:
+    return (value - EPOCH) // MICROSECOND
+
+
+def get_user_etag(user_id: Union[UUID, str], modified_at: datetime) -> str:
+    """
+    Strong entity tag of a user, which changes with every update as
+    ``modified_at`` does.
+    """
+    # the same user can be requested with differently formatted ids
+    user_id = UUID(str(user_id))
+    digest: str = blake2b(
+        b"%s:%d" % (user_id.bytes, to_microseconds(modified_at)),
+        digest_size=16,
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def get_users_etag(rows: Iterable[Dict]) -> str:
+    """
+    Strong entity tag of a list of users, out of their ids and
+    ``modified_at``, so that users being updated, or leaving or joining the
+    list, all change it.
+    """
+    digest = blake2b(digest_size=16)
+
+    for row in rows:
+        digest.update(
+            b"%s:%d,"
+            % (
+                str(row["id"]).encode("ascii"),
+                to_microseconds(row["modified_at"]),
+            )
+        )
 
+    return f'"{digest.hexdigest()}"'
 
-def download_image_from_url(url: str, user_id: str) -> str:
-    mime_type: str
-    file_data: bytes = bytes("", encoding="utf-8")
 
-    try:
-        with http_get(url, allow_redirects=True, stream=True) as res:
-            res.raise_for_status()
-            mime_type = res.headers.get("content-type").lower()
-            if mime_type not in [
-                "image/jpeg",
-                "image/png",
-                "image/webp",
-            ]:
-                raise ValueError(
-                    'Invalid mime type, only accepting: "ima'
-                    'ge/jpeg", "image/png" or "image/webp"'
-                )
-            for chunk in res.iter_content(chunk_size=8192):
-                file_data += chunk
-    except Exception:
-        raise ValueError(
-            f'Error occurred trying to read "{url}". STATUS CODE: '
-            f"{res.status_code}"
+def format_http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def parse_entity_tags(header: str) -> List[str]:
+    return ENTITY_TAG.findall(header)
+
+
+def is_not_modified(
+    headers: Mapping[str, str], etag: str, modified_at: datetime
+) -> bool:
+    """
+    Evaluates ``If-None-Match``, or ``If-Modified-Since`` when it is absent,
+    as RFC 7232 has it for GET requests.
+    """
+    if_none_match: Optional[str] = headers.get("if-none-match")
+
+    if if_none_match is not None:
+        # weak comparison
+        return any(
+            tag in ("*", etag, f"W/{etag}")
+            for tag in parse_entity_tags(if_none_match)
         )
 
-    extension: Optional[str] = guess_extension(mime_type)
+    if_modified_since: Optional[str] = headers.get("if-modified-since")
 
-    if not mime_type.startswith("image") or not extension:
-        raise ValueError(
-            f"The thumbnail_url should represent a file with a "
-            f"valid image mime type. But we detected {mime_type}."
+    if if_modified_since is not None:
+        try:
+            since: datetime = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+        # http dates have a precision of one second
+        return since.tzinfo is not None and (
+            modified_at.replace(microsecond=0) <= since
         )
 
-    img: Image.Image = Image.open(BytesIO(file_data))
+    return False
 
-    uploads_folder: Path = settings.UPLOAD_FOLDER.joinpath(
-        "profile_images", get_utc_now().date().isoformat()
-    )
 
-    if not uploads_folder.is_dir():
-        uploads_folder.mkdir(parents=True, exist_ok=True)
+def matches_entity_tag(if_match: str, etag: str) -> bool:
+    # strong comparison, weak tags never match
+    return any(tag in ("*", etag) for tag in parse_entity_tags(if_match))
 
-    resulting_image_path: Path = uploads_folder.joinpath(
-        f"{user_id}{extension}"
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return get_password_context(settings.BCRYPT_ROUNDS).verify(
+        plain_password, hashed_password
     )
-    image_absolute_path: str = str(resulting_image_path.absolute())
-
-    if mime_type == "image/jpeg":
-        img.save(
-            image_absolute_path,
-            "JPEG",
-            quality=85,
-            progressive=True,
-            optimize=True,
-        )
-    else:
-        if mime_type == "image/webp":
-            img = img.convert("RGB")
 
-        img.save(image_absolute_path, "PNG")
 
-    return image_absolute_path.split("uploads/profile_images/")[-1]
+def get_password_hash(password: str) -> str:
+    started_at: float = perf_counter()
+    hashed_password: str = get_password_context(settings.BCRYPT_ROUNDS).hash(
+        password
+    )
+    hashing_duration_seconds.observe(perf_counter() - started_at)
+    return hashed_password
 
 
-def process_user_upsert_info(
+async def process_user_upsert_info(
     upsert_user: Union[CreateUser, UpdateUser],
-    user: Optional[User] = None,
+    defer_image_processing: bool = False,
 ) -> Dict:
     user_info: Dict = upsert_user.dict(exclude_unset=True, exclude_none=True)
 
     if user_info.get("password"):
-        user_info["password"] = get_password_hash(
+        user_info["password"] = await password_hasher.hash(
             upsert_user.password.get_secret_value()
         )
 
-    if isinstance(upsert_user, CreateUser):
-        # Doing this here because I want the created image to have the same
-        #  id as the user
-        user_info["id"] = uuid4()
-
     if user_info.get("profile_image"):
-        if user:
-            cleanup_current_profile_picture(sub_path=user.profile_image)
-
-        user_info["profile_image"] = download_image_from_url(
-            url=user_info.get("profile_image"),
-            user_id=getattr(user, "id", None) or user_info.get("id"),
-        )
+        if defer_image_processing:
+            # the url is kept as the profile image until a worker replaces it
+            profile_image_ingestor.ensure_capacity()
+            user_info["profile_image_status"] = ProfileImageStatus.PENDING
+        else:
+            user_info[
+                "profile_image"
+            ] = await profile_image_ingestor.download_image_from_url(
+                url=user_info.get("profile_image")
+            )
+            user_info["profile_image_status"] = ProfileImageStatus.READY
 
     return user_info
-
-
-def cleanup_current_profile_picture(sub_path: str):
-    uploads_folder: Path = settings.UPLOAD_FOLDER.joinpath("profile_images")
-    sub_folder, image_name = sub_path.split("/")
-    date_subfolder: Path = uploads_folder.joinpath(sub_folder)
-    existing_image_path: Path = date_subfolder.joinpath(image_name)
-
-    if existing_image_path.is_file():
-        existing_image_path.unlink()
-
-    # if folder is empty after deleting file, delete folder
-    if sum(1 for item in uploads_folder.joinpath(sub_folder).iterdir()) == 0:
-        date_subfolder.rmdir()
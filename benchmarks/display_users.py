@@ -0,0 +1,80 @@
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from json import dumps
+from timeit import repeat
+from typing import Dict, List
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from tortoise import Tortoise
+
+from app.db.models import ProfileImageStatus, User
+from app.schemas import DisplayUser
+from app.utils import render_display_users
+
+
+def build_rows(count: int) -> List[Dict]:
+    created_at: datetime = datetime.now(tz=timezone.utc)
+    return [
+        {
+            "id": uuid4(),
+            "username": f"user-{index}",
+            "first_name": "Ana",
+            "last_name": "Silva",
+            "profile_image": f"2021/07/21/{uuid4()}.jpg",
+            "profile_image_status": ProfileImageStatus.READY,
+            "created_at": created_at + timedelta(seconds=index),
+            "modified_at": created_at + timedelta(seconds=index),
+        }
+        for index in range(count)
+    ]
+
+
+def render_through_models(rows: List[Dict]) -> bytes:
+    users: List[User] = [
+        User(**row, password="", deleted_at=None) for row in rows
+    ]
+    return dumps(
+        jsonable_encoder(
+            [DisplayUser.from_orm(user) for user in users], by_alias=True
+        ),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Compares rendering a page of users through model instances and "
+            "the DisplayUser schema, as list_users used to, with rendering "
+            "the .values() rows straight to bytes. Only the work done after "
+            "the rows come back from the database is measured."
+        )
+    )
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # binds the models' fields without needing a database connection
+    Tortoise.init_models(["app.db.models"], "models")
+    rows: List[Dict] = build_rows(args.rows)
+    assert render_through_models(rows) == render_display_users(rows)
+
+    for name, render in (
+        ("model", render_through_models),
+        ("rows", render_display_users),
+    ):
+        best: float = min(
+            repeat(lambda: render(rows), number=1, repeat=args.repeat)
+        )
+        print(
+            f"{name:>6}: {best * 1000:8.2f} ms per {args.rows} users, "
+            f"{best / args.rows * 1e6:6.2f} us per user"
+        )
+
+
+if __name__ == "__main__":
+    main()
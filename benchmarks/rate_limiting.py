@@ -0,0 +1,84 @@
+from argparse import ArgumentParser
+from asyncio import new_event_loop
+from time import perf_counter
+from typing import Dict
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.middleware import RateLimitMiddleware
+from app.services.ratelimit import (
+    AdmissionControl,
+    MemoryRateLimitBackend,
+    RateLimit,
+    RateLimiter,
+)
+
+
+async def endpoint(scope: Scope, receive: Receive, send: Send):
+    pass
+
+
+async def receive() -> Message:
+    return {"type": "http.request"}
+
+
+async def send(message: Message):
+    pass
+
+
+async def measure(app: ASGIApp, method: str, clients: int, requests: int):
+    scopes = [
+        {"type": "http", "method": method, "client": (f"10.0.0.{i}", 1234)}
+        for i in range(clients)
+    ]
+    started_at: float = perf_counter()
+
+    for index in range(requests):
+        await app(scopes[index % clients], receive, send)
+
+    return perf_counter() - started_at
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Measures what the rate limiting middleware, with the in memory "
+            "backend, adds to each request, calling it directly with an "
+            "endpoint doing nothing. Limits are high enough for no request "
+            "to be rejected."
+        )
+    )
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--clients", type=int, default=1000)
+    args = parser.parse_args()
+
+    limit = RateLimit(rate=1e9, burst=10**9)
+    middleware = RateLimitMiddleware(
+        endpoint,
+        limiter=RateLimiter(
+            backend=MemoryRateLimitBackend(max_size=args.clients),
+            limits={"read": limit, "write": limit},
+        ),
+        admission=AdmissionControl(max_concurrency=1, retry_after=1),
+    )
+    loop = new_event_loop()
+    baseline: float = loop.run_until_complete(
+        measure(endpoint, "GET", args.clients, args.requests)
+    )
+    results: Dict[str, float] = {
+        method: loop.run_until_complete(
+            measure(middleware, method, args.clients, args.requests)
+        )
+        for method in ("GET", "POST")
+    }
+    loop.close()
+
+    for method, elapsed in results.items():
+        print(
+            f"{method:>5}: {(elapsed - baseline) / args.requests * 1e6:6.2f} "
+            "us added per request"
+        )
+
+
+if __name__ == "__main__":
+    main()
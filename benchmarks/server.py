@@ -0,0 +1,72 @@
+from argparse import ArgumentParser
+
+import uvicorn
+from httpx import URL, AsyncHTTPTransport, Request, Response
+
+from app.main import app
+from app.server import Server, get_options
+from app.services import profile_image_ingestor
+
+
+class StubImageTransport(AsyncHTTPTransport):
+    """
+    Sends every profile image download to the local stub server at
+    ``base_url``, whatever the host of the image url, as users can only be
+    created with https image urls.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = URL(base_url)
+
+    async def handle_async_request(self, request: Request) -> Response:
+        request.url = request.url.copy_with(
+            scheme=self.base_url.scheme,
+            host=self.base_url.host,
+            port=self.base_url.port,
+        )
+        return await super().handle_async_request(request)
+
+
+def use_stub_image_server(base_url: str):
+    profile_image_ingestor.transport = StubImageTransport(base_url)
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Serves the app with a single uvicorn process, or with the "
+            "production server, downloading profile images from the given "
+            "stub server. Started by the endpoints benchmark."
+        )
+    )
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--image-server-url", required=True)
+    parser.add_argument(
+        "--runner", choices=("uvicorn", "gunicorn"), default="uvicorn"
+    )
+    parser.add_argument(
+        "--workers", type=int, help="gunicorn workers, defaults to sizing"
+    )
+    args = parser.parse_args()
+
+    # before the production server forks its workers, which inherit it
+    use_stub_image_server(args.image_server_url)
+
+    if args.runner == "gunicorn":
+        options = get_options(workers=args.workers)
+        options.update(bind=f"127.0.0.1:{args.port}", loglevel="warning")
+        Server(options).run()
+        return
+
+    uvicorn.run(
+        app,
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning",
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from statistics import median
+from typing import Dict, List, Tuple
+
+
+def measure_imports(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Self and cumulative import times, in microseconds, of every module
+    imported by a fresh interpreter importing ``module``.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    times: Dict[str, Tuple[int, int]] = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_time, cumulative_time, name = line[len("import time:") :].split(
+            "|"
+        )
+        times[name.strip()] = (int(self_time), int(cumulative_time))
+
+    return times
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Reports how long a fresh worker takes to import the app, per "
+            "module, as the median of several interpreters started one "
+            "after the other. Cumulative times include the modules a "
+            "module imports, self times do not."
+        )
+    )
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument(
+        "--sort",
+        choices=("cumulative", "self"),
+        default="cumulative",
+    )
+    args = parser.parse_args()
+
+    samples: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    for _ in range(args.repeat):
+        for name, times in measure_imports(args.module).items():
+            samples[name].append(times)
+
+    medians: Dict[str, Tuple[float, float]] = {
+        name: (
+            median(self_time for self_time, _ in times),
+            median(cumulative_time for _, cumulative_time in times),
+        )
+        for name, times in samples.items()
+    }
+    column: int = 1 if args.sort == "cumulative" else 0
+
+    print(f"{'self ms':>9} {'cumul. ms':>9}  module")
+    for name, (self_time, cumulative_time) in sorted(
+        medians.items(), key=lambda item: item[1][column], reverse=True
+    )[: args.top]:
+        print(f"{self_time / 1000:9.2f} {cumulative_time / 1000:9.2f}  {name}")
+
+    print(
+        f"\n{len(medians)} modules, "
+        f"{medians[args.module][1] / 1000:.2f} ms to import {args.module}"
+    )
+
+    for name in ("PIL", "httpx", "passlib", "bcrypt"):
+        if name in medians:
+            print(f"{name} is imported on boot")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+from argparse import ArgumentParser
+from asyncio import gather, run
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List
+from uuid import UUID
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from app.db import PRIMARY_CONNECTION
+from app.db.models import User, UserChangeType
+from app.db.queries import record_user_changes, update_user_columns
+from benchmarks.users_endpoints import (
+    USERNAME_PREFIX,
+    database,
+    delete_benchmark_users,
+    seed_users,
+)
+
+
+Update = Callable[[UUID, Dict], Awaitable[None]]
+
+
+async def update_through_models(user_id: UUID, columns: Dict):
+    # the path updates took before: a select, then a save of every column,
+    #  changed or not, in a transaction of its own
+    async with in_transaction(PRIMARY_CONNECTION) as connection:
+        user: User = (
+            await User.filter(id=user_id, deleted_at__isnull=True)
+            .using_db(connection)
+            .get()
+        )
+        user.update_from_dict(columns)
+        await user.save(using_db=connection)
+        await record_user_changes(
+            UserChangeType.UPDATED, [user.id], connection
+        )
+
+
+async def update_in_a_statement(user_id: UUID, columns: Dict):
+    await update_user_columns(user_id, columns, event=UserChangeType.UPDATED)
+
+
+async def measure(
+    update: Update,
+    user_ids: List[UUID],
+    build_columns: Callable[[int], Dict],
+    concurrency: int,
+    updates: int,
+) -> float:
+    async def worker(offset: int):
+        for index in range(offset, updates, concurrency):
+            await update(user_ids[index % len(user_ids)], build_columns(index))
+
+    started_at: float = perf_counter()
+    await gather(*(worker(offset) for offset in range(concurrency)))
+    return perf_counter() - started_at
+
+
+async def benchmark(users: int, concurrency: int, updates: int, seed: int):
+    async with database():
+        await delete_benchmark_users()
+        await seed_users(users, seed)
+
+        try:
+            user_ids: List[UUID] = await Tortoise.get_connection(
+                PRIMARY_CONNECTION
+            ).execute_query_dict(
+                'SELECT id FROM "user" WHERE username LIKE $1',
+                [f"{USERNAME_PREFIX}%"],
+            )
+            user_ids = [row["id"] for row in user_ids]
+            scenarios: Dict[str, Callable[[int], Dict]] = {
+                "changed": lambda index: {"first_name": f"Changed {index}"},
+                # what the clients sending the whole user on every update do
+                "unchanged": lambda index: {"first_name": "Unchanged"},
+            }
+            paths: Dict[str, Update] = {
+                "models": update_through_models,
+                "statement": update_in_a_statement,
+            }
+
+            for scenario, build_columns in scenarios.items():
+                for path, update in paths.items():
+                    elapsed: float = await measure(
+                        update, user_ids, build_columns, concurrency, updates
+                    )
+                    print(
+                        f"{scenario:>9} {path:>9}: "
+                        f"{updates / elapsed:8.0f} updates/s"
+                    )
+        finally:
+            await delete_benchmark_users()
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Compares updating users through the models, as updates used to, "
+            "with the single statement update, under concurrent updates, "
+            "with and without anything to change. Needs the database of "
+            "the configured environment."
+        )
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run(benchmark(args.users, args.concurrency, args.updates, args.seed))
+
+
+if __name__ == "__main__":
+    main()
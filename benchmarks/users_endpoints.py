@@ -0,0 +1,600 @@
+from argparse import ArgumentParser
+from asyncio import gather, run, sleep
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from json import dumps, loads
+from math import ceil
+from pathlib import Path
+from platform import python_version
+from secrets import token_hex
+from socket import socket
+from subprocess import DEVNULL, CalledProcessError, Popen, check_output
+from sys import executable
+from time import perf_counter
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from uuid import uuid4
+
+from faker import Faker
+from httpx import AsyncClient, HTTPError, Limits, Timeout
+from tortoise import Tortoise
+
+from app.config import settings
+from app.db import PRIMARY_CONNECTION, TORTOISE_ORM
+from app.db.queries import bulk_insert_users
+from app.main import app
+from app.services import profile_image_ingestor
+from app.tests.stub_server import StubImageServer
+from app.utils import encode_cursor, get_password_hash
+from benchmarks.server import use_stub_image_server
+
+
+# every user the benchmark creates has a username starting with this, which
+#  is how they are found again to be cleaned up
+USERNAME_PREFIX: str = "bench-"
+SEED_BATCH_SIZE: int = 10_000
+SEEDED_PROFILE_IMAGE: str = "2021/07/21/benchmark.jpg"
+# the image host does not matter, every download goes to the stub server
+IMAGE_URL: str = "https://images.benchmark/image.jpg"
+IDS_PER_BATCH_FETCH: int = 50
+
+USERS_URL: str = f"{settings.API_PREFIX}/users"
+
+Request = Tuple[str, str, Dict]
+
+
+class Scenario(NamedTuple):
+    name: str
+    expected_status: int
+    build_request: Callable[[int], Request]
+    # caps the requests of the scenarios that are much slower than the others
+    max_requests: Optional[int] = None
+
+
+def build_scenarios(
+    sample: List[Dict], stream_requests: int
+) -> List[Scenario]:
+    """
+    One scenario per route of ``app/api/endpoints/users.py``, the ones
+    changing the data last. Half of the sampled users are read and updated,
+    the other half deleted, one request each.
+    """
+    half: int = len(sample) // 2
+    read_users: List[Dict] = sample[:half]
+    deleted_users: List[Dict] = sample[half:]
+
+    def read_user(index: int) -> Dict:
+        return read_users[index % len(read_users)]
+
+    def cursor(index: int) -> str:
+        user: Dict = read_user(index)
+        return encode_cursor(user["created_at"], user["id"])
+
+    def ids(index: int) -> str:
+        return ",".join(
+            str(read_user(index * IDS_PER_BATCH_FETCH + offset)["id"])
+            for offset in range(IDS_PER_BATCH_FETCH)
+        )
+
+    return [
+        Scenario(
+            "list_users_first_page",
+            200,
+            lambda index: ("GET", USERS_URL, {}),
+        ),
+        Scenario(
+            "list_users_after_cursor",
+            200,
+            lambda index: (
+                "GET",
+                USERS_URL,
+                {"params": {"cursor": cursor(index)}},
+            ),
+        ),
+        Scenario(
+            "list_users_stream",
+            200,
+            lambda index: (
+                "GET",
+                USERS_URL,
+                {"params": {"cursor": cursor(index), "stream": True}},
+            ),
+            max_requests=stream_requests,
+        ),
+        Scenario(
+            "get_users_by_ids",
+            200,
+            lambda index: ("GET", USERS_URL, {"params": {"ids": ids(index)}}),
+        ),
+        Scenario(
+            "get_user",
+            200,
+            lambda index: ("GET", f"{USERS_URL}/{read_user(index)['id']}", {}),
+        ),
+        Scenario(
+            "create_user",
+            201,
+            lambda index: (
+                "POST",
+                USERS_URL,
+                {
+                    "json": {
+                        "username": f"{USERNAME_PREFIX}{token_hex(8)}",
+                        "firstName": "Bench",
+                        "lastName": "Mark",
+                        "password": "benchmark",
+                        "profileImage": IMAGE_URL,
+                    }
+                },
+            ),
+        ),
+        Scenario(
+            "update_user",
+            200,
+            lambda index: (
+                "PUT",
+                f"{USERS_URL}/{read_user(index)['id']}",
+                {"json": {"firstName": f"Bench {index}"}},
+            ),
+        ),
+        Scenario(
+            "delete_user",
+            204,
+            lambda index: (
+                "DELETE",
+                f"{USERS_URL}/{deleted_users[index]['id']}",
+                {},
+            ),
+            max_requests=len(deleted_users),
+        ),
+    ]
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    # nearest rank
+    rank: int = max(ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    latencies = sorted(latencies)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run_scenario(
+    client: AsyncClient, scenario: Scenario, requests: int, concurrency: int
+) -> Dict:
+    latencies: List[float] = []
+    errors: int = 0
+    # shared by the workers, so that each request is sent exactly once
+    indexes: Iterator[int] = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+
+        for index in indexes:
+            method, url, kwargs = scenario.build_request(index)
+            started_at: float = perf_counter()
+
+            try:
+                response = await client.request(method, url, **kwargs)
+            except HTTPError:
+                errors += 1
+                continue
+            finally:
+                latencies.append(perf_counter() - started_at)
+
+            if response.status_code != scenario.expected_status:
+                errors += 1
+
+    started_at: float = perf_counter()
+    await gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, perf_counter() - started_at)
+
+
+async def run_scenarios(
+    client: AsyncClient,
+    scenarios: List[Scenario],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+
+    for scenario in scenarios:
+        scenario_requests: int = (
+            requests
+            if scenario.max_requests is None
+            else min(requests, scenario.max_requests)
+        )
+        if not scenario_requests:
+            continue
+
+        # only the reads are warmed up, to leave the data as it is
+        if warmup and scenario.build_request(0)[0] == "GET":
+            await run_scenario(
+                client, scenario, min(warmup, scenario_requests), concurrency
+            )
+
+        results[scenario.name] = await run_scenario(
+            client, scenario, scenario_requests, concurrency
+        )
+        print_result(scenario.name, results[scenario.name])
+
+    return results
+
+
+def print_result(name: str, result: Dict):
+    print(
+        f"{name:>24}: {result['throughput']:9.1f} req/s  "
+        f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+        f"p99 {result['p99_ms']:8.2f} ms  "
+        f"{result['errors']} errors / {result['requests']}"
+    )
+
+
+@asynccontextmanager
+async def database() -> AsyncIterator[None]:
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        yield
+    finally:
+        await Tortoise.close_connections()
+
+
+async def seed_users(count: int, seed: int):
+    Faker.seed(seed)
+    faker: Faker = Faker()
+    # hashing a million passwords would take days, they all share one
+    password: str = get_password_hash("benchmark")
+
+    for start in range(0, count, SEED_BATCH_SIZE):
+        await bulk_insert_users(
+            [
+                {
+                    "id": uuid4(),
+                    "username": f"{USERNAME_PREFIX}{index}",
+                    "first_name": faker.first_name()[:30],
+                    "last_name": faker.last_name()[:60],
+                    "password": password,
+                    "profile_image": SEEDED_PROFILE_IMAGE,
+                    "profile_image_status": "ready",
+                }
+                for index in range(start, min(start + SEED_BATCH_SIZE, count))
+            ]
+        )
+        print(f"Seeded {min(start + SEED_BATCH_SIZE, count)}/{count} users")
+
+
+async def sample_users(count: int) -> List[Dict]:
+    return await Tortoise.get_connection(
+        PRIMARY_CONNECTION
+    ).execute_query_dict(
+        """
+        SELECT id, created_at FROM "user"
+        WHERE username LIKE $1 AND deleted_at IS NULL
+        ORDER BY random() LIMIT $2
+        """,
+        [f"{USERNAME_PREFIX}%", count],
+    )
+
+
+async def delete_benchmark_users():
+    connection = Tortoise.get_connection(PRIMARY_CONNECTION)
+    rows: List[Dict] = await connection.execute_query_dict(
+        """
+        SELECT profile_image FROM "user"
+        WHERE username LIKE $1 AND profile_image <> $2
+            AND profile_image_status = 'ready'
+        """,
+        [f"{USERNAME_PREFIX}%", SEEDED_PROFILE_IMAGE],
+    )
+
+    for row in rows:
+        await profile_image_ingestor.release(row["profile_image"])
+
+    await connection.execute_query(
+        'DELETE FROM "user" WHERE username LIKE $1', [f"{USERNAME_PREFIX}%"]
+    )
+
+
+@asynccontextmanager
+async def serve_asgi(
+    image_server_url: str, concurrency: int
+) -> AsyncIterator[AsyncClient]:
+    use_stub_image_server(image_server_url)
+    await app.router.startup()
+
+    try:
+        async with AsyncClient(
+            app=app, base_url="http://benchmark", timeout=Timeout(None)
+        ) as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+
+
+def get_free_port() -> int:
+    with socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def serve(
+    image_server_url: str, concurrency: int, runner: str
+) -> AsyncIterator[AsyncClient]:
+    port: int = get_free_port()
+    process: Popen = Popen(
+        [
+            executable,
+            "-m",
+            "benchmarks.server",
+            "--port",
+            str(port),
+            "--image-server-url",
+            image_server_url,
+            "--runner",
+            runner,
+        ]
+    )
+
+    try:
+        async with AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            timeout=Timeout(None),
+            limits=Limits(max_connections=concurrency),
+        ) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("The server exited while starting.")
+
+                try:
+                    await client.get("/")
+                    break
+                except HTTPError:
+                    await sleep(0.1)
+
+            yield client
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def serve_uvicorn(
+    image_server_url: str, concurrency: int
+) -> AsyncContextManager[AsyncClient]:
+    return serve(image_server_url, concurrency, runner="uvicorn")
+
+
+def serve_gunicorn(
+    image_server_url: str, concurrency: int
+) -> AsyncContextManager[AsyncClient]:
+    # the production server, app.server, with its default worker count
+    return serve(image_server_url, concurrency, runner="gunicorn")
+
+
+TRANSPORTS = {
+    "asgi": serve_asgi,
+    "uvicorn": serve_uvicorn,
+    "gunicorn": serve_gunicorn,
+}
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, Dict]],
+    baseline: Dict[str, Dict[str, Dict]],
+    threshold: float,
+) -> List[str]:
+    """
+    Lists the scenarios whose throughput dropped, or whose p95 latency grew,
+    by more than ``threshold`` (a ratio) compared to the baseline run.
+    """
+    regressions: List[str] = []
+
+    for transport, scenarios in results.items():
+        for name, result in scenarios.items():
+            previous: Optional[Dict] = baseline.get(transport, {}).get(name)
+            if previous is None:
+                continue
+
+            if result["throughput"] < previous["throughput"] * (1 - threshold):
+                regressions.append(
+                    f"{transport} {name}: throughput went from "
+                    f"{previous['throughput']:.1f} to "
+                    f"{result['throughput']:.1f} req/s"
+                )
+
+            if result["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{transport} {name}: p95 latency went from "
+                    f"{previous['p95_ms']:.2f} to {result['p95_ms']:.2f} ms"
+                )
+
+    return regressions
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return (
+            check_output(["git", "rev-parse", "HEAD"], stderr=DEVNULL)
+            .decode("ascii")
+            .strip()
+        )
+    except (CalledProcessError, OSError):
+        return None
+
+
+async def benchmark(args) -> Dict[str, Dict[str, Dict]]:
+    if not args.skip_seed:
+        async with database():
+            await delete_benchmark_users()
+            await seed_users(args.users, seed=args.seed)
+
+    results: Dict[str, Dict[str, Dict]] = {}
+
+    with StubImageServer() as image_server:
+        for transport in args.transports:
+            # sampled again for each transport, as the previous one deleted
+            #  some of the users
+            async with database():
+                sample: List[Dict] = await sample_users(args.requests * 2)
+
+            print(f"Benchmarking through {transport}")
+            async with TRANSPORTS[transport](
+                image_server.url("/image.jpg"), args.concurrency
+            ) as client:
+                results[transport] = await run_scenarios(
+                    client,
+                    [
+                        scenario
+                        for scenario in build_scenarios(
+                            sample, args.stream_requests
+                        )
+                        if not args.scenarios
+                        or scenario.name in args.scenarios
+                    ],
+                    requests=args.requests,
+                    concurrency=args.concurrency,
+                    warmup=args.warmup,
+                )
+
+    if not args.keep_users:
+        async with database():
+            await delete_benchmark_users()
+
+    return results
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Load tests every users endpoint against a database seeded with "
+            "fake users, in process through the ASGI app and/or through a "
+            "single uvicorn process or the production gunicorn server, and "
+            "reports their throughput and latency percentiles. To compare "
+            "the servers on user lookups: --transports uvicorn gunicorn "
+            "--scenarios get_user. Profile images are downloaded from a "
+            "local stub server. The seeded users are deleted at the end, so "
+            "do not point it at a database holding users named bench-*."
+        )
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=10_000,
+        help="users to seed, typically 10000, 100000 or 1000000",
+    )
+    parser.add_argument(
+        "--transports",
+        nargs="+",
+        choices=list(TRANSPORTS),
+        default=["asgi"],
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--requests", type=int, default=1000, help="per scenario"
+    )
+    parser.add_argument(
+        "--stream-requests",
+        type=int,
+        default=20,
+        help="for the streaming scenario, each streaming many users",
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=50, help="requests, per read scenario"
+    )
+    parser.add_argument("--scenarios", nargs="+", help="defaults to all")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--skip-seed",
+        action="store_true",
+        help="reuses the users seeded, and kept, by a previous run",
+    )
+    parser.add_argument("--keep-users", action="store_true")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help=(
+            "defaults to benchmarks/results/users_endpoints-<users>-"
+            "<timestamp>.json"
+        ),
+    )
+    parser.add_argument(
+        "--baseline", type=Path, help="results of a previous run to compare"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help=(
+            "fails when a throughput drops, or a p95 latency grows, by more "
+            "than this ratio compared to the baseline"
+        ),
+    )
+    args = parser.parse_args()
+
+    started_at: datetime = datetime.now(tz=timezone.utc)
+    results: Dict[str, Dict[str, Dict]] = run(benchmark(args))
+
+    output: Path = args.output or Path(__file__).parent.joinpath(
+        "results",
+        f"users_endpoints-{args.users}-{started_at:%Y%m%dT%H%M%S}.json",
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        dumps(
+            {
+                "meta": {
+                    "started_at": started_at.isoformat(),
+                    "commit": get_commit(),
+                    "python": python_version(),
+                    "users": args.users,
+                    "concurrency": args.concurrency,
+                    "requests": args.requests,
+                },
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        baseline: Dict = loads(args.baseline.read_text())
+        if baseline["meta"]["users"] != args.users:
+            print(
+                f"Warning: the baseline was seeded with "
+                f"{baseline['meta']['users']} users, not {args.users}"
+            )
+
+        regressions: List[str] = find_regressions(
+            results, baseline["results"], args.threshold
+        )
+        for regression in regressions:
+            print(f"Regression: {regression}")
+
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()